@@ -0,0 +1,410 @@
+"""
+Đo hiệu năng phần xử lý Excel trên file KPI giả lập (cùng bố cục báo cáo RPT_KPI_STAFF)
+- Sinh file mẫu: 5 dòng tiêu đề (merge, style), cột A -> S và các cột thêm, từ khóa cột K
+  ("TMDT...", "NPP Bán"...), mã nhân viên cột J, cột Q số/rỗng, dòng nhóm merge trong vùng dữ liệu
+- Mỗi phép đo chạy trong một process riêng: thời gian (nhỏ nhất sau nhiều lần chạy) và bộ nhớ Python
+  tối đa (tracemalloc) của process_single_excel (từng writer), hide_unwanted_columns,
+  optimize_columns_i_k, create_summary_workbook
+- Kết quả ghi ra output/benchmark/benchmark_YYYYMMDD_HHMMSS.json, so với baseline đã lưu
+  để phát hiện chậm đi / tốn bộ nhớ hơn
+
+    python benchmark.py                          # 1k, 10k, 100k dòng, so với baseline nếu có
+    python benchmark.py --rows 1k 1m --cases process_single_excel process_single_excel[stream]
+    python benchmark.py --save-baseline          # lưu kết quả lần này làm baseline
+"""
+
+import io
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import multiprocessing
+from time import perf_counter
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
+from pathlib import Path
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+BASE_PATH = Path(__file__).parent
+BENCHMARK_DIR = BASE_PATH / "output" / "benchmark"
+DEFAULT_ROWS = [1000, 10000, 100000]
+DEFAULT_TOLERANCE = 0.25
+MIN_SECONDS = 0.05      # Thời gian nhỏ hơn mức này coi là nhiễu khi so baseline
+MIN_PEAK_MB = 1.0
+SUMMARY_SHEETS = 3      # Số file ghép vào Kết quả.xlsx khi đo create_summary_workbook
+GENERATOR_VERSION = 1   # Tăng khi đổi cách sinh file mẫu (file mẫu đã sinh được tạo lại)
+
+HEADER_ROWS = 5
+EXTRA_COLUMNS = 4       # Cột sau S (T, U...) - bị ẩn theo rule "S:"
+COLUMN_TITLES = [
+    "STT", "Mã NPP", "Tên NPP", "Mã tuyến", "Khu vực", "Tỉnh/TP", "Số KH", "Mã NV", "Tên nhân viên",
+    "Mã NV NPP", "Kênh bán", "Doanh số", "Sản lượng", "Số đơn", "Số SKU", "Độ phủ", "Đơn chưa duyệt",
+    "Tỷ lệ", "Ghi chú",
+]
+K_VALUES = [
+    ("NPP Bán", 8), ("NPP tự bán", 4), ("TT Bán", 4), ("TMDT Lazada", 2), ("TMDT Sendo", 1),
+    ("TMDT Tiki", 1), ("TMDT Shopee", 1), ("Bán lẻ", 30), ("Bán buôn", 20), ("Siêu thị", 10),
+    ("Kênh nhà thuốc - khu vực miền Tây Nam Bộ", 5), ("Cửa hàng tiện lợi", 10),
+]
+LAST_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ"]
+MIDDLE_NAMES = ["Văn", "Thị", "Hữu", "Minh", "Ngọc", "Thanh", "Đức", "Quốc", "Thị Thu", "Hoàng"]
+FIRST_NAMES = ["An", "Bình", "Cường", "Dũng", "Giang", "Hà", "Hải", "Hương", "Khánh", "Linh", "Long",
+               "Mai", "Nam", "Phương", "Quân", "Sơn", "Thảo", "Trang", "Tuấn", "Yến"]
+REGIONS = ["Miền Bắc", "Miền Trung", "Miền Nam", "Tây Nguyên", "Đồng bằng sông Cửu Long"]
+PROVINCES = ["Hà Nội", "Hải Phòng", "Đà Nẵng", "Huế", "TP. Hồ Chí Minh", "Cần Thơ", "Đắk Lắk", "Bình Dương"]
+
+
+def parse_row_count(text):
+    """
+    "1000", "10k", "1m" -> số dòng
+    """
+    text = str(text).strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def generate_kpi_workbook(path, rows, extra_columns=EXTRA_COLUMNS, seed=0):
+    """
+    Sinh file KPI giả lập có `rows` dòng dữ liệu (từ dòng 6), ghi bằng write-only workbook
+    nên sinh được cả file 1 triệu dòng
+    """
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    col_count = len(COLUMN_TITLES) + extra_columns
+
+    thin = Side(style='thin', color="999999")
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    title_font = Font(bold=True, size=14, color="1F4E78")
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill("solid", fgColor="1F4E78")
+    group_fill = PatternFill("solid", fgColor="DDEBF7")
+    center = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    wrap = Alignment(vertical='top', wrap_text=True)
+
+    ws.column_dimensions['A'].width = 6
+    ws.column_dimensions['I'].width = 18
+    ws.column_dimensions['K'].width = 14
+    ws.freeze_panes = "C6"
+
+    def styled(value, font=None, fill=None, alignment=None, number_format=None, cell_border=None):
+        cell = WriteOnlyCell(ws, value)
+        if font:
+            cell.font = font
+        if fill:
+            cell.fill = fill
+        if alignment:
+            cell.alignment = alignment
+        if number_format:
+            cell.number_format = number_format
+        if cell_border:
+            cell.border = cell_border
+        return cell
+
+    # Dòng 1 -> 5: tiêu đề báo cáo, kỳ báo cáo, nhóm cột, tên cột
+    last_letter = get_column_letter(col_count)
+    ws.append([styled("BÁO CÁO KPI NHÂN VIÊN (RPT_KPI_STAFF)", font=title_font, alignment=center)])
+    ws.append([styled(f"Kỳ báo cáo: {date.today():%m/%Y}", alignment=center)])
+    ws.append(["Đơn vị tính: VNĐ"])
+    ws.append([styled("Thông tin nhà phân phối", header_font, header_fill, center, cell_border=border)]
+              + [styled(None, fill=header_fill, cell_border=border)] * 5
+              + [styled("Kết quả thực hiện", header_font, header_fill, center, cell_border=border)]
+              + [styled(None, fill=header_fill, cell_border=border)] * (col_count - 7))
+    titles = COLUMN_TITLES + [f"Chỉ tiêu {idx + 1}" for idx in range(extra_columns)]
+    ws.append([styled(title, header_font, header_fill, center, cell_border=border) for title in titles])
+    for ref in (f"A1:{last_letter}1", f"A2:{last_letter}2", "A4:F4", f"G4:{last_letter}4"):
+        ws.merged_cells.add(ref)
+
+    k_values = [value for value, weight in K_VALUES for _ in range(weight)]
+    names = [f"{rnd.choice(LAST_NAMES)} {rnd.choice(MIDDLE_NAMES)} {rnd.choice(FIRST_NAMES)}" for _ in range(500)]
+    stt = 0
+    for row_num in range(HEADER_ROWS + 1, HEADER_ROWS + rows + 1):
+        if rnd.random() < 0.002:
+            # Dòng nhóm theo khu vực: merge A:F, tô nền
+            ws.append([styled(f"Khu vực: {rnd.choice(REGIONS)}", Font(bold=True), group_fill)]
+                      + [styled(None, fill=group_fill)] * 5)
+            ws.merged_cells.add(f"A{row_num}:F{row_num}")
+            continue
+        stt += 1
+        q_roll = rnd.random()
+        q_value = None if q_roll < 0.4 else (0 if q_roll < 0.6 else rnd.randint(1, 20))
+        row = [
+            stt if rnd.random() > 0.05 else None,
+            f"NPP{rnd.randint(1, 300):04d}" if rnd.random() > 0.03 else None,
+            f"Nhà phân phối {rnd.randint(1, 300)}" if rnd.random() > 0.05 else None,
+            f"T{rnd.randint(1, 90):03d}" if rnd.random() > 0.03 else None,
+            rnd.choice(REGIONS),
+            rnd.choice(PROVINCES),
+            rnd.randint(0, 400),
+            f"NV{rnd.randint(1, 5000):05d}",
+            styled(rnd.choice(names), alignment=wrap),
+            "NVNPP015" if rnd.random() < 0.02 else f"NVNPP{rnd.randint(100, 999)}",
+            styled(rnd.choice(k_values), alignment=wrap),
+            styled(round(rnd.uniform(0, 5e8), 0), number_format='#,##0'),
+            rnd.randint(0, 10000),
+            rnd.randint(0, 300),
+            rnd.randint(0, 80),
+            styled(round(rnd.random(), 4), number_format='0.00%'),
+            q_value,
+            styled(round(rnd.random(), 4), number_format='0.00%'),
+            rnd.choice([None, None, None, "Đã đối soát", "Chờ duyệt"]),
+        ]
+        row.extend(rnd.randint(0, 1000) for _ in range(extra_columns))
+        ws.append(row)
+    wb.save(path)
+    return path
+
+
+def fixture_path(rows, seed=0):
+    """
+    File mẫu đã sinh (dùng lại giữa các lần chạy): output/benchmark/data/kpi_<rows>_s<seed>_v<version>.xlsx
+    """
+    path = BENCHMARK_DIR / "data" / f"kpi_{rows}_s{seed}_v{GENERATOR_VERSION}.xlsx"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"🧪 Sinh file mẫu {rows:,} dòng: {path.name}")
+        started = perf_counter()
+        tmp_file = path.with_name(path.name + ".tmp")
+        generate_kpi_workbook(tmp_file, rows, seed=seed)
+        tmp_file.replace(path)
+        print(f"   ✅ {perf_counter() - started:.1f}s, {path.stat().st_size / 1e6:.1f} MB")
+    return path
+
+
+# Các phép đo: setup(fixture, thư mục tạm) -> hàm chạy; chỉ đo thời gian/bộ nhớ của hàm chạy
+def _processor(work_dir, writer=None):
+    from process_excel import ExcelProcessor
+    from excel_rules import load_rule_book
+
+    processor = ExcelProcessor(use_manifest=False)
+    processor.output_dir = work_dir / "output"
+    if writer is not None:
+        spec = dict(load_rule_book(processor.rules_file).spec, writer=writer)
+        processor.rules_file = work_dir / f"rules_{writer}.json"
+        with open(processor.rules_file, 'w', encoding='utf-8') as f:
+            json.dump(spec, f, ensure_ascii=False)
+    return processor
+
+
+def _setup_process_single_excel(writer):
+    def setup(fixture, work_dir):
+        processor = _processor(work_dir, writer)
+        excel_file = work_dir / "RPT_KPI_STAFF.xlsx"
+        shutil.copyfile(fixture, excel_file)
+
+        def run():
+            if not processor.process_single_excel(excel_file):
+                raise RuntimeError("process_single_excel thất bại")
+        return run
+    return setup
+
+
+def _setup_loaded_sheet(method):
+    def setup(fixture, work_dir):
+        from excel_rules import load_rule_book
+
+        processor = _processor(work_dir)
+        ws = openpyxl.load_workbook(fixture).active
+        if method == 'hide_unwanted_columns':
+            rule_set = load_rule_book(processor.rules_file).for_report(None)
+            return lambda: processor.hide_unwanted_columns(ws, rule_set)
+        return lambda: processor.optimize_columns_i_k(ws)
+    return setup
+
+
+def _setup_summary(method):
+    def setup(fixture, work_dir):
+        processor = _processor(work_dir, 'xml')
+        daily_dir = processor.output_dir / datetime.now().strftime("%d%m%Y")
+        daily_dir.mkdir(parents=True)
+        processed_files = []
+        for idx in range(SUMMARY_SHEETS):
+            excel_file = daily_dir / f"RPT_KPI_STAFF_{idx + 1}.xlsx"
+            shutil.copyfile(fixture, excel_file)
+            processor.process_single_excel(excel_file)
+            processed_files.append(excel_file)
+
+        def run():
+            summary_file = daily_dir / "Kết quả.xlsx"
+            if summary_file.exists():
+                summary_file.unlink()
+            if method == 'create_summary_workbook':
+                done = processor.create_summary_workbook(processed_files)
+            else:
+                done = processor.create_summary_openpyxl(processed_files, summary_file)
+            if not done:
+                raise RuntimeError(f"{method} thất bại")
+        return run
+    return setup
+
+
+CASES = {
+    "process_single_excel": _setup_process_single_excel(None),
+    "process_single_excel[xml]": _setup_process_single_excel('xml'),
+    "process_single_excel[stream]": _setup_process_single_excel('stream'),
+    "process_single_excel[openpyxl]": _setup_process_single_excel('openpyxl'),
+    "hide_unwanted_columns": _setup_loaded_sheet('hide_unwanted_columns'),
+    "optimize_columns_i_k": _setup_loaded_sheet('optimize_columns_i_k'),
+    "create_summary_workbook": _setup_summary('create_summary_workbook'),
+    "create_summary_openpyxl": _setup_summary('create_summary_openpyxl'),
+}
+DEFAULT_CASES = [
+    "process_single_excel", "process_single_excel[stream]", "process_single_excel[openpyxl]",
+    "hide_unwanted_columns", "optimize_columns_i_k", "create_summary_workbook",
+]
+
+
+def _run_case(case, fixture, repeat, measure_memory):
+    """
+    Chạy một phép đo (trong process riêng): mỗi lần chạy setup lại từ đầu trên bản sao file mẫu
+    """
+    setup = CASES[case]
+    times = []
+    peak_mb = None
+    log = io.StringIO()
+    for attempt in range(repeat + (1 if measure_memory else 0)):
+        with tempfile.TemporaryDirectory(prefix="benchmark_") as tmp_dir, redirect_stdout(log):
+            run = setup(Path(fixture), Path(tmp_dir))
+            if attempt < repeat:
+                started = perf_counter()
+                run()
+                times.append(perf_counter() - started)
+            else:
+                # Lần đo bộ nhớ chạy riêng (tracemalloc làm chậm code)
+                tracemalloc.start()
+                try:
+                    before = tracemalloc.get_traced_memory()[0]
+                    run()
+                    peak_mb = (tracemalloc.get_traced_memory()[1] - before) / (1 << 20)
+                finally:
+                    tracemalloc.stop()
+            run = None
+    times.sort()
+    return {
+        'seconds': round(times[0], 4),
+        'median_seconds': round(times[len(times) // 2], 4),
+        'runs': len(times),
+        'peak_mb': round(peak_mb, 2) if peak_mb is not None else None,
+    }
+
+
+def run_benchmarks(rows_list, cases, repeat=3, measure_memory=True, seed=0):
+    """
+    Đo tất cả phép đo với từng số dòng -> dict kết quả (ghi ra JSON)
+    """
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for rows in rows_list:
+        fixture = fixture_path(rows, seed)
+        for case in cases:
+            print(f"⏱️ {case} - {rows:,} dòng...", end=" ", flush=True)
+            # Process mới cho mỗi phép đo: bộ nhớ / cache của phép đo trước không ảnh hưởng
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    result = pool.submit(_run_case, case, str(fixture), repeat, measure_memory).result()
+                except Exception as e:
+                    print(f"❌ {e}")
+                    results[f"{case}@{rows}"] = {'case': case, 'rows': rows, 'error': str(e)}
+                    continue
+            result.update(case=case, rows=rows, file_mb=round(fixture.stat().st_size / 1e6, 2))
+            results[f"{case}@{rows}"] = result
+            memory = f", {result['peak_mb']:.1f} MB" if result['peak_mb'] is not None else ""
+            print(f"{result['seconds']:.3f}s{memory}")
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'openpyxl': openpyxl.__version__,
+        'generator_version': GENERATOR_VERSION,
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    So với baseline, trả về danh sách phép đo chậm đi / tốn bộ nhớ hơn quá tolerance (0.25 = 25%)
+    """
+    regressions = []
+    print("\n" + "=" * 78)
+    print(f"📊 SO VỚI BASELINE ({baseline.get('created', '?')}, ngưỡng {tolerance:.0%})")
+    print("=" * 78)
+    if baseline.get('generator_version') != current.get('generator_version'):
+        print("⚠️ Baseline dùng file mẫu phiên bản khác - kết quả có thể không so được")
+    for key, result in current['results'].items():
+        old = baseline.get('results', {}).get(key)
+        if old is None or 'error' in result or 'error' in old:
+            print(f"   {key:<48} (không có baseline)")
+            continue
+        notes = []
+        flagged = False
+        for metric, unit, floor in (('seconds', 's', MIN_SECONDS), ('peak_mb', ' MB', MIN_PEAK_MB)):
+            new_value, old_value = result.get(metric), old.get(metric)
+            if new_value is None or old_value is None:
+                continue
+            worse = new_value > old_value * (1 + tolerance) and new_value - old_value > floor
+            flagged |= worse
+            ratio = f" ({new_value / old_value:.2f}x)" if old_value else ""
+            notes.append(f"{old_value:g}{unit} -> {new_value:g}{unit}{ratio}{' ⚠️' if worse else ''}")
+        if flagged:
+            regressions.append(key)
+        print(f"{'❌' if flagged else '✅'} {key:<48} {'; '.join(notes)}")
+    if regressions:
+        print(f"\n⚠️ {len(regressions)} phép đo chậm đi / tốn bộ nhớ hơn baseline")
+    else:
+        print("\n✅ Không có phép đo nào kém hơn baseline")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo hiệu năng xử lý Excel trên file KPI giả lập")
+    parser.add_argument('--rows', nargs='+', default=[str(rows) for rows in DEFAULT_ROWS],
+                        help="Số dòng dữ liệu của file mẫu (vd 1k 10k 100k 1m)")
+    parser.add_argument('--cases', nargs='+', default=DEFAULT_CASES, choices=sorted(CASES),
+                        help="Các phép đo")
+    parser.add_argument('--repeat', type=int, default=3, help="Số lần chạy mỗi phép đo (lấy thời gian nhỏ nhất)")
+    parser.add_argument('--no-memory', action='store_true', help="Bỏ lượt đo bộ nhớ (tracemalloc)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed sinh file mẫu")
+    parser.add_argument('--baseline', type=Path, default=BENCHMARK_DIR / "baseline.json", help="File baseline")
+    parser.add_argument('--save-baseline', action='store_true', help="Lưu kết quả lần này làm baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Mức kém hơn baseline cho phép (0.25 = 25%%)")
+    parser.add_argument('--generate-only', action='store_true', help="Chỉ sinh file mẫu")
+    args = parser.parse_args(argv)
+
+    rows_list = [parse_row_count(rows) for rows in args.rows]
+    if args.generate_only:
+        for rows in rows_list:
+            print(f"📄 {fixture_path(rows, args.seed)}")
+        return 0
+
+    current = run_benchmarks(rows_list, args.cases, max(1, args.repeat), not args.no_memory, args.seed)
+    BENCHMARK_DIR.mkdir(parents=True, exist_ok=True)
+    result_file = BENCHMARK_DIR / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Kết quả: {result_file}")
+
+    regressions = []
+    if args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_results(current, json.load(f), args.tolerance)
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(result_file, args.baseline)
+        print(f"📌 Đã lưu baseline: {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
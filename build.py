@@ -26,9 +26,33 @@ def build_menu_exe():
         "--add-data=output;output",     # Include output folder
         "--add-data=check_oder.py;.",   # Include check_oder.py
         "--add-data=process_excel.py;.", # Include process_excel.py
+        "--add-data=check_oder_async.py;.", # Include check_oder_async.py
+        "--add-data=run_trace.py;.",    # Include run_trace.py
+        "--add-data=excel_rules.py;.",  # Include excel_rules.py
+        "--add-data=xlsx_patch.py;.",  # Include xlsx_patch.py
+        "--add-data=xlsx_stream.py;.",  # Include xlsx_stream.py
+        "--add-data=excel_sidecar.py;.",  # Include excel_sidecar.py
+        "--add-data=excel_cache.py;.",  # Include excel_cache.py
+        "--add-data=excel_history.py;.",  # Include excel_history.py
+        "--add-data=excel_delta.py;.",  # Include excel_delta.py
+        "--add-data=check_daemon.py;.",  # Include check_daemon.py
+        "--add-data=excel_manifest.py;.",  # Include excel_manifest.py
+        "--add-data=xlsx_merge.py;.",  # Include xlsx_merge.py
         "--add-data=test_system.py;.",  # Include test_system.py
         "--add-data=HUONG_DAN.md;.",    # Include hướng dẫn
         "--hidden-import=process_excel", # Import process_excel
+        "--hidden-import=check_oder_async", # Engine asyncio
+        "--hidden-import=run_trace",    # Trace thời gian chạy
+        "--hidden-import=excel_rules",  # Bộ rule xử lý Excel
+        "--hidden-import=xlsx_patch",  # Sửa trực tiếp sheet XML
+        "--hidden-import=xlsx_stream",  # Xử lý file rất lớn với bộ nhớ cố định
+        "--hidden-import=excel_sidecar",  # File dữ liệu dạng cột (CSV/parquet)
+        "--hidden-import=excel_cache",  # Cache dữ liệu báo cáo đã xử lý
+        "--hidden-import=excel_history",  # Chỉ mục lịch sử SQLite
+        "--hidden-import=excel_delta",  # So báo cáo với lần chạy trước
+        "--hidden-import=check_daemon",  # Daemon chạy theo lịch
+        "--hidden-import=excel_manifest",  # Manifest file đã xử lý
+        "--hidden-import=xlsx_merge",  # Ghép file tổng hợp
         "--hidden-import=check_oder",   # Import check_oder
         "--clean",                      # Clean cache
         "-y",                          # Overwrite without confirmation
@@ -79,10 +103,34 @@ def build_exe():
         "--add-data=input;input",       # Include input folder
         "--add-data=output;output",     # Include output folder
         "--add-data=process_excel.py;.", # Include process_excel.py
+        "--add-data=check_oder_async.py;.", # Include check_oder_async.py
+        "--add-data=run_trace.py;.",    # Include run_trace.py
+        "--add-data=excel_rules.py;.",  # Include excel_rules.py
+        "--add-data=xlsx_patch.py;.",  # Include xlsx_patch.py
+        "--add-data=xlsx_stream.py;.",  # Include xlsx_stream.py
+        "--add-data=excel_sidecar.py;.",  # Include excel_sidecar.py
+        "--add-data=excel_cache.py;.",  # Include excel_cache.py
+        "--add-data=excel_history.py;.",  # Include excel_history.py
+        "--add-data=excel_delta.py;.",  # Include excel_delta.py
+        "--add-data=check_daemon.py;.",  # Include check_daemon.py
+        "--add-data=excel_manifest.py;.",  # Include excel_manifest.py
+        "--add-data=xlsx_merge.py;.",  # Include xlsx_merge.py
         "--add-data=menu.py;.",         # Include menu.py
         "--add-data=test_system.py;.",  # Include test_system.py
         "--add-data=HUONG_DAN.md;.",    # Include hướng dẫn
         "--hidden-import=process_excel", # Import process_excel
+        "--hidden-import=check_oder_async", # Engine asyncio
+        "--hidden-import=run_trace",    # Trace thời gian chạy
+        "--hidden-import=excel_rules",  # Bộ rule xử lý Excel
+        "--hidden-import=xlsx_patch",  # Sửa trực tiếp sheet XML
+        "--hidden-import=xlsx_stream",  # Xử lý file rất lớn với bộ nhớ cố định
+        "--hidden-import=excel_sidecar",  # File dữ liệu dạng cột (CSV/parquet)
+        "--hidden-import=excel_cache",  # Cache dữ liệu báo cáo đã xử lý
+        "--hidden-import=excel_history",  # Chỉ mục lịch sử SQLite
+        "--hidden-import=excel_delta",  # So báo cáo với lần chạy trước
+        "--hidden-import=check_daemon",  # Daemon chạy theo lịch
+        "--hidden-import=excel_manifest",  # Manifest file đã xử lý
+        "--hidden-import=xlsx_merge",  # Ghép file tổng hợp
         "--clean",                      # Clean cache
         "-y",                          # Overwrite without confirmation
         "check_oder.py"                 # File chính
@@ -132,10 +180,34 @@ def build_dir():
         "--add-data=input;input",       # Include input folder  
         "--add-data=output;output",     # Include output folder
         "--add-data=process_excel.py;.", # Include process_excel.py
+        "--add-data=check_oder_async.py;.", # Include check_oder_async.py
+        "--add-data=run_trace.py;.",    # Include run_trace.py
+        "--add-data=excel_rules.py;.",  # Include excel_rules.py
+        "--add-data=xlsx_patch.py;.",  # Include xlsx_patch.py
+        "--add-data=xlsx_stream.py;.",  # Include xlsx_stream.py
+        "--add-data=excel_sidecar.py;.",  # Include excel_sidecar.py
+        "--add-data=excel_cache.py;.",  # Include excel_cache.py
+        "--add-data=excel_history.py;.",  # Include excel_history.py
+        "--add-data=excel_delta.py;.",  # Include excel_delta.py
+        "--add-data=check_daemon.py;.",  # Include check_daemon.py
+        "--add-data=excel_manifest.py;.",  # Include excel_manifest.py
+        "--add-data=xlsx_merge.py;.",  # Include xlsx_merge.py
         "--add-data=menu.py;.",         # Include menu.py
         "--add-data=test_system.py;.",  # Include test_system.py
         "--add-data=HUONG_DAN.md;.",    # Include hướng dẫn
         "--hidden-import=process_excel", # Import process_excel
+        "--hidden-import=check_oder_async", # Engine asyncio
+        "--hidden-import=run_trace",    # Trace thời gian chạy
+        "--hidden-import=excel_rules",  # Bộ rule xử lý Excel
+        "--hidden-import=xlsx_patch",  # Sửa trực tiếp sheet XML
+        "--hidden-import=xlsx_stream",  # Xử lý file rất lớn với bộ nhớ cố định
+        "--hidden-import=excel_sidecar",  # File dữ liệu dạng cột (CSV/parquet)
+        "--hidden-import=excel_cache",  # Cache dữ liệu báo cáo đã xử lý
+        "--hidden-import=excel_history",  # Chỉ mục lịch sử SQLite
+        "--hidden-import=excel_delta",  # So báo cáo với lần chạy trước
+        "--hidden-import=check_daemon",  # Daemon chạy theo lịch
+        "--hidden-import=excel_manifest",  # Manifest file đã xử lý
+        "--hidden-import=xlsx_merge",  # Ghép file tổng hợp
         "--exclude-module=tkinter",     # Loại bỏ tkinter không cần
         "--exclude-module=matplotlib",  # Loại bỏ matplotlib không cần
         "--clean",                      # Clean cache
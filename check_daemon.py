@@ -0,0 +1,519 @@
+"""
+Chế độ chạy nền (daemon) cho Order Checker: một process thường trú giữ sẵn Playwright driver và Chromium,
+mỗi lần chạy chỉ mở browser context mới thay vì khởi động lại từ đầu (import, tìm chrome.exe, khởi động
+driver, mở Chromium; đăng nhập dùng lại phiên đã lưu trong input/session_state.json).
+- Lịch chạy dạng cron trong config.json (settings.daemon.schedule), đọc lại khi config.json đổi
+- Chromium chạy như process riêng có cổng remote debugging, mỗi lần chạy kết nối qua CDP
+  (OrderChecker.launch_browser); luồng tải song song và engine async cũng dùng chung Chromium này
+- Khởi động lại Chromium theo chính sách recycle: sau N lần chạy, quá số phút, sau lần chạy lỗi, khi Chromium bị tắt
+- Nhận yêu cầu chạy ngay qua socket TCP cục bộ (127.0.0.1:settings.daemon.port)
+Dòng lệnh: python check_daemon.py start | run [--wait] | status | stop  (menu 9 = start, menu 1 gửi yêu cầu
+chạy tới daemon nếu đang chạy)
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Cấu hình mặc định - ghi đè bằng settings.daemon trong config.json
+DEFAULT_DAEMON_SETTINGS = {
+    'schedule': [],                # Biểu thức cron 5 trường "phút giờ ngày tháng thứ", vd "30 7 * * 1-6"
+    'port': 8765,                  # Cổng TCP nhận lệnh (chỉ 127.0.0.1)
+    'recycle_after_runs': 20,      # Khởi động lại Chromium sau số lần chạy này (0 = không)
+    'recycle_after_minutes': 240,  # ... hoặc khi Chromium đã chạy quá số phút này (0 = không)
+    'recycle_on_failure': True     # ... hoặc sau lần chạy lỗi
+}
+BROWSER_START_TIMEOUT = 30  # Giây chờ Chromium mở cổng remote debugging
+POLL_SECONDS = 1            # Chu kỳ kiểm tra lịch / yêu cầu (giữ Ctrl+C phản hồi nhanh)
+_STOP = object()
+
+
+def get_base_path():
+    """Thư mục chứa config (thư mục exe khi chạy bản đóng gói, thư mục script khi dev)"""
+    if getattr(sys, 'frozen', False):
+        return Path(sys.executable).parent
+    return Path(__file__).parent
+
+
+def load_daemon_settings(config_file):
+    """
+    settings.daemon trong config.json ghép với DEFAULT_DAEMON_SETTINGS (không đọc được thì dùng mặc định)
+    """
+    settings = dict(DEFAULT_DAEMON_SETTINGS)
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f).get('settings', {}).get('daemon', {}))
+    except FileNotFoundError:
+        pass  # config.json được tạo ở lần chạy đầu (OrderChecker)
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"⚠️ Không đọc được settings.daemon ({e}), dùng cấu hình mặc định")
+    return settings
+
+
+class CronSchedule:
+    """
+    Biểu thức cron 5 trường: phút (0-59) giờ (0-23) ngày (1-31) tháng (1-12) thứ (0-6, 0 hoặc 7 = Chủ nhật).
+    Mỗi trường: *, số, khoảng a-b, bước */n hoặc a-b/n, danh sách cách nhau dấu phẩy.
+    Như cron: giới hạn cả ngày lẫn thứ thì chạy khi khớp một trong hai
+    """
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Lịch cron cần 5 trường: {expression!r}")
+        fields = [self._parse(part, low, high, expression) for part, (low, high) in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(part, low, high, expression):
+        values = set()
+        for item in part.split(','):
+            spec, _, step = item.partition('/')
+            try:
+                step = int(step) if step else 1
+                if spec == '*':
+                    start, end = low, high
+                elif '-' in spec:
+                    start, end = (int(value) for value in spec.split('-', 1))
+                else:
+                    start = end = int(spec)
+                    if step > 1:
+                        end = high
+            except ValueError:
+                raise ValueError(f"Lịch cron không hợp lệ: {expression!r}") from None
+            if step < 1 or not low <= start <= end <= high:
+                raise ValueError(f"Lịch cron ngoài giới hạn {low}-{high}: {expression!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches_day(self, day):
+        day_match = day.day in self.days
+        weekday_match = day.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, moment):
+        """
+        Thời điểm chạy kế tiếp sau moment (đầu phút), None nếu không có trong 4 năm tới (vd 31/2)
+        """
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        hours = sorted(self.hours)
+        minutes = sorted(self.minutes)
+        for _ in range(366 * 4):
+            if day.month in self.months and self.matches_day(day):
+                for hour in hours:
+                    for minute in minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        return None
+
+
+def send_command(command, port=None, timeout=None):
+    """
+    Gửi lệnh tới daemon đang chạy, trả về dict kết quả hoặc None nếu không có daemon
+    """
+    if port is None:
+        port = load_daemon_settings(get_base_path() / "input" / "config.json")['port']
+    try:
+        with socket.create_connection(('127.0.0.1', int(port)), timeout=5) as conn:
+            conn.settimeout(timeout)
+            conn.sendall(command.encode('utf-8') + b'\n')
+            reply = conn.makefile('r', encoding='utf-8').readline()
+    except (ConnectionRefusedError, socket.timeout, OSError):
+        return None
+    try:
+        return json.loads(reply)
+    except ValueError:
+        return None
+
+
+def request_run(wait=False, port=None):
+    """
+    Yêu cầu daemon chạy ngay (wait: chờ chạy xong), None nếu daemon không chạy
+    """
+    return send_command("run wait" if wait else "run", port)
+
+
+class _RunRequest:
+    def __init__(self, reason, wait=False):
+        self.reason = reason
+        self.done = threading.Event() if wait else None
+        self.success = None
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Một lệnh mỗi kết nối: "run", "run wait", "status", "stop" -> một dòng JSON
+    """
+    def handle(self):
+        daemon = self.server.owner
+        command = self.rfile.readline(1024).decode('utf-8', 'replace').strip().lower()
+        if command in ("run", "run wait"):
+            request = _RunRequest("yêu cầu", wait=command == "run wait")
+            daemon.requests.put(request)
+            if request.done is None:
+                reply = {'queued': True, 'pending': daemon.requests.qsize()}
+            else:
+                request.done.wait()
+                reply = {'success': request.success}
+        elif command == "status":
+            reply = daemon.status()
+        elif command == "stop":
+            daemon.requests.put(_STOP)
+            reply = {'stopping': True}
+        else:
+            reply = {'error': f"lệnh không hỗ trợ: {command}"}
+        self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class _CommandServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    # POSIX: mở lại cổng ngay sau khi daemon trước dừng (kết nối cũ còn TIME_WAIT).
+    # Windows: SO_REUSEADDR cho phép hai process cùng nghe một cổng nên không bật
+    allow_reuse_address = os.name != 'nt'
+
+
+class ChromiumProcess:
+    """
+    Chromium headless chạy như process riêng với cổng remote debugging ngẫu nhiên (đọc từ DevToolsActivePort
+    trong thư mục profile tạm). Các driver Playwright (kể cả ở thread khác) kết nối tới qua connect_over_cdp:
+    daemon giữ Chromium giữa các lần chạy, OrderChecker dùng chung một Chromium cho các luồng tải song song
+    """
+    def __init__(self, executable, label="Chromium"):
+        self.executable = executable
+        self.label = label
+        self.process = None
+        self.profile_dir = None
+        self.endpoint = None
+        self.started = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        Mở Chromium và chờ cổng remote debugging, trả về endpoint CDP ("http://127.0.0.1:<port>")
+        """
+        self.profile_dir = tempfile.mkdtemp(prefix="check_chromium_")
+        args = [
+            self.executable, "--headless=new", "--remote-debugging-address=127.0.0.1", "--remote-debugging-port=0",
+            f"--user-data-dir={self.profile_dir}", "--no-first-run", "--no-default-browser-check", "about:blank"
+        ]
+        try:
+            self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            self.stop()
+            raise
+        port_file = Path(self.profile_dir) / "DevToolsActivePort"
+        deadline = time.monotonic() + BROWSER_START_TIMEOUT
+        while True:
+            try:
+                port = port_file.read_text(encoding='utf-8').splitlines()[0].strip()
+                if port.isdigit():
+                    break
+            except (OSError, IndexError):
+                pass
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError("Chromium không mở được cổng remote debugging")
+            time.sleep(0.05)
+        self.endpoint = f"http://127.0.0.1:{port}"
+        self.started = time.monotonic()
+        print(f"🌐 {self.label} (pid {self.process.pid}) tại {self.endpoint}")
+        return self.endpoint
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+        self.endpoint = None
+
+
+class CheckDaemon:
+    def __init__(self):
+        self.base_path = get_base_path()
+        self.config_file = self.base_path / "input" / "config.json"
+        self.settings = load_daemon_settings(self.config_file)
+        self.config_mtime = self._config_mtime()
+        self.requests = queue.Queue()
+        self.server = None
+        self.playwright = None     # Playwright sync driver của luồng chính (engine sync)
+        self.chromium_path = None  # Tìm chrome.exe một lần ở lần chạy đầu
+        self.browser = None        # ChromiumProcess thường trú
+        self.cdp_endpoint = None
+        self.browser_runs = 0
+        self.schedules = []
+        self.next_run = None
+        self.started_at = datetime.now()
+        self.running = None        # Lần chạy đang diễn ra: (lý do, thời điểm bắt đầu)
+        self.run_count = 0
+        self.last_run = None
+
+    def _config_mtime(self):
+        try:
+            return self.config_file.stat().st_mtime
+        except OSError:
+            return None
+
+    def load_schedules(self):
+        """
+        Biên dịch lịch chạy (bỏ biểu thức lỗi) và tính lần chạy kế tiếp
+        """
+        schedules = []
+        for expression in self.settings.get('schedule') or []:
+            try:
+                schedules.append(CronSchedule(expression))
+            except ValueError as e:
+                print(f"⚠️ {e}")
+        self.schedules = schedules
+        self.plan_next_run()
+
+    def plan_next_run(self):
+        now = datetime.now()
+        upcoming = [moment for moment in (schedule.next_after(now) for schedule in self.schedules) if moment]
+        self.next_run = min(upcoming) if upcoming else None
+
+    def reload_settings(self):
+        """
+        Đọc lại settings.daemon khi config.json đổi (lịch chạy, chính sách recycle; cổng chỉ đổi khi khởi động lại)
+        """
+        mtime = self._config_mtime()
+        if mtime == self.config_mtime:
+            return
+        self.config_mtime = mtime
+        port = self.settings['port']
+        self.settings = load_daemon_settings(self.config_file)
+        self.settings['port'] = port
+        self.load_schedules()
+        print(f"🔄 Đã đọc lại lịch chạy, lần kế tiếp: {self.describe_next_run()}")
+
+    def describe_next_run(self):
+        return f"{self.next_run:%d/%m/%Y %H:%M}" if self.next_run else "không có lịch (chỉ chạy theo yêu cầu)"
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'running': ({'reason': self.running[0], 'started_at': self.running[1].isoformat(timespec='seconds')}
+                        if self.running else None),
+            'pending': self.requests.qsize(),
+            'next_run': self.next_run.isoformat(timespec='minutes') if self.next_run else None,
+            'runs': self.run_count,
+            'last_run': self.last_run,
+            'browser': {
+                'pid': self.browser.pid if self.browser_alive() else None,
+                'endpoint': self.cdp_endpoint if self.browser_alive() else None,
+                'runs': self.browser_runs,
+                'minutes': (round((time.monotonic() - self.browser.started) / 60, 1)
+                            if self.browser_alive() else None)
+            }
+        }
+
+    def browser_alive(self):
+        return self.browser is not None and self.browser.alive()
+
+    def start_browser(self, executable):
+        """
+        Mở Chromium thường trú (ChromiumProcess), các lần chạy kết nối qua self.cdp_endpoint
+        """
+        self.browser = ChromiumProcess(executable, label="Chromium thường trú")
+        try:
+            self.cdp_endpoint = self.browser.start()
+        except RuntimeError:
+            self.browser = None
+            raise
+        self.browser_runs = 0
+
+    def stop_browser(self):
+        if self.browser is not None:
+            self.browser.stop()
+            self.browser = None
+        self.cdp_endpoint = None
+
+    def ensure_browser(self, executable):
+        """
+        Chromium sẵn sàng cho lần chạy: khởi động lại theo chính sách recycle hoặc khi đã bị tắt
+        """
+        if self.browser_alive():
+            runs_limit = self.settings.get('recycle_after_runs') or 0
+            minutes_limit = self.settings.get('recycle_after_minutes') or 0
+            minutes = (time.monotonic() - self.browser.started) / 60
+            if runs_limit and self.browser_runs >= runs_limit:
+                print(f"♻️ Khởi động lại Chromium sau {self.browser_runs} lần chạy")
+                self.stop_browser()
+            elif minutes_limit and minutes >= minutes_limit:
+                print(f"♻️ Khởi động lại Chromium sau {minutes:.0f} phút")
+                self.stop_browser()
+        elif self.browser is not None:
+            print("⚠️ Chromium thường trú đã tắt, khởi động lại")
+            self.stop_browser()
+        if not self.browser_alive():
+            self.start_browser(executable)
+
+    def run_once(self, reason):
+        """
+        Một lần chạy đầy đủ (tải + xử lý Excel) trên Chromium thường trú, trả về True/False
+        """
+        # Import khi chạy lần đầu: lệnh run/status/stop gửi tới daemon không cần nạp Playwright
+        from check_oder import OrderChecker
+        from playwright.sync_api import sync_playwright
+
+        started = datetime.now()
+        self.running = (reason, started)
+        print("\n" + "=" * 60)
+        print(f"⏰ [{started:%H:%M:%S}] Bắt đầu lần chạy ({reason})")
+        success = False
+        try:
+            checker = OrderChecker(chromium_path=self.chromium_path)
+            self.chromium_path = checker.chromium_path
+            if checker.config:
+                if checker.config.get('settings', {}).get('engine', 'sync') != 'async':
+                    # Engine async tự khởi động driver asyncio, chỉ giữ driver sync cho engine sync
+                    if self.playwright is None:
+                        self.playwright = sync_playwright().start()
+                    checker.playwright = self.playwright
+                executable = self.chromium_path
+                if not executable or not os.path.exists(executable):
+                    # Không có Chromium đi kèm dự án: dùng Chromium Playwright đã cài
+                    if self.playwright is not None:
+                        executable = self.playwright.chromium.executable_path
+                    else:
+                        with sync_playwright() as p:
+                            executable = p.chromium.executable_path
+                self.ensure_browser(executable)
+                checker.cdp_endpoint = self.cdp_endpoint
+                success = bool(checker.run_browser_test())
+        except Exception as e:
+            print(f"❌ Lỗi lần chạy: {str(e)}")
+        finally:
+            self.running = None
+        seconds = (datetime.now() - started).total_seconds()
+        self.run_count += 1
+        self.browser_runs += 1
+        self.last_run = {'reason': reason, 'started_at': started.isoformat(timespec='seconds'),
+                         'seconds': round(seconds, 1), 'success': success}
+        print(f"{'✅' if success else '❌'} Lần chạy ({reason}) xong sau {seconds:.1f}s")
+        if not success and self.settings.get('recycle_on_failure', True) and self.browser is not None:
+            print("♻️ Lần chạy lỗi: khởi động lại Chromium ở lần chạy sau")
+            self.stop_browser()
+        return success
+
+    def serve(self):
+        """
+        Vòng lặp chính: chạy theo lịch và theo yêu cầu (lần lượt, không chạy chồng), tới khi nhận lệnh stop / Ctrl+C
+        """
+        try:
+            self.server = _CommandServer(('127.0.0.1', int(self.settings['port'])), _CommandHandler)
+        except OSError as e:
+            print(f"❌ Không mở được cổng {self.settings['port']} (daemon khác đang chạy?): {e}")
+            return False
+        self.server.owner = self
+        threading.Thread(target=self.server.serve_forever, name="daemon-commands", daemon=True).start()
+        self.load_schedules()
+        print(f"🟢 Daemon đang chạy (pid {os.getpid()}), nhận lệnh tại 127.0.0.1:{self.settings['port']}")
+        print(f"⏰ Lần chạy kế tiếp: {self.describe_next_run()}")
+        print("   Chạy ngay: python check_daemon.py run | Dừng: python check_daemon.py stop hoặc Ctrl+C")
+        try:
+            while True:
+                try:
+                    request = self.requests.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    self.reload_settings()
+                    if self.next_run and datetime.now() >= self.next_run:
+                        self.run_once(f"lịch {self.next_run:%H:%M}")
+                        self.plan_next_run()
+                        print(f"⏰ Lần chạy kế tiếp: {self.describe_next_run()}")
+                    continue
+                if request is _STOP:
+                    break
+                request.success = self.run_once(request.reason)
+                if request.done is not None:
+                    request.done.set()
+                if self.next_run and datetime.now() >= self.next_run:
+                    # Lịch đã tới trong lúc chạy theo yêu cầu: vừa chạy xong, bỏ qua lần này
+                    self.plan_next_run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print("🛑 Đang dừng daemon...")
+            self.server.shutdown()
+            self.server.server_close()
+            while True:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not _STOP and request.done is not None:
+                    request.done.set()
+            self.stop_browser()
+            if self.playwright is not None:
+                try:
+                    self.playwright.stop()
+                except Exception:
+                    pass
+                self.playwright = None
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Daemon chạy Order Checker theo lịch, giữ sẵn Chromium")
+    parser.add_argument('command', choices=['start', 'run', 'status', 'stop'],
+                        help="start: chạy daemon | run: yêu cầu chạy ngay | status | stop")
+    parser.add_argument('--wait', action='store_true', help="run: chờ lần chạy xong")
+    args = parser.parse_args(argv)
+
+    if args.command == 'start':
+        return 0 if CheckDaemon().serve() else 1
+
+    command = {'run': "run wait" if args.wait else "run", 'status': "status", 'stop': "stop"}[args.command]
+    reply = send_command(command)
+    if reply is None:
+        print("❌ Daemon không chạy (khởi động: python check_daemon.py start)")
+        return 1
+    if args.command == 'run':
+        if args.wait:
+            print("✅ Lần chạy hoàn thành" if reply.get('success') else "❌ Lần chạy có lỗi")
+            return 0 if reply.get('success') else 1
+        print(f"📨 Đã gửi yêu cầu chạy ({reply.get('pending', 0)} yêu cầu đang chờ)")
+    elif args.command == 'status':
+        print(json.dumps(reply, ensure_ascii=False, indent=2))
+    else:
+        print("🛑 Đã gửi lệnh dừng daemon")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,20 +3,49 @@ import sys
 import json
 import time
 import shutil
+import queue
+import multiprocessing
+import fnmatch
+import random
+import threading
 import warnings
 import copy
+import contextlib
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
 import openpyxl
 
 # Import Excel processor
-from process_excel import process_excel_for_check_order
+from process_excel import process_excel_for_check_order, ExcelPipeline, ExcelProcessor
+from run_trace import RunTracer, NULL_TRACER
+from check_daemon import ChromiumProcess
 
 # Tắt warning openpyxl về default style
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
+# Timeout mặc định (ms) cho từng điều kiện chờ - ghi đè bằng settings.waits trong config.json
+DEFAULT_WAIT_TIMEOUTS = {
+    'menu_visible': 30000,          # Menu #638 hiển thị sau khi reload
+    'submenu_visible': 10000,       # DMS_REPORT_KPI / RPT_KPI_STAFF hiển thị
+    'report_xhr': 30000,            # Response XHR của trang báo cáo (settings.report_xhr_url)
+    'report_form': 30000,           # Dropdown KPI hiển thị = form báo cáo đã render
+    'picker_visible': 5000,         # Month picker mở
+    'picker_month_visible': 5000,   # Ô tháng hiển thị sau khi chọn năm
+    'month_applied': 3000           # Giá trị fromMonth đã đổi sang tháng/năm đã chọn
+}
+
+# Cấu hình retry mặc định - ghi đè bằng settings.retry trong config.json
+DEFAULT_RETRY_SETTINGS = {
+    'max_attempts': 4,       # Số lần thử tối đa cho mỗi báo cáo
+    'backoff_ms': 500,       # Thời gian chờ trước lần thử lại đầu tiên
+    'backoff_max_ms': 8000,  # Thời gian chờ tối đa giữa 2 lần thử
+    'run_budget': 20         # Tổng số lần thử lại cho cả lần chạy
+}
+RECOVERY_TIERS = 3  # Làm lại bước lỗi → điều hướng lại từ menu → mở trang mới (recover_for_retry)
+
 class OrderChecker:
     def ensure_template_excel(self):
         """
@@ -53,15 +82,39 @@ class OrderChecker:
         if not report_list:
             return None
         return report_list
-    def __init__(self):
+    def __init__(self, chromium_path=None):
         self.base_path = self.get_base_path()
         self.input_dir = self.setup_directory("input")
         self.output_dir = self.setup_directory("output")
         self.daily_output_dir = self.setup_daily_output_directory()
         self.ensure_template_excel()
-        self.chromium_path = self.get_chromium_path()
+        # chromium_path: đường dẫn đã tìm sẵn (daemon), không phải tìm lại chrome.exe mỗi lần chạy
+        self.chromium_path = chromium_path or self.get_chromium_path()
         self.config_file = self.input_dir / "config.json"
         self.config = self.load_or_create_config()
+        self.session_file = self.input_dir / "session_state.json"
+        # Trace thời gian từng bước (settings.trace, mặc định bật)
+        if self.config and self.config.get('settings', {}).get('trace', True):
+            self.tracer = RunTracer()
+        else:
+            self.tracer = NULL_TRACER
+        self._session_lock = threading.Lock()
+        self.export_template = None  # Request export ghi lại cho chế độ direct_export
+        self.excel_pipeline = None   # Worker xử lý Excel chạy nền trong lúc tải
+        self.wait_stats = {}         # Thời gian chờ thực tế theo từng điều kiện
+        self._wait_lock = threading.Lock()
+        self.home_url = None         # Trang sau đăng nhập (dùng khi mở lại trang từ đầu)
+        self.retry_budget_left = None
+        self._retry_lock = threading.Lock()
+        self.report_month = None        # (năm, tháng) báo cáo của lần chạy
+        self.network_stats = {'blocked': {}, 'allowed_requests': 0, 'content_length_bytes': 0, 'unknown_size': 0}
+        self._network_lock = threading.Lock()
+        self.report_month_value = None  # Giá trị fromMonth đã xác nhận đúng
+        self._month_lock = threading.Lock()
+        # Chạy trong daemon (check_daemon.py): Playwright driver đang chạy sẵn của luồng chính
+        # và địa chỉ CDP của Chromium thường trú
+        self.playwright = None
+        self.cdp_endpoint = None
         
     def get_base_path(self):
         """
@@ -155,6 +208,11 @@ class OrderChecker:
         if not self.config:
             return False
 
+        # Engine asyncio (settings.engine = "async"): hàm này chỉ còn là lớp bọc đồng bộ
+        if self.config.get('settings', {}).get('engine', 'sync') == 'async':
+            from check_oder_async import AsyncOrderChecker
+            return AsyncOrderChecker(self).run(url)
+
         report_list = self.load_report_list_from_excel()
         if not report_list:
             return False
@@ -163,24 +221,26 @@ class OrderChecker:
             url = self.config['website']['url']
 
         try:
-            with sync_playwright() as p:
-                if self.chromium_path and os.path.exists(self.chromium_path):
-                    browser = p.chromium.launch(
-                        executable_path=self.chromium_path,
-                        headless=True
-                    )
-                else:
-                    browser = p.chromium.launch(headless=True)
+            with self.start_playwright() as p, self.shared_browser_for_workers(p, len(report_list)):
+                browser = self.launch_browser(p)
 
-                context = browser.new_context()
+                session = self.load_session_state()
+                context = self.new_browser_context(browser, session['storage_state'] if session else None)
                 page = context.new_page()
 
-                login_success = self.login_to_website(page)
+                with self.tracer.span("login"):
+                    login_success = self.ensure_logged_in(page, session)
                 if not login_success:
                     print("❌ Đăng nhập thất bại!")
                     return False
 
-                navigation_success = self.navigate_to_reports(page)
+                # URL trang sau đăng nhập - các worker song song mở thẳng trang này
+                home_url = page.url
+                self.home_url = home_url
+                self.reset_retry_budget()
+
+                with self.tracer.span("navigate"):
+                    navigation_success = self.navigate_to_reports(page)
                 if not navigation_success:
                     print("❌ Điều hướng thất bại!")
                     return False
@@ -188,35 +248,63 @@ class OrderChecker:
                 # Lặp qua từng báo cáo trong Excel
                 all_success = True
                 downloaded_files = []
+                results = {}
                 
-                print("─" * 60)
-                print("📥 Đang tải báo cáo...")
-                for idx, report in enumerate(report_list, 1):
-                    success = self.select_kpi_and_download(page, report['report_name'], report['short_name'])
-                    if success:
-                        downloaded_files.append(report['short_name'])
-                        print(f"✅ Tải file {idx}: {report['short_name']} thành công")
-                    else:
-                        print(f"❌ Tải file {idx}: {report['short_name']} thất bại")
-                        all_success = False
-                
-                if downloaded_files:
-                    print(f"✅ Đã tải thành công {len(downloaded_files)} báo cáo")
-                print("─" * 60)
+                # Xử lý Excel chạy nền ngay khi từng file tải xong
+                use_pipeline = self.config.get('settings', {}).get('pipeline_processing', True)
+                if use_pipeline:
+                    self.excel_pipeline = ExcelPipeline(ExcelProcessor(
+                        tracer=self.tracer,
+                        use_manifest=self.config.get('settings', {}).get('excel_manifest', True),
+                        use_history=self.config.get('settings', {}).get('history_index', True)
+                    ))
                 
-                # Đóng browser an toàn
+                # Lỗi giữa chừng vẫn phải xử lý xong các file đã gửi sang pipeline (trạng thái, manifest,
+                # delta, chỉ mục lịch sử) và không để lại executor của pipeline trên OrderChecker
                 try:
-                    context.close()
-                    browser.close()
-                except:
-                    pass
+                    print("─" * 60)
+                    print("📥 Đang tải báo cáo...")
+                    results = self.download_reports(page, report_list, home_url)
+                    for idx, report in enumerate(report_list, 1):
+                        success = results.get(idx, False)
+                        if success:
+                            downloaded_files.append(report['short_name'])
+                        else:
+                            all_success = False
+                        self.print_download_result(idx, report['short_name'], success)
+                    
+                    if downloaded_files:
+                        print(f"✅ Đã tải thành công {len(downloaded_files)} báo cáo")
+                    self.print_wait_summary()
+                    self.print_network_filter_summary()
+                    print("─" * 60)
+                finally:
+                    # Đóng browser an toàn
+                    try:
+                        context.close()
+                        browser.close()
+                    except:
+                        pass
+                    
+                    if self.excel_pipeline:
+                        self.finish_excel_pipeline(report_list, results)
+                
+                if use_pipeline:
+                    return all_success
                 
                 # Thông báo hoàn thành
                 if downloaded_files:
                     print("\n" + "─" * 60)
                     print("📊 Đang xử lý file Excel...")
                     try:
-                        process_success = process_excel_for_check_order()
+                        settings = self.config.get('settings', {})
+                        process_success = process_excel_for_check_order(
+                            tracer=self.tracer,
+                            workers=settings.get('excel_workers', 1),
+                            file_timeout=settings.get('excel_file_timeout', 600),
+                            use_manifest=settings.get('excel_manifest', True),
+                            use_history=settings.get('history_index', True)
+                        )
                         if process_success:
                             print("✅ Xử lý Excel hoàn thành!")
                         else:
@@ -230,30 +318,541 @@ class OrderChecker:
         except Exception as e:
             print(f"❌ Lỗi browser: {str(e)}")
             return False
+        finally:
+            self.save_trace()
 
-    def select_kpi_and_download(self, page, kpi_text, short_name):
+    def on_report_saved(self, short_name, file_path):
         """
-        Chọn KPI theo tên (kpi_text), tải file và đặt tên theo short_name
+        Gọi sau khi một báo cáo đã lưu xong: chuyển ngay sang worker xử lý Excel (nếu bật pipeline)
+        """
+        if self.excel_pipeline and short_name:
+            self.excel_pipeline.submit(short_name, file_path)
+
+    def finish_excel_pipeline(self, report_list, download_results):
         """
+        Chờ worker xử lý Excel chạy xong và in trạng thái tải + xử lý của từng báo cáo
+        """
+        print("\n" + "─" * 60)
+        print("📊 Đang hoàn tất xử lý file Excel...")
         try:
-            kpi_dropdown = self.get_locator(page, self.config['selectors']['kpi_dropdown'])
-            kpi_dropdown.click()
+            process_results = self.excel_pipeline.finish()
+        finally:
+            self.excel_pipeline = None
+        self.print_run_report(report_list, download_results, process_results)
+
+    def print_run_report(self, report_list, download_results, process_results):
+        """
+        In trạng thái tải + xử lý Excel của từng báo cáo (theo thứ tự trong template)
+        """
+        for idx, report in enumerate(report_list, 1):
+            short_name = report['short_name']
+            download_status = "✅" if download_results.get(idx) else "❌"
+            if short_name in process_results:
+                process_status = "✅" if process_results[short_name] else "❌"
+            else:
+                process_status = "—"
+            print(f"{idx:2}. {short_name}: tải {download_status} | xử lý {process_status}")
+
+        if process_results and all(process_results.values()):
+            print("✅ Xử lý Excel hoàn thành!")
+        elif process_results:
+            print("⚠️ Xử lý Excel có vấn đề!")
+        print(f"📁 Các file đã được lưu tại: {self.daily_output_dir}")
+        print("─" * 60)
+
+    def save_trace(self):
+        """
+        Ghi trace của lần chạy vào thư mục output theo ngày (nếu bật settings.trace)
+        """
+        if isinstance(self.tracer, RunTracer) and self.tracer.events:
             try:
-                kpi_dropdown.select_option(label=kpi_text)
+                trace_file = self.tracer.save(self.daily_output_dir)
+                print(f"🧭 Trace: {trace_file.name} (mở bằng https://ui.perfetto.dev)")
             except Exception as e:
+                print(f"⚠️ Không ghi được trace: {e}")
+
+    def start_playwright(self):
+        """
+        Playwright driver cho luồng chính của lần chạy: driver đang chạy sẵn của daemon nếu có
+        (không dừng khi chạy xong), không thì khởi động mới. Luồng tải song song luôn dùng driver riêng
+        vì Playwright sync API không dùng chung giữa các thread
+        """
+        if self.playwright is not None:
+            return contextlib.nullcontext(self.playwright)
+        return sync_playwright()
+
+    @contextlib.contextmanager
+    def shared_browser_for_workers(self, p, report_count):
+        """
+        Tải song song (download_workers > 1): mở một Chromium riêng có cổng remote debugging cho cả lần chạy,
+        luồng chính và mỗi worker chỉ kết nối CDP + mở context riêng thay vì mỗi thread một Chromium
+        (Playwright sync API không dùng chung driver giữa các thread, nhưng các driver dùng chung được Chromium).
+        Chạy trong daemon thì đã có Chromium thường trú; không mở được thì mỗi worker tự mở Chromium như cũ
+        """
+        if self.cdp_endpoint or self.get_download_workers(report_count) <= 1:
+            yield
+            return
+        executable = self.chromium_path
+        if not executable or not os.path.exists(executable):
+            executable = p.chromium.executable_path
+        browser_process = ChromiumProcess(executable, label="Chromium dùng chung cho các luồng tải")
+        try:
+            self.cdp_endpoint = browser_process.start()
+        except (OSError, RuntimeError) as e:
+            print(f"⚠️ Không mở được Chromium dùng chung ({e}), mỗi luồng tải mở Chromium riêng")
+            browser_process = None
+        try:
+            yield
+        finally:
+            if browser_process is not None:
+                self.cdp_endpoint = None
+                browser_process.stop()
+
+    def launch_browser(self, p):
+        """
+        Khởi động Chromium headless (ưu tiên Chromium đi kèm dự án).
+        Đã có Chromium chạy sẵn (daemon hoặc shared_browser_for_workers): kết nối CDP tới Chromium đó
+        (browser.close() chỉ ngắt kết nối)
+        """
+        if self.cdp_endpoint:
+            return p.chromium.connect_over_cdp(self.cdp_endpoint)
+        if self.chromium_path and os.path.exists(self.chromium_path):
+            return p.chromium.launch(
+                executable_path=self.chromium_path,
+                headless=True
+            )
+        return p.chromium.launch(headless=True)
+
+    def new_browser_context(self, browser, storage_state=None):
+        """
+        Tạo browser context (kèm phiên đăng nhập nếu có) và bật lọc request nếu được cấu hình
+        """
+        if storage_state:
+            context = browser.new_context(storage_state=storage_state)
+        else:
+            context = browser.new_context()
+        self.setup_network_filter(context)
+        return context
+
+    def setup_network_filter(self, context):
+        """
+        Chặn các request không cần cho automation (ảnh, font, analytics, widget bên thứ ba...)
+        theo settings.network_filter:
+        - block_resource_types: loại tài nguyên bị chặn (image, font, media, stylesheet...)
+        - deny_url_patterns: URL khớp mẫu (glob, vd "*google-analytics.com*") bị chặn
+        - allow_url_patterns: URL khớp mẫu luôn được cho qua (ưu tiên hơn 2 danh sách trên)
+        """
+        network_filter = self.config.get('settings', {}).get('network_filter', {})
+        if not network_filter.get('enabled', False):
+            return
+
+        block_types = set(network_filter.get('block_resource_types', []))
+        deny_patterns = network_filter.get('deny_url_patterns', [])
+        allow_patterns = network_filter.get('allow_url_patterns', [])
+
+        def handle_route(route):
+            request = route.request
+            url = request.url
+            if not any(fnmatch.fnmatch(url, pattern) for pattern in allow_patterns):
+                if request.resource_type in block_types or any(fnmatch.fnmatch(url, pattern) for pattern in deny_patterns):
+                    with self._network_lock:
+                        blocked = self.network_stats['blocked']
+                        blocked[request.resource_type] = blocked.get(request.resource_type, 0) + 1
+                    route.abort()
+                    return
+            route.continue_()
+
+        def handle_response(response):
+            # Chỉ đọc header content-length (không tải body): response chunked/nén không có header này
+            # được đếm riêng thay vì tính 0 byte
+            try:
+                size = int(response.headers['content-length'])
+            except (KeyError, TypeError, ValueError):
+                size = None
+            with self._network_lock:
+                self.network_stats['allowed_requests'] += 1
+                if size is None:
+                    self.network_stats['unknown_size'] += 1
+                else:
+                    self.network_stats['content_length_bytes'] += size
+
+        context.route("**/*", handle_route)
+        context.on("response", handle_response)
+
+    def print_network_filter_summary(self):
+        """
+        In số request đã chặn theo loại và dung lượng khai báo (content-length) của các response đã nhận
+        Dung lượng tiết kiệm nhờ chặn không đo được: request bị hủy trước khi server trả về
+        """
+        stats = self.network_stats
+        blocked = stats['blocked']
+        if not blocked and not stats['allowed_requests']:
+            return
+        blocked_total = sum(blocked.values())
+        detail = ", ".join(f"{resource_type}: {count}" for resource_type, count in sorted(blocked.items()))
+        print(f"🚫 Số request đã chặn: {blocked_total}" + (f" ({detail})" if detail else ""))
+        unknown = f", {stats['unknown_size']} response không có content-length" if stats['unknown_size'] else ""
+        print(f"📶 Đã nhận {stats['allowed_requests']} response, content-length cộng lại "
+              f"{stats['content_length_bytes'] / 1024:.0f} KB{unknown}")
+
+    def get_download_workers(self, report_count):
+        """
+        Số luồng tải song song lấy từ settings.download_workers (mặc định 1 = tuần tự)
+        Không vượt quá số báo cáo cần tải
+        """
+        settings = self.config.get('settings', {})
+        try:
+            workers = int(settings.get('download_workers', 1))
+        except (TypeError, ValueError):
+            workers = 1
+        return max(1, min(workers, report_count))
+
+    def print_download_result(self, idx, short_name, success):
+        """
+        In kết quả tải của một báo cáo
+        """
+        if success:
+            print(f"✅ Tải file {idx}: {short_name} thành công")
+        else:
+            print(f"❌ Tải file {idx}: {short_name} thất bại")
+
+    def download_reports(self, page, report_list, home_url):
+        """
+        Tải tất cả báo cáo, trả về dict {số thứ tự: True/False}
+        - direct_export: báo cáo đầu tải qua giao diện để ghi lại request export,
+          các báo cáo sau gửi thẳng request đó (lỗi thì quay về giao diện)
+        - download_workers > 1: tải qua giao diện bằng nhiều trang song song
+        """
+        results = {}
+        pending = list(enumerate(report_list, 1))
+        workers = self.get_download_workers(len(report_list))
+
+        if self.config.get('settings', {}).get('direct_export', False) and pending:
+            idx, report = pending.pop(0)
+            results[idx] = self.download_one_report(page, report, record_export=True)
+            page = self.live_page(page)
+            if self.export_template and pending:
+                print(f"⚡ Tải trực tiếp {len(pending)} báo cáo qua request export...")
+                direct_results = self.download_reports_direct(page.context.storage_state(), pending, workers)
+                results.update(direct_results)
+                pending = [(idx, report) for idx, report in pending if not direct_results.get(idx)]
+                if pending:
+                    print(f"↩️ {len(pending)} báo cáo tải lại qua giao diện")
+
+        if workers > 1 and len(pending) > 1:
+            print(f"🔀 Tải song song bằng {min(workers, len(pending))} luồng")
+            results.update(self.download_reports_parallel(
+                page, pending, page.context.storage_state(), home_url, min(workers, len(pending))
+            ))
+        else:
+            for idx, report in pending:
+                results[idx] = self.download_one_report(page, report)
+                page = self.live_page(page)
+
+        return results
+
+    def download_reports_parallel(self, page, pending, storage_state, home_url, workers):
+        """
+        Tải báo cáo song song:
+        - Trang chính (đã đăng nhập + điều hướng) là worker đầu tiên
+        - Mỗi worker còn lại chạy trong thread riêng với driver Playwright riêng (sync API gắn với thread),
+          kết nối CDP tới Chromium dùng chung (shared_browser_for_workers) và mở context riêng từ
+          storage_state của lần đăng nhập (không cần đăng nhập lại)
+        - Các worker lấy báo cáo từ hàng đợi chung qua select_kpi_and_download
+        pending: list các (số thứ tự, báo cáo)
+        Trả về dict {số thứ tự: True/False}
+        """
+        jobs = queue.Queue()
+        for job in pending:
+            jobs.put(job)
+        results = {}
+
+        threads = []
+        for worker_id in range(2, workers + 1):
+            thread = threading.Thread(
+                target=self._download_worker,
+                args=(worker_id, jobs, results, storage_state, home_url),
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+
+        # Worker 1 dùng luôn trang chính của luồng hiện tại
+        self._consume_download_jobs(page, jobs, results)
+
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def _download_worker(self, worker_id, jobs, results, storage_state, home_url):
+        """
+        Worker tải báo cáo trong thread riêng (Playwright sync API không dùng chung giữa các thread)
+        launch_browser kết nối tới Chromium dùng chung nếu có, không thì worker mở Chromium của riêng nó
+        Nếu không khởi tạo được trang, worker thoát và các báo cáo còn lại do worker khác xử lý
+        """
+        try:
+            with sync_playwright() as p:
+                browser = self.launch_browser(p)
                 try:
-                    dhtc_option = self.get_locator(page, f'//option[contains(text(), "{kpi_text}")]')
-                    dhtc_option.click()
-                except Exception as e2:
+                    context = self.new_browser_context(browser, storage_state)
+                    page = context.new_page()
+
+                    if not self.open_authenticated_page(page, home_url):
+                        print(f"⚠️ Worker {worker_id}: không mở được phiên đăng nhập")
+                        return
+                    with self.tracer.span("navigate"):
+                        navigation_success = self.navigate_to_reports(page)
+                    if not navigation_success:
+                        print(f"⚠️ Worker {worker_id}: điều hướng thất bại")
+                        return
+
+                    self._consume_download_jobs(page, jobs, results)
+                finally:
                     try:
-                        dhtc_option = self.get_locator(page, f'//option[contains(text(), "{kpi_text.split()[0]}")]')
-                        dhtc_option.click()
-                    except Exception as e3:
-                        return False
+                        browser.close()
+                    except:
+                        pass
+        except Exception as e:
+            print(f"⚠️ Worker {worker_id}: lỗi browser: {str(e)}")
 
-            selected_text = kpi_dropdown.locator('option:checked').inner_text()
-            if kpi_text in selected_text or kpi_text.split()[0] in selected_text:
-                return self.click_search_and_download(page, custom_filename=short_name)
+    def _consume_download_jobs(self, page, jobs, results):
+        """
+        Lấy lần lượt báo cáo từ hàng đợi cho tới khi hết
+        """
+        while True:
+            try:
+                idx, report = jobs.get_nowait()
+            except queue.Empty:
+                return
+            results[idx] = self.download_one_report(page, report)
+            page = self.live_page(page)
+
+    def record_export_request(self, page, download, requests):
+        """
+        Ghi lại request export mà nút Search đã gửi (URL, method, header, các trường form)
+        và tên trường KPI trong request để gửi lại cho các báo cáo sau
+        """
+        try:
+            kpi_dropdown = self.get_locator(page, self.config['selectors']['kpi_dropdown'])
+            kpi_value = kpi_dropdown.input_value()
+            kpi_field_name = kpi_dropdown.get_attribute('name')
+            kpi_options = kpi_dropdown.evaluate(
+                "el => Array.from(el.options).map(o => [o.text.trim(), o.value])"
+            )
+
+            # Ưu tiên request trùng URL file tải về, nếu không có thì lấy request POST cuối cùng
+            export_request = None
+            for request in reversed(requests):
+                if request.url == download.url:
+                    export_request = request
+                    break
+            if export_request is None:
+                for request in reversed(requests):
+                    if request.method == 'POST' and request.post_data:
+                        export_request = request
+                        break
+            if export_request is None:
+                return
+
+            url_parts = urlsplit(export_request.url)
+            query_fields = parse_qsl(url_parts.query, keep_blank_values=True)
+            headers = {
+                key: value for key, value in export_request.headers.items()
+                if key.lower() not in ('cookie', 'content-length', 'host')
+            }
+            body_fields = []
+            if export_request.post_data:
+                if 'application/x-www-form-urlencoded' not in headers.get('content-type', ''):
+                    return  # Chỉ hỗ trợ form urlencoded
+                body_fields = parse_qsl(export_request.post_data, keep_blank_values=True)
+
+            kpi_keys = self.find_kpi_field_keys(query_fields + body_fields, kpi_value, kpi_field_name)
+            if not kpi_keys:
+                print("⚠️ Không xác định được trường KPI trong request export, tải qua giao diện")
+                return
+
+            self.export_template = {
+                'url': urlunsplit(url_parts._replace(query='')),
+                'method': export_request.method,
+                'headers': headers,
+                'query_fields': query_fields,
+                'body_fields': body_fields,
+                'kpi_keys': kpi_keys,
+                'kpi_options': kpi_options
+            }
+            print("📝 Đã ghi lại request export")
+        except Exception as e:
+            print(f"⚠️ Không ghi lại được request export: {e}")
+
+    def find_kpi_field_keys(self, fields, kpi_value, kpi_field_name):
+        """
+        Tên trường chứa KPI trong request export:
+        - Có trường trùng thuộc tính name của dropdown KPI (và mang giá trị KPI) thì dùng trường đó
+        - Không thì chỉ chấp nhận khi đúng một tên trường mang giá trị KPI (giá trị ngắn như "1" có thể
+          trùng trường trang/loại/cờ khác) - nhiều hơn thì trả về None để tải qua giao diện
+        """
+        matching_keys = {key for key, value in fields if value == kpi_value}
+        if kpi_field_name and kpi_field_name in matching_keys:
+            return [kpi_field_name]
+        if len(matching_keys) == 1:
+            return list(matching_keys)
+        return None
+
+    def find_kpi_option_value(self, kpi_text):
+        """
+        Tìm value của option KPI theo tên (cùng thứ tự so khớp với select_kpi_and_download)
+        """
+        options = self.export_template['kpi_options']
+        for text, value in options:
+            if text == kpi_text:
+                return value
+        for text, value in options:
+            if kpi_text in text:
+                return value
+        first_word = kpi_text.split()[0] if kpi_text.split() else kpi_text
+        for text, value in options:
+            if first_word in text:
+                return value
+        return None
+
+    def build_export_request(self, kpi_value):
+        """
+        Tạo lại request export với KPI mới: chỉ thay giá trị các trường KPI đã ghi lại
+        (tháng và các trường khác giữ nguyên như lúc ghi lại)
+        """
+        template = self.export_template
+        kpi_keys = set(template['kpi_keys'])
+
+        def replace_kpi(fields):
+            return [
+                (key, kpi_value if key in kpi_keys else value)
+                for key, value in fields
+            ]
+
+        url = template['url']
+        query_fields = replace_kpi(template['query_fields'])
+        if query_fields:
+            url = f"{url}?{urlencode(query_fields)}"
+        body = urlencode(replace_kpi(template['body_fields'])) if template['body_fields'] else None
+        return url, body
+
+    def download_reports_direct(self, storage_state, pending, workers):
+        """
+        Tải báo cáo bằng cách gửi lại request export qua APIRequestContext của Playwright
+        (dùng cookie phiên đăng nhập, giữ kết nối keep-alive trong mỗi context)
+        Chạy song song theo download_workers, trả về dict {số thứ tự: True/False}
+        """
+        jobs = queue.Queue()
+        for job in pending:
+            jobs.put(job)
+        results = {}
+
+        threads = []
+        for worker_id in range(1, max(1, workers) + 1):
+            thread = threading.Thread(
+                target=self._direct_export_worker,
+                args=(worker_id, jobs, results, storage_state),
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def _direct_export_worker(self, worker_id, jobs, results, storage_state):
+        """
+        Worker gửi request export, mỗi worker có một APIRequestContext riêng
+        """
+        try:
+            with sync_playwright() as p:
+                request_context = p.request.new_context(storage_state=storage_state)
+                try:
+                    while True:
+                        try:
+                            idx, report = jobs.get_nowait()
+                        except queue.Empty:
+                            return
+                        with self.tracer.span("direct_fetch", short_name=report['short_name']) as span:
+                            results[idx] = self.fetch_report_direct(
+                                request_context, report['report_name'], report['short_name']
+                            )
+                            span['success'] = results[idx]
+                finally:
+                    request_context.dispose()
+        except Exception as e:
+            print(f"⚠️ Worker export {worker_id}: {str(e)}")
+
+    def fetch_report_direct(self, request_context, kpi_text, short_name):
+        """
+        Gửi request export cho một KPI và lưu file nếu server trả về file xlsx
+        """
+        kpi_value = self.find_kpi_option_value(kpi_text)
+        if kpi_value is None:
+            return False
+
+        url, body = self.build_export_request(kpi_value)
+        try:
+            response = request_context.fetch(
+                url,
+                method=self.export_template['method'],
+                headers=self.export_template['headers'],
+                data=body,
+                timeout=180000
+            )
+            content = response.body()
+            # File xlsx là file zip - bắt đầu bằng "PK"
+            if not response.ok or not content.startswith(b"PK"):
+                return False
+            download_path = self.daily_output_dir / f"{short_name}.xlsx"
+            with open(download_path, 'wb') as f:
+                f.write(content)
+            self.on_report_saved(short_name, download_path)
+            return True
+        except Exception:
+            return False
+
+    def open_authenticated_page(self, page, home_url):
+        """
+        Mở trang sau đăng nhập bằng session có sẵn trong context
+        Nếu session không dùng được thì đăng nhập lại trên trang này
+        """
+        try:
+            page.goto(home_url)
+            dashboard_indicator = self.get_locator(page, self.config['selectors']['dashboard_indicator'])
+            self.smart_wait_for_element(dashboard_indicator, 'visible')
+            return True
+        except Exception:
+            return self.login_to_website(page)
+
+    def download_one_report(self, page, report, record_export=False):
+        """
+        Tải một báo cáo qua giao diện, ghi span "report" vào trace
+        """
+        with self.tracer.span("report", short_name=report['short_name']) as span:
+            success = self.select_kpi_and_download(
+                page, report['report_name'], report['short_name'], record_export=record_export
+            )
+            span['success'] = success
+            return success
+
+    def select_kpi_and_download(self, page, kpi_text, short_name, record_export=False):
+        """
+        Chọn KPI theo tên (kpi_text), tải file và đặt tên theo short_name
+        record_export=True: ghi lại request export để dùng cho chế độ direct_export
+        """
+        try:
+            if not self.relogin_if_needed(page):
+                return False
+
+            with self.tracer.span("select_kpi", short_name=short_name):
+                kpi_selected = self.select_kpi_option(page, kpi_text)
+            if kpi_selected:
+                return self.click_search_and_download(
+                    page, custom_filename=short_name, record_export=record_export, kpi_text=kpi_text
+                )
             else:
                 return False
         except PlaywrightTimeoutError:
@@ -261,6 +860,28 @@ class OrderChecker:
         except Exception as e:
             return False
 
+    def select_kpi_option(self, page, kpi_text):
+        """
+        Chọn option KPI theo tên và kiểm tra lại option đang được chọn
+        """
+        kpi_dropdown = self.get_locator(page, self.config['selectors']['kpi_dropdown'])
+        kpi_dropdown.click()
+        try:
+            kpi_dropdown.select_option(label=kpi_text)
+        except Exception as e:
+            try:
+                dhtc_option = self.get_locator(page, f'//option[contains(text(), "{kpi_text}")]')
+                dhtc_option.click()
+            except Exception as e2:
+                try:
+                    dhtc_option = self.get_locator(page, f'//option[contains(text(), "{kpi_text.split()[0]}")]')
+                    dhtc_option.click()
+                except Exception as e3:
+                    return False
+
+        selected_text = kpi_dropdown.locator('option:checked').inner_text()
+        return kpi_text in selected_text or kpi_text.split()[0] in selected_text
+
     def load_or_create_config(self):
         """
         Tải hoặc tạo file config.json
@@ -349,7 +970,34 @@ class OrderChecker:
             "settings": {
                 "wait_timeout": 30000,
                 "auto_wait": True,
-                "fast_mode": False
+                "fast_mode": False,
+                "download_workers": 1,
+                "session_cache": True,
+                "session_check_timeout": 5000,
+                "direct_export": False,
+                "pipeline_processing": True,
+                "waits": dict(DEFAULT_WAIT_TIMEOUTS),
+                "retry": dict(DEFAULT_RETRY_SETTINGS),
+                "network_filter": {
+                    "enabled": False,
+                    "block_resource_types": ["image", "font", "media"],
+                    "deny_url_patterns": ["*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*"],
+                    "allow_url_patterns": []
+                },
+                "engine": "sync",
+                "async_concurrency": 3,
+                "trace": True,
+                "excel_workers": 1,
+                "excel_file_timeout": 600,
+                "excel_manifest": True,
+                "history_index": True,
+                "daemon": {
+                    "schedule": [],
+                    "port": 8765,
+                    "recycle_after_runs": 20,
+                    "recycle_after_minutes": 240,
+                    "recycle_on_failure": True
+                }
             }
         }
         
@@ -372,9 +1020,8 @@ class OrderChecker:
             selectors = self.config['selectors']
             timeout = self.config['settings']['wait_timeout']
             
-            # Mở trang đăng nhập
-            page.goto(url)
-            page.wait_for_load_state('networkidle')
+            # Mở trang đăng nhập (không chờ networkidle - chờ trực tiếp ô username bên dưới)
+            page.goto(url, wait_until='domcontentloaded')
             
             # Tìm và điền username
             try:
@@ -412,6 +1059,100 @@ class OrderChecker:
         except Exception as e:
             return False
 
+    def load_session_state(self):
+        """
+        Đọc phiên đăng nhập đã lưu (cookies/localStorage) từ input/session_state.json
+        Trả về dict {'home_url', 'storage_state'} hoặc None nếu chưa có / đã tắt
+        """
+        settings = self.config.get('settings', {})
+        if not settings.get('session_cache', True) or not self.session_file.exists():
+            return None
+        try:
+            with open(self.session_file, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            if session.get('home_url') and session.get('storage_state'):
+                return session
+        except Exception:
+            pass
+        return None
+
+    def save_session_state(self, page):
+        """
+        Lưu phiên đăng nhập hiện tại để các lần chạy sau không cần đăng nhập lại
+        """
+        settings = self.config.get('settings', {})
+        if not settings.get('session_cache', True):
+            return
+        try:
+            self.write_session_file(page.url, page.context.storage_state())
+        except Exception as e:
+            print(f"⚠️ Không lưu được phiên đăng nhập: {e}")
+
+    def write_session_file(self, home_url, storage_state):
+        """
+        Ghi phiên đăng nhập ra input/session_state.json
+        """
+        session = {
+            'home_url': home_url,
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            'storage_state': storage_state
+        }
+        with self._session_lock:
+            with open(self.session_file, 'w', encoding='utf-8') as f:
+                json.dump(session, f, ensure_ascii=False)
+
+    def is_session_valid(self, page, session):
+        """
+        Kiểm tra nhanh phiên đã lưu: mở trang sau đăng nhập và chờ dashboard_indicator
+        với timeout ngắn (settings.session_check_timeout, mặc định 5 giây)
+        """
+        timeout = self.config.get('settings', {}).get('session_check_timeout', 5000)
+        try:
+            page.goto(session['home_url'], wait_until='domcontentloaded')
+            dashboard_indicator = self.get_locator(page, self.config['selectors']['dashboard_indicator'])
+            dashboard_indicator.wait_for(state='visible', timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    def ensure_logged_in(self, page, session=None):
+        """
+        Dùng lại phiên đã lưu nếu còn hiệu lực, nếu không thì đăng nhập và lưu phiên mới
+        """
+        if session and self.is_session_valid(page, session):
+            print("🔑 Dùng lại phiên đăng nhập đã lưu")
+            return True
+
+        if not self.login_to_website(page):
+            return False
+        self.save_session_state(page)
+        return True
+
+    def is_logged_out(self, page):
+        """
+        Phiên hết hạn giữa chừng thì trang bị chuyển về form đăng nhập
+        Kiểm tra không chờ: ô username đang hiển thị hay không
+        """
+        try:
+            username_field = self.get_locator(page, self.config['selectors']['username_field'])
+            return username_field.count() > 0 and username_field.first.is_visible()
+        except Exception:
+            return False
+
+    def relogin_if_needed(self, page):
+        """
+        Nếu phiên hết hạn: đăng nhập lại, lưu phiên mới và điều hướng lại trang báo cáo
+        Trả về False nếu phiên hết hạn và không đăng nhập lại được
+        """
+        if not self.is_logged_out(page):
+            return True
+
+        print("🔑 Phiên đăng nhập hết hạn, đang đăng nhập lại...")
+        if not self.login_to_website(page):
+            return False
+        self.save_session_state(page)
+        return self.navigate_to_reports(page)
+
     def navigate_to_reports(self, page):
         """
         Điều hướng đến trang báo cáo sau khi đăng nhập thành công
@@ -419,18 +1160,18 @@ class OrderChecker:
         try:
             menu_item_638 = self.get_locator(page, self.config['selectors']['menu_638'])
             menu_item_638.click()
-            page.wait_for_load_state('networkidle')
 
             dms_report_kpi = self.get_locator(page, self.config['selectors']['dms_report_kpi'])
+            self.wait_for_condition('submenu_visible', lambda t: dms_report_kpi.wait_for(state='visible', timeout=t))
             dms_report_kpi.click()
 
             rpt_kpi_staff = self.get_locator(page, self.config['selectors']['rpt_kpi_staff'])
+            self.wait_for_condition('submenu_visible', lambda t: rpt_kpi_staff.wait_for(state='attached', timeout=t))
             try:
                 rpt_kpi_staff.scroll_into_view_if_needed()
             except:
                 pass
-            rpt_kpi_staff.click()
-            page.wait_for_load_state('networkidle')
+            self.click_and_wait_for_report(page, rpt_kpi_staff)
             return True
         except PlaywrightTimeoutError:
             return False
@@ -490,89 +1231,274 @@ class OrderChecker:
             print(f"❌ KPI selection error: {e}")
             return False
 
+    def get_report_month(self):
+        """
+        Tháng/năm báo cáo = ngày hiện tại lùi 1 ngày, tính một lần cho cả lần chạy
+        """
+        if self.report_month is None:
+            yesterday = datetime.now() - timedelta(days=1)
+            self.report_month = (yesterday.year, yesterday.month)
+        return self.report_month
+
     def select_month_year_before_search(self, page):
         """
         Chọn tháng/năm trước khi click search
         Chọn ngày hiện tại lùi 1 ngày để xác định tháng/năm
+        - Lần đầu: chọn bằng month picker và ghi nhớ giá trị fromMonth đã xác nhận
+        - Các báo cáo sau: fromMonth đã đúng thì bỏ qua, nếu bị reset (reload trang)
+          thì gán lại giá trị đã nhớ trong 1 lần page.evaluate (kèm sự kiện input/change)
+        - Gán trực tiếp không được thì quay về month picker
         """
         try:
-            from datetime import datetime, timedelta
-            
-            # Tính ngày hiện tại lùi 1 ngày
-            yesterday = datetime.now() - timedelta(days=1)
-            target_year = yesterday.year
-            target_month = yesterday.month
-            
-            print(f"📅 Chọn tháng/năm: {target_month}/{target_year}")
-            
-            # Bước 1: Click vào field fromMonth để mở month/year picker
+            target_year, target_month = self.get_report_month()
             from_month_field = self.get_locator(page, self.config['selectors']['from_month_field'])
-            from_month_field.click()
-            page.wait_for_timeout(1000)  # Đợi picker hiện lên
-            
-            # Bước 2: Chọn năm
-            year_selector = self.get_locator(page, self.config['selectors']['month_year_picker_year'])
-            year_selector.select_option(value=str(target_year))
-            print(f"✅ Đã chọn năm: {target_year}")
-            page.wait_for_timeout(500)
             
-            # Bước 3: Chọn tháng
-            month_selector_template = self.config['selectors']['month_year_picker_month']
-            month_selector = month_selector_template.format(month=target_month)
-            month_element = self.get_locator(page, month_selector)
-            month_element.click()
-            print(f"✅ Đã chọn tháng: T{target_month}")
-            page.wait_for_timeout(1000)
+            if self.report_month_value:
+                if from_month_field.input_value() == self.report_month_value:
+                    return True
+                if self.set_month_value_directly(from_month_field, self.report_month_value):
+                    return True
             
+            print(f"📅 Chọn tháng/năm: {target_month}/{target_year}")
+            if self.pick_month_with_picker(page, from_month_field, target_year, target_month):
+                # Giá trị đã xác nhận đúng tháng/năm - ghi nhớ cho các báo cáo sau
+                with self._month_lock:
+                    self.report_month_value = from_month_field.input_value()
             return True
             
         except Exception as e:
             print(f"❌ Lỗi chọn tháng/năm: {str(e)}")
             return False
 
-    def click_search_and_download(self, page, custom_filename=None):
+    def set_month_value_directly(self, from_month_field, value):
+        """
+        Gán giá trị fromMonth trong 1 bước và phát sự kiện input/change như khi người dùng chọn
+        Trả về True nếu giá trị sau khi gán đúng như mong muốn
+        """
+        try:
+            applied_value = from_month_field.evaluate(
+                """(el, value) => {
+                    el.value = value;
+                    el.dispatchEvent(new Event('input', { bubbles: true }));
+                    el.dispatchEvent(new Event('change', { bubbles: true }));
+                    return el.value;
+                }""",
+                value
+            )
+            return applied_value == value
+        except Exception:
+            return False
+
+    def pick_month_with_picker(self, page, from_month_field, target_year, target_month):
+        """
+        Chọn tháng/năm qua month picker
+        Trả về True nếu xác nhận được fromMonth đã nhận tháng/năm mới
+        """
+        # Bước 1: Click vào field fromMonth để mở month/year picker
+        from_month_field.click()
+        year_selector = self.get_locator(page, self.config['selectors']['month_year_picker_year'])
+        self.wait_for_condition('picker_visible', lambda t: year_selector.wait_for(state='visible', timeout=t))
+        
+        # Bước 2: Chọn năm
+        year_selector.select_option(value=str(target_year))
+        print(f"✅ Đã chọn năm: {target_year}")
+        
+        # Bước 3: Chọn tháng (chờ ô tháng của năm vừa chọn hiển thị)
+        month_selector_template = self.config['selectors']['month_year_picker_month']
+        month_selector = month_selector_template.format(month=target_month)
+        month_element = self.get_locator(page, month_selector)
+        self.wait_for_condition('picker_month_visible', lambda t: month_element.wait_for(state='visible', timeout=t))
+        month_element.click()
+        print(f"✅ Đã chọn tháng: T{target_month}")
+        
+        # Chờ giá trị fromMonth được cập nhật (không bắt buộc - định dạng giá trị tùy trang)
+        return self.wait_for_condition(
+            'month_applied',
+            lambda t: from_month_field.evaluate(
+                """(el, [m, y]) => new Promise((resolve, reject) => {
+                    const deadline = Date.now() + %d;
+                    const check = () => {
+                        const nums = ((el.value || '').match(/\\d+/g) || []).map(Number);
+                        if (nums.includes(m) && nums.includes(y)) return resolve(true);
+                        if (Date.now() > deadline) return reject(new Error('month not applied'));
+                        requestAnimationFrame(check);
+                    };
+                    check();
+                })""" % t,
+                [target_month, target_year]
+            ),
+            required=False
+        )
+
+    def click_search_and_download(self, page, custom_filename=None, record_export=False, kpi_text=None):
         """
         Click nút Search và xử lý download file với retry logic
         Nếu custom_filename được truyền vào thì đặt tên file tải về theo tên này
+        record_export=True: ghi lại request mà nút Search gửi đi (xem record_export_request)
+        kpi_text: tên KPI đang chọn, dùng để chọn lại KPI khi khôi phục (xem recover_for_retry)
         """
-        max_retries = 3
-        for attempt in range(1, max_retries + 1):
+        retry_settings = self.get_retry_settings()
+        max_attempts = retry_settings['max_attempts']
+        tier = 1
+        error = None
+        for attempt in range(1, max_attempts + 1):
+            failed_step = None
+            error = None
             try:
                 # Bước mới: Chọn tháng/năm trước khi search
-                month_year_success = self.select_month_year_before_search(page)
+                with self.tracer.span("select_month", short_name=custom_filename):
+                    month_year_success = self.select_month_year_before_search(page)
                 if not month_year_success:
-                    print(f"   ❌ Không thể chọn tháng/năm, thử lại lần {attempt}")
-                    if attempt < max_retries:
-                        if self.retry_navigation_from_menu(page):
-                            continue
-                    return False
-                
-                search_button = self.get_locator(page, self.config['selectors']['search_button'])
-                if custom_filename:
-                    download_path = self.daily_output_dir / f"{custom_filename}.xlsx"
+                    failed_step = 'month'
+                    print(f"   ❌ Không thể chọn tháng/năm (lần {attempt})")
                 else:
-                    download_path = self.daily_output_dir / f"report_{int(time.time())}.xlsx"
-                with page.expect_download(timeout=180000) as download_info:
-                    search_button.click()
-                download = download_info.value
-                download.save_as(str(download_path))
-                if download_path.exists() and download_path.stat().st_size > 0:
-                    return True
-                else:
-                    if attempt < max_retries:
-                        if self.retry_navigation_from_menu(page):
-                            continue
-                    print(f"❌ Tải thất bại: {custom_filename or download_path.name}")
-                    return False
+                    failed_step = 'download'
+                    search_button = self.get_locator(page, self.config['selectors']['search_button'])
+                    if custom_filename:
+                        download_path = self.daily_output_dir / f"{custom_filename}.xlsx"
+                    else:
+                        download_path = self.daily_output_dir / f"report_{int(time.time())}.xlsx"
+                    captured_requests = []
+                    on_request = captured_requests.append
+                    if record_export:
+                        page.on("request", on_request)
+                    try:
+                        with self.tracer.span("export_wait", short_name=custom_filename, attempt=attempt):
+                            with page.expect_download(timeout=180000) as download_info:
+                                search_button.click()
+                    finally:
+                        if record_export:
+                            page.remove_listener("request", on_request)
+                    download = download_info.value
+                    if record_export:
+                        self.record_export_request(page, download, captured_requests)
+                    with self.tracer.span("save_as", short_name=custom_filename):
+                        download.save_as(str(download_path))
+                    if download_path.exists() and download_path.stat().st_size > 0:
+                        self.on_report_saved(custom_filename, download_path)
+                        return True
             except Exception as e:
-                if attempt < max_retries:
-                    if self.retry_navigation_from_menu(page):
-                        continue
-                else:
-                    print(f"❌ Tải thất bại: {custom_filename or 'Unknown'} - Lỗi: {str(e)}")
-                    return False
+                error = e
+
+            if attempt >= max_attempts:
+                break
+            if not self.take_retry_budget():
+                print("   ⚠️ Đã dùng hết số lần thử lại cho phép của lần chạy")
+                break
+            # Khôi phục ở cấp hiện tại, lên cấp sau khi cấp này thất bại (không Search trên trang hỏng)
+            # hoặc khi lần thử ngay sau lần khôi phục ở cấp này vẫn lỗi
+            recovered_page = None
+            while tier <= RECOVERY_TIERS:
+                with self.tracer.span("recover", short_name=custom_filename, attempt=attempt,
+                                      failed_step=failed_step, tier=tier) as span:
+                    self.retry_backoff(attempt, retry_settings)
+                    recovered_page = self.recover_for_retry(page, tier, failed_step, kpi_text)
+                    span['success'] = recovered_page is not None
+                if recovered_page is not None:
+                    break
+                tier += 1
+            if recovered_page is None:
+                print("   ❌ Không khôi phục được trang báo cáo")
+                break
+            page = recovered_page
+            tier = min(tier + 1, RECOVERY_TIERS)
+
+        if error is not None:
+            print(f"❌ Tải thất bại: {custom_filename or 'Unknown'} - Lỗi: {str(error)}")
+        else:
+            print(f"❌ Tải thất bại: {custom_filename or 'Unknown'}")
         return False
-    
+
+    def get_retry_settings(self):
+        """
+        Cấu hình retry từ settings.retry (giá trị thiếu dùng mặc định)
+        """
+        retry_settings = dict(DEFAULT_RETRY_SETTINGS)
+        retry_settings.update(self.config.get('settings', {}).get('retry', {}))
+        return retry_settings
+
+    def reset_retry_budget(self):
+        """
+        Đặt lại tổng số lần thử lại cho phép trong một lần chạy (settings.retry.run_budget)
+        """
+        self.retry_budget_left = int(self.get_retry_settings()['run_budget'])
+
+    def take_retry_budget(self):
+        """
+        Lấy 1 lần thử lại từ ngân sách chung của lần chạy, trả về False nếu đã hết
+        Ngân sách dùng chung giữa các worker để một KPI lỗi không chiếm hết thời gian chạy
+        """
+        with self._retry_lock:
+            if self.retry_budget_left is None:
+                self.retry_budget_left = int(self.get_retry_settings()['run_budget'])
+            if self.retry_budget_left <= 0:
+                return False
+            self.retry_budget_left -= 1
+            return True
+
+    def retry_backoff(self, attempt, retry_settings):
+        """
+        Chờ trước khi thử lại: tăng theo cấp số nhân, có jitter để các worker không thử lại cùng lúc
+        """
+        delay_ms = min(
+            retry_settings['backoff_max_ms'],
+            retry_settings['backoff_ms'] * (2 ** (attempt - 1))
+        )
+        time.sleep(delay_ms * random.uniform(0.5, 1.0) / 1000)
+
+    def recover_for_retry(self, page, tier, failed_step, kpi_text):
+        """
+        Khôi phục theo cấp trước khi thử lại (click_search_and_download lên cấp sau khi cấp hiện tại thất bại
+        hoặc lần thử ngay sau nó vẫn lỗi):
+        - Cấp 1: chỉ làm lại bước lỗi (đóng picker / chọn lại KPI rồi click Search lại)
+        - Cấp 2: điều hướng lại từ menu #638 (retry_navigation_from_menu) + chọn lại KPI
+        - Cấp 3: đóng trang, mở trang mới trong cùng context (trang sau đăng nhập) + điều hướng + chọn lại KPI
+        Trả về trang dùng để thử lại (trang mới ở cấp 3), None nếu khôi phục thất bại
+        """
+        try:
+            if tier == 1:
+                print(f"   🔁 Thử lại bước {'chọn tháng' if failed_step == 'month' else 'tải file'}")
+                try:
+                    page.keyboard.press("Escape")  # Đóng picker nếu đang mở dở
+                except Exception:
+                    pass
+                if not self.relogin_if_needed(page):
+                    return None
+            elif tier == 2:
+                print("   🔁 Điều hướng lại từ menu")
+                if not self.retry_navigation_from_menu(page):
+                    return None
+            else:
+                print("   🔁 Mở lại trang từ đầu")
+                context = page.context
+                try:
+                    page.close()
+                except Exception:
+                    pass
+                page = context.new_page()
+                page.goto(self.home_url or self.config['website']['url'], wait_until='domcontentloaded')
+                if not self.relogin_if_needed(page):
+                    return None
+                if not self.navigate_to_reports(page):
+                    return None
+
+            if kpi_text and not self.select_kpi_option(page, kpi_text):
+                return None
+            return page
+        except Exception:
+            return None
+
+    def live_page(self, page):
+        """
+        Trang đang dùng của một worker: nếu trang đã bị đóng khi khôi phục cấp 3 (recover_for_retry)
+        thì lấy trang mới mở trong cùng context (mỗi worker chỉ có một context, một trang)
+        """
+        if page.is_closed():
+            open_pages = [other for other in page.context.pages if not other.is_closed()]
+            if open_pages:
+                return open_pages[-1]
+        return page
+
     def retry_navigation_from_menu(self, page):
         """
         Thực hiện lại navigation từ menu #638 khi retry
@@ -580,33 +1506,35 @@ class OrderChecker:
         try:
             timeout = self.config['settings']['wait_timeout']
             
-            # Refresh page và đợi load
-            page.reload()
-            page.wait_for_load_state('networkidle')
-            page.wait_for_timeout(3000)
+            # Refresh page và chờ menu #638 (hoặc form đăng nhập nếu phiên hết hạn)
+            page.reload(wait_until='domcontentloaded')
+            menu_item_638 = self.get_locator(page, self.config['selectors']['menu_638'])
+            username_field = self.get_locator(page, self.config['selectors']['username_field'])
+            self.wait_for_condition(
+                'menu_visible',
+                lambda t: menu_item_638.or_(username_field).first.wait_for(state='visible', timeout=t)
+            )
+            
+            # Phiên hết hạn thì đăng nhập lại (trang dashboard có sẵn menu #638)
+            if self.is_logged_out(page):
+                print("🔑 Phiên đăng nhập hết hạn, đang đăng nhập lại...")
+                if not self.login_to_website(page):
+                    return False
+                self.save_session_state(page)
             
             # Click menu #638
-            menu_item_638 = self.get_locator(page, self.config['selectors']['menu_638'])
             menu_item_638.wait_for(state='visible', timeout=timeout)
             menu_item_638.click()
             
-            page.wait_for_load_state('networkidle')
-            page.wait_for_timeout(2000)
-            
             # Click DMS_REPORT_KPI
             dms_report_kpi = self.get_locator(page, self.config['selectors']['dms_report_kpi'])
-            dms_report_kpi.wait_for(state='visible', timeout=timeout)
+            self.wait_for_condition('submenu_visible', lambda t: dms_report_kpi.wait_for(state='visible', timeout=t))
             dms_report_kpi.click()
             
-            page.wait_for_timeout(1000)
-            
             # Click RPT_KPI_STAFF
             rpt_kpi_staff = self.get_locator(page, self.config['selectors']['rpt_kpi_staff'])
-            rpt_kpi_staff.wait_for(state='visible', timeout=timeout)
-            rpt_kpi_staff.click()
-            
-            page.wait_for_load_state('networkidle')
-            page.wait_for_timeout(2000)
+            self.wait_for_condition('submenu_visible', lambda t: rpt_kpi_staff.wait_for(state='visible', timeout=t))
+            self.click_and_wait_for_report(page, rpt_kpi_staff)
             
             # Bỏ việc chọn KPI dropdown ở đây vì sẽ được xử lý trong select_kpi_and_download
             
@@ -615,6 +1543,71 @@ class OrderChecker:
         except Exception as e:
             return False
 
+    def get_wait_timeout(self, name):
+        """
+        Timeout (ms) của từng điều kiện chờ: settings.waits.<name>, nếu không có thì dùng mặc định
+        """
+        waits = self.config.get('settings', {}).get('waits', {})
+        try:
+            return int(waits.get(name, DEFAULT_WAIT_TIMEOUTS.get(name, 10000)))
+        except (TypeError, ValueError):
+            return DEFAULT_WAIT_TIMEOUTS.get(name, 10000)
+
+    def wait_for_condition(self, name, wait_fn, required=True):
+        """
+        Chờ theo điều kiện thay cho sleep cố định
+        - wait_fn(timeout): hàm chờ của Playwright (locator.wait_for, expect_response...)
+        - Ghi lại thời gian chờ thực tế của từng điều kiện vào self.wait_stats
+        - required=False: hết thời gian chờ thì bỏ qua, không báo lỗi
+        """
+        timeout = self.get_wait_timeout(name)
+        start = time.perf_counter()
+        ok = False
+        try:
+            wait_fn(timeout)
+            ok = True
+        except Exception:
+            if required:
+                raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._wait_lock:
+                self.wait_stats.setdefault(name, []).append((elapsed_ms, ok))
+        return ok
+
+    def click_and_wait_for_report(self, page, locator):
+        """
+        Click mở trang báo cáo RPT_KPI_STAFF rồi chờ:
+        - response XHR của trang báo cáo (nếu cấu hình settings.report_xhr_url)
+        - dropdown KPI hiển thị (form báo cáo đã render xong)
+        """
+        xhr_url = self.config.get('settings', {}).get('report_xhr_url')
+        if xhr_url:
+            def click_and_wait_response(timeout):
+                with page.expect_response(lambda response: xhr_url in response.url, timeout=timeout):
+                    locator.click()
+            self.wait_for_condition('report_xhr', click_and_wait_response)
+        else:
+            locator.click()
+
+        kpi_dropdown = self.get_locator(page, self.config['selectors']['kpi_dropdown'])
+        self.wait_for_condition('report_form', lambda t: kpi_dropdown.wait_for(state='visible', timeout=t))
+
+    def print_wait_summary(self):
+        """
+        In thống kê thời gian chờ theo từng điều kiện
+        """
+        if not self.wait_stats:
+            return
+        print("⏱️ Thời gian chờ theo điều kiện:")
+        for name, records in self.wait_stats.items():
+            times = [elapsed for elapsed, _ in records]
+            timeouts = sum(1 for _, ok in records if not ok)
+            line = f"   {name}: {len(records)} lần, TB {sum(times) / len(times):.0f}ms, max {max(times):.0f}ms"
+            if timeouts:
+                line += f", hết giờ {timeouts} lần"
+            print(line)
+
     def smart_wait_for_element(self, locator, state='visible'):
         """
         Smart waiting strategy - sử dụng auto wait hoặc custom timeout
@@ -674,6 +1667,9 @@ def main():
     """
     Hàm main chạy chương trình
     """
+    # Cần cho process pool xử lý Excel khi chạy bản đóng gói (engine async)
+    multiprocessing.freeze_support()
+    
     # Khởi tạo OrderChecker
     checker = OrderChecker()
     
@@ -0,0 +1,557 @@
+"""
+Engine asyncio cho Order Checker (playwright.async_api)
+Đăng nhập, điều hướng, chọn KPI và tải file chạy dưới dạng coroutine trên một event loop:
+- Một trình duyệt, nhiều trang, số báo cáo tải cùng lúc giới hạn bởi semaphore (settings.async_concurrency)
+- Xử lý Excel (openpyxl) chạy trong process pool qua loop.run_in_executor
+- Dùng lại cấu hình, thư mục, phiên đăng nhập, timeout chờ và ngân sách retry của OrderChecker
+"""
+
+import os
+import time
+import random
+import asyncio
+import fnmatch
+from concurrent.futures import ProcessPoolExecutor
+from playwright.async_api import async_playwright
+
+from process_excel import ExcelProcessor, process_excel_file_timed
+from run_trace import RunTracer
+from check_oder import RECOVERY_TIERS
+
+
+class AsyncOrderChecker:
+    def __init__(self, checker):
+        """
+        checker: OrderChecker đã khởi tạo (config, thư mục output theo ngày, đường dẫn Chromium...)
+        """
+        self.checker = checker
+        self.config = checker.config
+        self.pages = []            # Trang đã điều hướng tới form báo cáo, sẵn sàng dùng lại
+        self.process_futures = {}  # short_name -> Future xử lý Excel
+        self.processed_files = {}  # short_name -> đường dẫn file
+        self.manifest_tickets = {} # short_name -> ticket ghi manifest sau khi xử lý xong
+        self.processor = ExcelProcessor(
+            tracer=checker.tracer,
+            use_manifest=self.config.get('settings', {}).get('excel_manifest', True),
+            use_history=self.config.get('settings', {}).get('history_index', True)
+        )
+
+    def run(self, url=None):
+        """
+        Lớp bọc đồng bộ: chạy toàn bộ automation trên event loop mới
+        """
+        return asyncio.run(self.run_async(url))
+
+    async def run_async(self, url=None):
+        """
+        Chạy automation: đăng nhập, tải song song các báo cáo trong template.xlsx, xử lý Excel
+        """
+        checker = self.checker
+        report_list = checker.load_report_list_from_excel()
+        if not report_list:
+            return False
+
+        concurrency = self.get_concurrency(len(report_list))
+        loop = asyncio.get_running_loop()
+
+        try:
+            with ProcessPoolExecutor(max_workers=min(concurrency, os.cpu_count() or 1)) as executor:
+                async with async_playwright() as p:
+                    browser = await self.launch_browser(p)
+
+                    session = checker.load_session_state()
+                    context = await self.new_browser_context(browser, session['storage_state'] if session else None)
+                    page = await context.new_page()
+
+                    with checker.tracer.span("login"):
+                        login_success = await self.ensure_logged_in(page, session)
+                    if not login_success:
+                        print("❌ Đăng nhập thất bại!")
+                        return False
+
+                    checker.home_url = page.url
+                    checker.reset_retry_budget()
+
+                    with checker.tracer.span("navigate"):
+                        navigation_success = await self.navigate_to_reports(page)
+                    if not navigation_success:
+                        print("❌ Điều hướng thất bại!")
+                        return False
+                    self.pages.append(page)
+
+                    print("─" * 60)
+                    print(f"📥 Đang tải báo cáo (async, tối đa {concurrency} báo cáo cùng lúc)...")
+                    semaphore = asyncio.Semaphore(concurrency)
+                    tasks = [
+                        self.download_report(context, semaphore, executor, loop, report)
+                        for report in report_list
+                    ]
+                    download_outcomes = await asyncio.gather(*tasks)
+                    download_results = {idx: ok for idx, ok in enumerate(download_outcomes, 1)}
+
+                    downloaded_count = sum(1 for ok in download_outcomes if ok)
+                    for idx, report in enumerate(report_list, 1):
+                        checker.print_download_result(idx, report['short_name'], download_results[idx])
+                    if downloaded_count:
+                        print(f"✅ Đã tải thành công {downloaded_count} báo cáo")
+                    checker.print_wait_summary()
+                    checker.print_network_filter_summary()
+                    print("─" * 60)
+
+                    try:
+                        await context.close()
+                        await browser.close()
+                    except:
+                        pass
+
+                # Chờ process pool xử lý xong các file còn lại
+                print("\n" + "─" * 60)
+                print("📊 Đang hoàn tất xử lý file Excel...")
+                # File đã xử lý trước đó (theo manifest) không gửi sang process pool
+                process_results = {name: True for name in self.processed_files if name not in self.process_futures}
+                for short_name, future in self.process_futures.items():
+                    try:
+                        result, seconds = await future
+                        if self.is_tracing():
+                            result, events = result
+                            checker.tracer.add_events(events)
+                        if result:
+                            self.processor.record_manifest(self.processed_files[short_name],
+                                                           self.manifest_tickets.get(short_name),
+                                                           seconds, result.rule_stats)
+                        process_results[short_name] = bool(result)
+                    except Exception as e:
+                        print(f"❌ Lỗi xử lý {short_name}: {str(e)}")
+                        process_results[short_name] = False
+
+            processed_files = [self.processed_files[name] for name, ok in process_results.items() if ok]
+            self.processor.finish_files(processed_files)
+
+            checker.print_run_report(report_list, download_results, process_results)
+            checker.save_trace()
+            return all(download_outcomes)
+        except Exception as e:
+            print(f"❌ Lỗi browser: {str(e)}")
+            return False
+
+    def get_concurrency(self, report_count):
+        """
+        Số báo cáo tải cùng lúc (settings.async_concurrency), không vượt quá số báo cáo
+        """
+        try:
+            concurrency = int(self.config.get('settings', {}).get('async_concurrency', 3))
+        except (TypeError, ValueError):
+            concurrency = 3
+        return max(1, min(concurrency, report_count))
+
+    async def launch_browser(self, p):
+        """
+        Khởi động Chromium headless (ưu tiên Chromium đi kèm dự án), hoặc kết nối CDP tới Chromium của daemon
+        """
+        if self.checker.cdp_endpoint:
+            return await p.chromium.connect_over_cdp(self.checker.cdp_endpoint)
+        chromium_path = self.checker.chromium_path
+        if chromium_path and os.path.exists(chromium_path):
+            return await p.chromium.launch(executable_path=chromium_path, headless=True)
+        return await p.chromium.launch(headless=True)
+
+    async def new_browser_context(self, browser, storage_state=None):
+        """
+        Tạo browser context (kèm phiên đăng nhập nếu có) và bật lọc request nếu được cấu hình
+        """
+        if storage_state:
+            context = await browser.new_context(storage_state=storage_state)
+        else:
+            context = await browser.new_context()
+        await self.setup_network_filter(context)
+        return context
+
+    async def setup_network_filter(self, context):
+        """
+        Bản async của OrderChecker.setup_network_filter (cùng cấu hình settings.network_filter)
+        """
+        checker = self.checker
+        network_filter = self.config.get('settings', {}).get('network_filter', {})
+        if not network_filter.get('enabled', False):
+            return
+
+        block_types = set(network_filter.get('block_resource_types', []))
+        deny_patterns = network_filter.get('deny_url_patterns', [])
+        allow_patterns = network_filter.get('allow_url_patterns', [])
+
+        async def handle_route(route):
+            request = route.request
+            url = request.url
+            if not any(fnmatch.fnmatch(url, pattern) for pattern in allow_patterns):
+                if request.resource_type in block_types or any(fnmatch.fnmatch(url, pattern) for pattern in deny_patterns):
+                    blocked = checker.network_stats['blocked']
+                    blocked[request.resource_type] = blocked.get(request.resource_type, 0) + 1
+                    await route.abort()
+                    return
+            await route.continue_()
+
+        def handle_response(response):
+            try:
+                size = int(response.headers['content-length'])
+            except (KeyError, TypeError, ValueError):
+                size = None
+            checker.network_stats['allowed_requests'] += 1
+            if size is None:
+                checker.network_stats['unknown_size'] += 1
+            else:
+                checker.network_stats['content_length_bytes'] += size
+
+        await context.route("**/*", handle_route)
+        context.on("response", handle_response)
+
+    async def wait_for_condition(self, name, wait_fn, required=True):
+        """
+        Bản async của OrderChecker.wait_for_condition: wait_fn(timeout) trả về coroutine
+        """
+        checker = self.checker
+        timeout = checker.get_wait_timeout(name)
+        start = time.perf_counter()
+        ok = False
+        try:
+            await wait_fn(timeout)
+            ok = True
+        except Exception:
+            if required:
+                raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            checker.wait_stats.setdefault(name, []).append((elapsed_ms, ok))
+        return ok
+
+    async def ensure_logged_in(self, page, session=None):
+        """
+        Dùng lại phiên đã lưu nếu còn hiệu lực, nếu không thì đăng nhập và lưu phiên mới
+        """
+        if session:
+            timeout = self.config.get('settings', {}).get('session_check_timeout', 5000)
+            try:
+                await page.goto(session['home_url'], wait_until='domcontentloaded')
+                dashboard_indicator = self.checker.get_locator(page, self.config['selectors']['dashboard_indicator'])
+                await dashboard_indicator.wait_for(state='visible', timeout=timeout)
+                print("🔑 Dùng lại phiên đăng nhập đã lưu")
+                return True
+            except Exception:
+                pass
+
+        if not await self.login_to_website(page):
+            return False
+        await self.save_session_state(page)
+        return True
+
+    async def save_session_state(self, page):
+        """
+        Lưu phiên đăng nhập hiện tại (settings.session_cache)
+        """
+        if not self.config.get('settings', {}).get('session_cache', True):
+            return
+        try:
+            self.checker.write_session_file(page.url, await page.context.storage_state())
+        except Exception as e:
+            print(f"⚠️ Không lưu được phiên đăng nhập: {e}")
+
+    async def login_to_website(self, page):
+        """
+        Đăng nhập vào website sử dụng thông tin từ config
+        """
+        checker = self.checker
+        selectors = self.config['selectors']
+        timeout = self.config.get('settings', {}).get('wait_timeout', 30000)
+        try:
+            await page.goto(self.config['website']['url'], wait_until='domcontentloaded')
+
+            username_field = checker.get_locator(page, selectors['username_field'])
+            await username_field.wait_for(state='visible', timeout=timeout)
+            await username_field.fill(self.config['credentials']['username'])
+
+            password_field = checker.get_locator(page, selectors['password_field'])
+            await password_field.wait_for(state='visible', timeout=timeout)
+            await password_field.fill(self.config['credentials']['password'])
+
+            login_button = checker.get_locator(page, selectors['login_button'])
+            await login_button.wait_for(state='visible', timeout=timeout)
+            await login_button.click()
+
+            dashboard_indicator = checker.get_locator(page, selectors['dashboard_indicator'])
+            await dashboard_indicator.wait_for(state='visible', timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    async def is_logged_out(self, page):
+        """
+        Phiên hết hạn thì trang bị chuyển về form đăng nhập (kiểm tra không chờ)
+        """
+        try:
+            username_field = self.checker.get_locator(page, self.config['selectors']['username_field'])
+            return await username_field.count() > 0 and await username_field.first.is_visible()
+        except Exception:
+            return False
+
+    async def relogin_if_needed(self, page):
+        """
+        Nếu phiên hết hạn: đăng nhập lại, lưu phiên mới và điều hướng lại trang báo cáo
+        """
+        if not await self.is_logged_out(page):
+            return True
+        print("🔑 Phiên đăng nhập hết hạn, đang đăng nhập lại...")
+        if not await self.login_to_website(page):
+            return False
+        await self.save_session_state(page)
+        return await self.navigate_to_reports(page)
+
+    async def navigate_to_reports(self, page):
+        """
+        Điều hướng đến trang báo cáo: menu #638 → DMS_REPORT_KPI → RPT_KPI_STAFF
+        """
+        checker = self.checker
+        selectors = self.config['selectors']
+        try:
+            menu_item_638 = checker.get_locator(page, selectors['menu_638'])
+            await menu_item_638.click()
+
+            dms_report_kpi = checker.get_locator(page, selectors['dms_report_kpi'])
+            await self.wait_for_condition('submenu_visible', lambda t: dms_report_kpi.wait_for(state='visible', timeout=t))
+            await dms_report_kpi.click()
+
+            rpt_kpi_staff = checker.get_locator(page, selectors['rpt_kpi_staff'])
+            await self.wait_for_condition('submenu_visible', lambda t: rpt_kpi_staff.wait_for(state='attached', timeout=t))
+            try:
+                await rpt_kpi_staff.scroll_into_view_if_needed()
+            except:
+                pass
+            await rpt_kpi_staff.click()
+
+            kpi_dropdown = checker.get_locator(page, selectors['kpi_dropdown'])
+            await self.wait_for_condition('report_form', lambda t: kpi_dropdown.wait_for(state='visible', timeout=t))
+            return True
+        except Exception:
+            return False
+
+    async def acquire_page(self, context):
+        """
+        Lấy một trang đã ở form báo cáo, nếu hết thì mở trang mới trong cùng context (dùng chung cookie)
+        """
+        if self.pages:
+            return self.pages.pop()
+        page = await context.new_page()
+        await page.goto(self.checker.home_url, wait_until='domcontentloaded')
+        if not await self.relogin_if_needed(page) or not await self.navigate_to_reports(page):
+            await page.close()
+            return None
+        return page
+
+    async def download_report(self, context, semaphore, executor, loop, report):
+        """
+        Tải một báo cáo (giới hạn số báo cáo chạy cùng lúc bằng semaphore)
+        Tải xong thì gửi file sang process pool xử lý Excel ngay
+        """
+        async with semaphore:
+            page = await self.acquire_page(context)
+            if page is None:
+                return False
+            download_path = None
+            try:
+                with self.checker.tracer.span("report", short_name=report['short_name']) as span:
+                    download_path, page = await self.select_kpi_and_download(
+                        page, report['report_name'], report['short_name']
+                    )
+                    span['success'] = download_path is not None
+            finally:
+                if not page.is_closed():
+                    self.pages.append(page)
+
+        if download_path is None:
+            return False
+        short_name = report['short_name']
+        self.processed_files[short_name] = download_path
+        done, self.manifest_tickets[short_name] = self.processor.check_manifest(download_path)
+        if done:
+            return True
+        self.process_futures[short_name] = loop.run_in_executor(
+            executor, process_excel_file_timed, str(download_path), self.is_tracing()
+        )
+        return True
+
+    def is_tracing(self):
+        """
+        Có ghi trace hay không (để process xử lý Excel gửi span về)
+        """
+        return isinstance(self.checker.tracer, RunTracer)
+
+    async def select_kpi_option(self, page, kpi_text):
+        """
+        Chọn option KPI theo tên và kiểm tra lại option đang được chọn
+        """
+        kpi_dropdown = self.checker.get_locator(page, self.config['selectors']['kpi_dropdown'])
+        await kpi_dropdown.click()
+        try:
+            await kpi_dropdown.select_option(label=kpi_text)
+        except Exception:
+            try:
+                await self.checker.get_locator(page, f'//option[contains(text(), "{kpi_text}")]').click()
+            except Exception:
+                try:
+                    await self.checker.get_locator(page, f'//option[contains(text(), "{kpi_text.split()[0]}")]').click()
+                except Exception:
+                    return False
+
+        selected_text = await kpi_dropdown.locator('option:checked').inner_text()
+        return kpi_text in selected_text or kpi_text.split()[0] in selected_text
+
+    async def select_month(self, page):
+        """
+        Chọn tháng/năm báo cáo (cùng cách làm với OrderChecker.select_month_year_before_search):
+        giá trị fromMonth đã xác nhận được nhớ lại và gán trực tiếp cho các báo cáo sau
+        """
+        checker = self.checker
+        selectors = self.config['selectors']
+        target_year, target_month = checker.get_report_month()
+        from_month_field = checker.get_locator(page, selectors['from_month_field'])
+
+        if checker.report_month_value:
+            if await from_month_field.input_value() == checker.report_month_value:
+                return True
+            applied_value = await from_month_field.evaluate(
+                """(el, value) => {
+                    el.value = value;
+                    el.dispatchEvent(new Event('input', { bubbles: true }));
+                    el.dispatchEvent(new Event('change', { bubbles: true }));
+                    return el.value;
+                }""",
+                checker.report_month_value
+            )
+            if applied_value == checker.report_month_value:
+                return True
+
+        await from_month_field.click()
+        year_selector = checker.get_locator(page, selectors['month_year_picker_year'])
+        await self.wait_for_condition('picker_visible', lambda t: year_selector.wait_for(state='visible', timeout=t))
+        await year_selector.select_option(value=str(target_year))
+
+        month_element = checker.get_locator(page, selectors['month_year_picker_month'].format(month=target_month))
+        await self.wait_for_condition('picker_month_visible', lambda t: month_element.wait_for(state='visible', timeout=t))
+        await month_element.click()
+
+        applied = await self.wait_for_condition(
+            'month_applied',
+            lambda t: from_month_field.evaluate(
+                """(el, [m, y]) => new Promise((resolve, reject) => {
+                    const deadline = Date.now() + %d;
+                    const check = () => {
+                        const nums = ((el.value || '').match(/\\d+/g) || []).map(Number);
+                        if (nums.includes(m) && nums.includes(y)) return resolve(true);
+                        if (Date.now() > deadline) return reject(new Error('month not applied'));
+                        requestAnimationFrame(check);
+                    };
+                    check();
+                })""" % t,
+                [target_month, target_year]
+            ),
+            required=False
+        )
+        if applied:
+            checker.report_month_value = await from_month_field.input_value()
+        return True
+
+    async def select_kpi_and_download(self, page, kpi_text, short_name):
+        """
+        Chọn KPI, chọn tháng, click Search và lưu file với retry theo cấp
+        (cùng settings.retry và ngân sách retry chung của OrderChecker)
+        Trả về (đường dẫn file đã lưu hoặc None nếu thất bại, trang đang dùng - trang mới nếu đã khôi phục cấp 3)
+        """
+        checker = self.checker
+        retry_settings = checker.get_retry_settings()
+        max_attempts = retry_settings['max_attempts']
+        download_path = checker.daily_output_dir / f"{short_name}.xlsx"
+        tier = 1
+        error = None
+
+        for attempt in range(1, max_attempts + 1):
+            error = None
+            try:
+                if not await self.relogin_if_needed(page):
+                    ready = False
+                else:
+                    with checker.tracer.span("select_kpi", short_name=short_name):
+                        ready = await self.select_kpi_option(page, kpi_text)
+                    if ready:
+                        with checker.tracer.span("select_month", short_name=short_name):
+                            ready = await self.select_month(page)
+                if ready:
+                    search_button = checker.get_locator(page, self.config['selectors']['search_button'])
+                    with checker.tracer.span("export_wait", short_name=short_name, attempt=attempt):
+                        async with page.expect_download(timeout=180000) as download_info:
+                            await search_button.click()
+                        download = await download_info.value
+                    with checker.tracer.span("save_as", short_name=short_name):
+                        await download.save_as(str(download_path))
+                    if download_path.exists() and download_path.stat().st_size > 0:
+                        return download_path, page
+            except Exception as e:
+                error = e
+
+            if attempt >= max_attempts:
+                break
+            if not checker.take_retry_budget():
+                print("   ⚠️ Đã dùng hết số lần thử lại cho phép của lần chạy")
+                break
+            # Khôi phục ở cấp hiện tại, lên cấp sau khi cấp này thất bại hoặc lần thử ngay sau nó vẫn lỗi
+            # (như OrderChecker)
+            recovered_page = None
+            while tier <= RECOVERY_TIERS:
+                with checker.tracer.span("recover", short_name=short_name, attempt=attempt, tier=tier) as span:
+                    delay_ms = min(retry_settings['backoff_max_ms'], retry_settings['backoff_ms'] * (2 ** (attempt - 1)))
+                    await asyncio.sleep(delay_ms * random.uniform(0.5, 1.0) / 1000)
+                    recovered_page = await self.recover_for_retry(page, tier)
+                    span['success'] = recovered_page is not None
+                if recovered_page is not None:
+                    break
+                tier += 1
+            if recovered_page is None:
+                print(f"   ❌ Không khôi phục được trang báo cáo: {short_name}")
+                break
+            page = recovered_page
+            tier = min(tier + 1, RECOVERY_TIERS)
+
+        if error is not None:
+            print(f"❌ Tải thất bại: {short_name} - Lỗi: {str(error)}")
+        else:
+            print(f"❌ Tải thất bại: {short_name}")
+        return None, page
+
+    async def recover_for_retry(self, page, tier):
+        """
+        Khôi phục theo cấp: cấp 1 chỉ làm lại các bước (KPI/tháng/Search),
+        cấp 2 tải lại trang + điều hướng, cấp 3 đóng trang và mở trang mới từ trang sau đăng nhập
+        Trả về trang dùng để thử lại, None nếu khôi phục thất bại
+        """
+        try:
+            if tier == 1:
+                try:
+                    await page.keyboard.press("Escape")
+                except Exception:
+                    pass
+                return page if await self.relogin_if_needed(page) else None
+            if tier == 2:
+                await page.reload(wait_until='domcontentloaded')
+            else:
+                context = page.context
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+                page = await context.new_page()
+                await page.goto(self.checker.home_url or self.config['website']['url'], wait_until='domcontentloaded')
+            if await self.is_logged_out(page):
+                # relogin_if_needed đã điều hướng lại trang báo cáo sau khi đăng nhập
+                success = await self.relogin_if_needed(page)
+            else:
+                success = await self.navigate_to_reports(page)
+            return page if success else None
+        except Exception:
+            return None
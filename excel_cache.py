@@ -0,0 +1,436 @@
+"""
+Cache dữ liệu báo cáo đã xử lý (output/.report_cache): giá trị các ô của sheet sau khi áp dụng bộ rule,
+mask dòng ẩn và mask dòng bị xóa dữ liệu, theo hash file tải về + phiên bản bộ rule.
+Dữ liệu được ghi ngay trong lượt xử lý file (process_single_excel), các bước sau (file dữ liệu sidecar,
+liệt kê file, chạy lại trong ngày...) đọc từ cache thay vì mở lại file xlsx.
+- Định dạng nhị phân theo cột: mỗi cột là các khối nén zlib (loại giá trị, số nguyên, số thực, mã chuỗi +
+  bảng chuỗi), chỉ giải nén cột cần đọc
+- Tìm lại được theo file đã xử lý: <hash file sau xử lý>.ref trỏ tới entry
+- Tổng dung lượng vượt giới hạn thì xóa entry lâu không dùng nhất
+"""
+
+import os
+import sys
+import json
+import zlib
+import struct
+import threading
+from array import array
+from datetime import datetime, date, time, timedelta
+from pathlib import Path
+
+from excel_manifest import file_hash
+from xlsx_stream import read_sheet_rows
+
+MAGIC = b"XLRC"
+FORMAT_VERSION = 1
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Loại giá trị của ô (khối "tags": 1 byte / dòng)
+_NONE, _INT, _FLOAT, _STR, _BOOL, _DATETIME, _DATE, _TIME = range(8)
+
+
+class _ColumnBuilder:
+    """
+    Giá trị một cột theo dòng: loại giá trị (1 byte/dòng), số nguyên / số thực / mã chuỗi chỉ của ô có giá trị
+    """
+    __slots__ = ('tags', 'ints', 'floats', 'codes', 'strings', 'string_bytes')
+
+    def __init__(self):
+        self.tags = bytearray()
+        self.ints = array('q')
+        self.floats = array('d')
+        self.codes = array('I')
+        self.strings = {}  # chuỗi -> mã
+        self.string_bytes = 0
+
+    def add(self, value):
+        kind = type(value)
+        if value is None:
+            self.tags.append(_NONE)
+        elif kind is str:
+            code = self.strings.get(value)
+            if code is None:
+                code = self.strings[value] = len(self.strings)
+                self.string_bytes += len(value)
+            self.codes.append(code)
+            self.tags.append(_STR)
+        elif kind is float:
+            self.floats.append(value)
+            self.tags.append(_FLOAT)
+        elif kind is bool:
+            self.ints.append(value)
+            self.tags.append(_BOOL)
+        elif kind is int and -(1 << 63) <= value < (1 << 63):
+            self.ints.append(value)
+            self.tags.append(_INT)
+        elif kind is datetime:
+            self.ints.append((value.replace(tzinfo=None) - _EPOCH) // _MICROSECOND)
+            self.tags.append(_DATETIME)
+        elif kind is date:
+            self.ints.append(value.toordinal())
+            self.tags.append(_DATE)
+        elif kind is time:
+            self.ints.append(((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond)
+            self.tags.append(_TIME)
+        else:
+            self.add(str(value))
+
+    def pad(self, count):
+        self.tags.extend(bytes(count))
+
+    @property
+    def size(self):
+        return len(self.tags) + 8 * (len(self.ints) + len(self.floats)) + 4 * len(self.codes) + self.string_bytes
+
+    def blocks(self):
+        strings = json.dumps(list(self.strings), ensure_ascii=False).encode('utf-8')
+        return {
+            'tags': bytes(self.tags),
+            'ints': self.ints.tobytes(),
+            'floats': self.floats.tobytes(),
+            'codes': self.codes.tobytes(),
+            'strings': strings
+        }
+
+
+class ReportCacheWriter:
+    """
+    Nhận các dòng của sheet đã xử lý theo thứ tự (cùng cách gọi với excel_sidecar.SidecarWriter):
+    begin(số cột), wants(dòng, ẩn), add_row(dòng, giá trị, ẩn, khoảng cột bị xóa).
+    Dữ liệu vượt dung lượng tối đa của cache thì bỏ (không ghi entry)
+    """
+    CHECK_ROWS = 4096
+
+    def __init__(self, cache, key, input_hash, rule_set, short_name):
+        self.cache = cache
+        self.key = key
+        self.input_hash = input_hash
+        self.rules_version = rule_set.version
+        self.short_name = short_name
+        self.col_count = 0
+        self.row_count = 0
+        self.last_row = 0          # dòng cuối có giá trị (bỏ các dòng rỗng ở cuối khi ghi)
+        self.columns = []
+        self.adds = []
+        self.hidden = bytearray()
+        self.cleared = array('H')  # cột bắt đầu bị xóa của từng dòng (0 = không xóa)
+
+    def begin(self, col_count):
+        self.col_count = col_count
+        self.columns = [_ColumnBuilder() for _ in range(col_count)]
+        self.adds = [column.add for column in self.columns]
+
+    def wants(self, row_num, hidden):
+        return self.columns is not None
+
+    def add_row(self, row_num, values, hidden=False, cleared=None):
+        """
+        values: giá trị các ô theo cột (phần tử đầu = cột A); cleared: (từ cột, tới cột) nếu dòng bị xóa dữ liệu
+        """
+        if self.columns is None or row_num <= self.row_count:
+            return
+        gap = row_num - self.row_count - 1
+        if gap:
+            for column in self.columns:
+                column.pad(gap)
+            self.hidden.extend(bytes(gap))
+            self.cleared.frombytes(bytes(2 * gap))
+        self.row_count = row_num
+        values = values[:self.col_count]
+        for add, value in zip(self.adds, values):
+            add(value)
+        for column in self.columns[len(values):]:
+            column.tags.append(_NONE)
+        # Dòng không còn giá trị nào coi như không có (dòng trống giữa/sau dữ liệu không ghi nhận bị xóa)
+        has_value = values.count(None) != len(values)
+        if has_value:
+            self.last_row = row_num
+        self.hidden.append(1 if hidden else 0)
+        self.cleared.append(cleared[0] if cleared and has_value else 0)
+
+        if row_num % self.CHECK_ROWS == 0 and self.size > self.cache.max_bytes:
+            print(f"ℹ️ {self.short_name}: dữ liệu vượt dung lượng cache ({self.cache.max_bytes / 1e6:.0f} MB), không lưu cache")
+            self.discard()
+
+    @property
+    def size(self):
+        return len(self.hidden) * 3 + sum(column.size for column in self.columns)
+
+    def close(self, output_file, rule_stats=None):
+        """
+        Ghi entry vào cache (file tạm rồi đổi tên) kèm liên kết theo hash file đã xử lý, trả về đường dẫn entry
+        """
+        if self.columns is None:
+            return None
+        blocks = []
+        offset = 0
+
+        def add_block(data):
+            nonlocal offset
+            packed = zlib.compress(data, 6)
+            blocks.append(packed)
+            position = [offset, len(packed)]
+            offset += len(packed)
+            return position
+
+        self.row_count = self.last_row
+        del self.hidden[self.row_count:]
+        del self.cleared[self.row_count:]
+        columns = []
+        for column in self.columns:
+            del column.tags[self.row_count:]
+            columns.append({name: add_block(data) for name, data in column.blocks().items()})
+        self.columns = None
+        self.adds = []
+        header = {
+            'format': FORMAT_VERSION,
+            'byteorder': sys.byteorder,
+            'short_name': self.short_name,
+            'input_hash': self.input_hash,
+            'rules_version': self.rules_version,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'row_count': self.row_count,
+            'col_count': self.col_count,
+            'rule_hits': {rule_id: stats['hits'] for rule_id, stats in (rule_stats or {}).items()},
+            'hidden': add_block(bytes(self.hidden)),
+            'cleared': add_block(self.cleared.tobytes()),
+            'columns': columns
+        }
+        return self.cache.store(self.key, header, blocks, output_file)
+
+    def discard(self):
+        self.columns = None
+        self.adds = []
+        self.hidden = bytearray()
+        self.cleared = array('H')
+
+
+class CachedReport:
+    """
+    Entry đã lưu trong cache: giá trị theo cột / theo dòng, dòng ẩn, dòng bị xóa dữ liệu.
+    Số dòng, số cột tính từ 1 như trong Excel; cột chỉ được giải nén khi đọc tới
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        data = self.path.read_bytes()
+        magic, header_length = struct.unpack_from('<4sI', data)
+        if magic != MAGIC:
+            raise ValueError("không phải file cache")
+        self.header = json.loads(data[8:8 + header_length].decode('utf-8'))
+        if self.header.get('format') != FORMAT_VERSION:
+            raise ValueError(f"định dạng cache cũ ({self.header.get('format')})")
+        self.data = memoryview(data)[8 + header_length:]
+        self.short_name = self.header['short_name']
+        self.rules_version = self.header['rules_version']
+        self.row_count = self.header['row_count']
+        self.col_count = self.header['col_count']
+        self.rule_hits = self.header.get('rule_hits', {})
+        self._columns = {}
+
+    def _block(self, position):
+        offset, length = position
+        return zlib.decompress(self.data[offset:offset + length])
+
+    def _array(self, typecode, position):
+        values = array(typecode)
+        values.frombytes(self._block(position))
+        if self.header['byteorder'] != sys.byteorder:
+            values.byteswap()
+        return values
+
+    def hidden_mask(self):
+        """
+        bytes theo dòng (phần tử đầu = dòng 1): 1 = dòng ẩn
+        """
+        return self._block(self.header['hidden'])
+
+    def hidden_rows(self):
+        return {idx + 1 for idx, flag in enumerate(self.hidden_mask()) if flag}
+
+    def cleared_rows(self):
+        """
+        {dòng: cột bắt đầu bị xóa dữ liệu}
+        """
+        return {idx + 1: col for idx, col in enumerate(self._array('H', self.header['cleared'])) if col}
+
+    def column(self, col):
+        """
+        Giá trị cột col (1 = A) theo dòng: list, phần tử đầu = dòng 1
+        """
+        if col in self._columns:
+            return self._columns[col]
+        values = [None] * self.row_count
+        if 1 <= col <= self.col_count:
+            blocks = self.header['columns'][col - 1]
+            tags = self._block(blocks['tags'])
+            ints = iter(self._array('q', blocks['ints']))
+            floats = iter(self._array('d', blocks['floats']))
+            strings = json.loads(self._block(blocks['strings']).decode('utf-8'))
+            codes = iter(self._array('I', blocks['codes']))
+            for idx, tag in enumerate(tags):
+                if tag == _NONE:
+                    continue
+                if tag == _STR:
+                    values[idx] = strings[next(codes)]
+                elif tag == _FLOAT:
+                    values[idx] = next(floats)
+                elif tag == _INT:
+                    values[idx] = next(ints)
+                elif tag == _BOOL:
+                    values[idx] = bool(next(ints))
+                elif tag == _DATETIME:
+                    values[idx] = _EPOCH + timedelta(microseconds=next(ints))
+                elif tag == _DATE:
+                    values[idx] = date.fromordinal(next(ints))
+                else:
+                    micros = next(ints)
+                    seconds, micros = divmod(micros, 1000000)
+                    values[idx] = time(seconds // 3600, seconds // 60 % 60, seconds % 60, micros)
+        self._columns[col] = values
+        return values
+
+    def rows(self, start_row=1, visible_only=False, columns=None):
+        """
+        Yield (số dòng, list giá trị các cột) từ start_row; columns: chỉ đọc các cột này (mặc định tất cả)
+        """
+        columns = list(columns) if columns is not None else list(range(1, self.col_count + 1))
+        values = [self.column(col) for col in columns]
+        hidden = self.hidden_mask() if visible_only else None
+        for idx in range(max(start_row, 1) - 1, self.row_count):
+            if hidden is not None and hidden[idx]:
+                continue
+            yield idx + 1, [column[idx] for column in values]
+
+    def feed(self, sink):
+        """
+        Đưa lại các dòng vào một sink (vd excel_sidecar.SidecarWriter) như khi xử lý file
+        """
+        sink.begin(self.col_count)
+        hidden = self.hidden_mask()
+        cleared = self._array('H', self.header['cleared'])
+        wanted = [idx for idx in range(self.row_count) if sink.wants(idx + 1, bool(hidden[idx]))]
+        columns = [self.column(col) for col in range(1, self.col_count + 1)]
+        for idx in wanted:
+            sink.add_row(idx + 1, [column[idx] for column in columns], bool(hidden[idx]),
+                         (cleared[idx], self.col_count) if cleared[idx] else None)
+
+
+class ReportCache:
+    DIR_NAME = ".report_cache"
+    SUFFIX = ".xrc"
+
+    def __init__(self, directory, max_mb):
+        self.directory = Path(directory)
+        self.max_bytes = int(max_mb * 1e6)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_key(input_hash, rules_version):
+        return f"{input_hash}-{rules_version}"
+
+    def writer(self, excel_file, rule_set, short_name):
+        """
+        ReportCacheWriter cho file sắp xử lý (None nếu file tải về này đã có trong cache với bộ rule này)
+        """
+        input_hash = file_hash(excel_file)
+        key = self.entry_key(input_hash, rule_set.version)
+        if (self.directory / f"{key}{self.SUFFIX}").exists():
+            return None
+        return ReportCacheWriter(self, key, input_hash, rule_set, short_name)
+
+    def store(self, key, header, blocks, output_file):
+        """
+        Ghi entry (header JSON + các khối nén) và liên kết <hash file đã xử lý>.ref, rồi dọn bớt theo dung lượng
+        """
+        header['output_hash'] = file_hash(output_file)
+        entry = self.directory / f"{key}{self.SUFFIX}"
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_file = entry.with_name(f"{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_file, 'wb') as f:
+            f.write(struct.pack('<4sI', MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for block in blocks:
+                f.write(block)
+        os.replace(tmp_file, entry)
+        ref = self.directory / f"{header['output_hash']}.ref"
+        tmp_file = ref.with_name(f"{ref.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_file.write_text(entry.name, encoding='utf-8')
+        os.replace(tmp_file, ref)
+        self.evict()
+        return entry
+
+    def load(self, excel_file=None, digest=None, rules_version=None):
+        """
+        Entry của một file (CachedReport) hoặc None:
+        - file đã xử lý: tìm theo hash file (liên kết .ref)
+        - file tải về chưa xử lý: theo hash file + rules_version
+        digest: hash file đã tính sẵn (vd từ manifest) để không phải đọc lại file
+        """
+        if not self.directory.exists():
+            return None
+        if digest is None:
+            digest = file_hash(excel_file)
+        entry = None
+        try:
+            entry = self.directory / (self.directory / f"{digest}.ref").read_text(encoding='utf-8').strip()
+        except OSError:
+            if rules_version is not None:
+                entry = self.directory / f"{self.entry_key(digest, rules_version)}{self.SUFFIX}"
+        if entry is None or not entry.exists():
+            return None
+        try:
+            report = CachedReport(entry)
+            os.utime(entry)  # đánh dấu vừa dùng (dọn cache theo thời gian dùng gần nhất)
+            return report
+        except (OSError, ValueError, KeyError, zlib.error) as e:
+            print(f"⚠️ Entry cache {entry.name} không đọc được ({e}), bỏ qua")
+            return None
+
+    def evict(self):
+        """
+        Xóa entry dùng lâu nhất tới khi tổng dung lượng <= giới hạn, xóa liên kết .ref không còn entry
+        """
+        with self.lock:
+            entries = []
+            for entry in self.directory.glob(f"*{self.SUFFIX}"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    entry.unlink()
+                    total -= size
+                except OSError:
+                    pass
+            for ref in self.directory.glob("*.ref"):
+                try:
+                    if not (self.directory / ref.read_text(encoding='utf-8').strip()).exists():
+                        ref.unlink()
+                except OSError:
+                    pass
+
+
+def read_report_rows(excel_file, cache=None, digest=None):
+    """
+    Các dòng của file đã xử lý: (nguồn, iterator (số dòng, giá trị các cột, dòng có ẩn, cột bắt đầu bị xóa)).
+    Nguồn "cache" nếu cache có entry của file, không thì "xlsx": đọc sheet XML (không biết dòng nào bị xóa
+    dữ liệu: None). digest: hash file đã tính sẵn
+    """
+    report = cache.load(excel_file, digest=digest) if cache is not None else None
+    if report is not None:
+        def cached_rows():
+            hidden = report.hidden_mask()
+            cleared = report.cleared_rows()
+            for row_num, values in report.rows():
+                yield row_num, values, bool(hidden[row_num - 1]), cleared.get(row_num)
+        return "cache", cached_rows()
+    return "xlsx", ((row_num, values, hidden, None) for row_num, values, hidden in read_sheet_rows(excel_file))
@@ -0,0 +1,145 @@
+"""
+So sánh báo cáo với lần chạy trước (output/DDMMYYYY/<short_name>.delta.csv): báo cáo tải mỗi ngày là số liệu
+lũy kế từ đầu tháng nên phần lớn dòng giống hôm trước. File delta chỉ gồm các dòng còn hiện (sau khi áp dụng rule)
+mới có / không còn / thay đổi so với file cùng short_name ở thư mục ngày gần nhất trước đó, cùng tháng báo cáo.
+- Khóa của dòng: giá trị các cột delta_key_columns (rules.json, mặc định mã nhân viên "H"); khóa trùng nhau
+  thì thêm số thứ tự lần xuất hiện (#2, #3...)
+- Nội dung dòng so bằng hash (blake2b) giá trị các cột đang hiện, không tính cột ẩn (STT, mã NPP...)
+- Dòng đọc từ cache dữ liệu nếu còn, không thì đọc sheet XML (excel_cache.read_report_rows)
+"""
+
+import os
+import csv
+import hashlib
+from pathlib import Path
+from openpyxl.utils import get_column_letter
+
+from excel_manifest import ExcelManifest, file_hash
+from excel_cache import read_report_rows
+from excel_sidecar import report_month_of, _text
+from excel_history import report_date_of, _column_titles
+
+SUFFIX = ".delta.csv"
+META_COLUMNS = ('change', 'key', 'prev_row', 'row', 'changed_columns')
+
+
+def _key_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _is_processed(excel_file, digest):
+    """
+    File có đang là kết quả đã xử lý không (thư mục không có manifest.json thì coi như đã xử lý)
+    """
+    if not (excel_file.parent / ExcelManifest.FILE_NAME).exists():
+        return True
+    entry = ExcelManifest(excel_file.parent).files.get(excel_file.name)
+    return bool(entry) and entry.get('output_hash') == digest
+
+
+def previous_report(excel_file):
+    """
+    File cùng tên đã xử lý ở thư mục ngày gần nhất trước thư mục của excel_file: (file, hash) hoặc (None, None)
+    """
+    excel_file = Path(excel_file)
+    current_date = report_date_of(excel_file.parent)
+    if current_date is None:
+        return None, None
+    earlier = []
+    for day_dir in excel_file.parent.parent.iterdir():
+        report_date = report_date_of(day_dir) if day_dir.is_dir() else None
+        if report_date is not None and report_date < current_date and (day_dir / excel_file.name).exists():
+            earlier.append((report_date, day_dir / excel_file.name))
+    for _, candidate in sorted(earlier, reverse=True):
+        digest = file_hash(candidate)
+        if _is_processed(candidate, digest):
+            return candidate, digest
+    return None, None
+
+
+class _Fingerprints:
+    """
+    Các dòng dữ liệu còn hiện của một file: khóa -> (hash nội dung, số dòng, giá trị các cột đang hiện)
+    """
+    def __init__(self, excel_file, rule_set, cache, digest=None):
+        source, rows = read_report_rows(excel_file, cache, digest)
+        header_rows = set(rule_set.sidecar_header_rows)
+        key_idx = [col - 1 for col in rule_set.delta_key_columns]
+        header_values = {}
+        self.columns = None
+        self.rows = {}
+        occurrences = {}
+        for row_num, values, hidden, _ in rows:
+            if row_num < rule_set.data_start_row:
+                if row_num in header_rows:
+                    header_values[row_num] = values
+                continue
+            if hidden or all(value is None for value in values):
+                continue
+            if self.columns is None:
+                col_count = len(values)
+                self.columns = [col for col in range(1, col_count + 1)
+                                if not rule_set.column_is_hidden(col, col_count)]
+            key = " | ".join(_key_text(values[idx]) if idx < len(values) else "" for idx in key_idx)
+            occurrences[key] = occurrences.get(key, 0) + 1
+            if occurrences[key] > 1:
+                key = f"{key} #{occurrences[key]}"
+            content = tuple(values[col - 1] for col in self.columns)
+            digest = hashlib.blake2b(repr(content).encode('utf-8'), digest_size=8).digest()
+            self.rows[key] = (digest, row_num, content)
+        self.columns = self.columns or []
+        titles = _column_titles(header_values, max(self.columns, default=0))
+        self.titles = [titles.get(get_column_letter(col), get_column_letter(col)) for col in self.columns]
+
+
+def write_delta(excel_file, rule_set, cache=None):
+    """
+    Ghi <short_name>.delta.csv cạnh file đã xử lý, trả về {'previous', 'added', 'removed', 'changed', 'path'}
+    hoặc None nếu không có file lần trước để so (hoặc file delta đã mới hơn cả hai file)
+    """
+    excel_file = Path(excel_file)
+    previous_file, previous_digest = previous_report(excel_file)
+    if previous_file is None or report_month_of(previous_file) != report_month_of(excel_file):
+        return None
+    path = excel_file.with_name(excel_file.stem + SUFFIX)
+    try:
+        if path.stat().st_mtime_ns >= max(excel_file.stat().st_mtime_ns, previous_file.stat().st_mtime_ns):
+            return None
+    except FileNotFoundError:
+        pass
+
+    before = _Fingerprints(previous_file, rule_set, cache, previous_digest)
+    after = _Fingerprints(excel_file, rule_set, cache)
+    if before.rows and after.rows and before.columns != after.columns:
+        raise ValueError(f"các cột đang hiện khác với file {previous_file.parent.name}")
+
+    changes = []
+    counts = {'added': 0, 'removed': 0, 'changed': 0}
+    for key, (digest, row_num, content) in after.rows.items():
+        old = before.rows.get(key)
+        if old is None:
+            changes.append(('added', key, None, row_num, "", content))
+        elif old[0] != digest:
+            changed = [title for title, new_value, old_value in zip(after.titles, content, old[2])
+                       if new_value != old_value]
+            changes.append(('changed', key, old[1], row_num, ", ".join(changed), content))
+        else:
+            continue
+        counts[changes[-1][0]] += 1
+    for key, (_, row_num, content) in sorted(before.rows.items(), key=lambda item: item[1][1]):
+        if key not in after.rows:
+            changes.append(('removed', key, row_num, None, "", content))
+            counts['removed'] += 1
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(META_COLUMNS) + (after.titles or before.titles))
+        for change, key, prev_row, row_num, changed, content in changes:
+            writer.writerow([change, key, prev_row, row_num, changed] + [_text(value) for value in content])
+    os.replace(tmp_path, path)
+    return dict(counts, previous=previous_file.parent.name, path=path)
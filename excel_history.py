@@ -0,0 +1,401 @@
+"""
+Chỉ mục lịch sử các báo cáo đã xử lý (output/history.sqlite): dòng dữ liệu của mọi file
+output/DDMMYYYY/<short_name>.xlsx trong một database SQLite để tra cứu qua nhiều ngày mà không mở lại
+từng file xlsx (vd nhân viên nào có cột Q trống ở báo cáo DHTC trong 30 ngày qua).
+- Cập nhật tăng dần: file đã có trong chỉ mục và không đổi (kích thước, thời gian sửa, hash) thì bỏ qua
+- Chỉ lấy file đã xử lý xong: thư mục ngày có manifest.json thì file phải khớp hash sau xử lý trong manifest,
+  thư mục không có manifest (tắt excel_manifest) chỉ lấy các file vừa xử lý trong lần chạy (processed_files) -
+  file tải về chưa xử lý không bao giờ vào chỉ mục
+- Dòng lấy từ cache dữ liệu nếu còn, không thì đọc sheet XML của file (excel_cache.read_report_rows)
+Bảng:
+- files: mỗi file một dòng - report_date (YYYY-MM-DD theo thư mục ngày), short_name, hash, phiên bản bộ rule,
+  tên cột (JSON {cột Excel: tiêu đề})
+- rows: mỗi dòng dữ liệu (từ data_start_row) một dòng - report_date, short_name, row_num, staff_code (cột
+  staff_column của rules.json), hidden, cleared_from và giá trị các cột Excel "A", "B"... (ngày giờ lưu dạng ISO)
+- visible_rows: view các dòng còn hiện (hidden = 0)
+Chỉ mục: (short_name, staff_code, report_date) và (short_name, <cột>) cho các cột bộ rule đọc.
+Dữ liệu của thư mục ngày đã xóa vẫn giữ trong database (xóa history.sqlite để tạo lại từ đầu).
+Dòng lệnh: python excel_history.py update | query "SELECT ..." | empty Q --report DHTC --days 30 | columns DHTC
+"""
+
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime, date, time as dtime
+from pathlib import Path
+from openpyxl.utils import get_column_letter
+
+from excel_rules import load_rule_book, column_index
+from excel_manifest import ExcelManifest, file_hash
+from excel_cache import ReportCache, read_report_rows
+from xlsx_patch import PatchUnsupported
+
+BASE_PATH = Path(__file__).parent
+_DAY_DIR_RE = re.compile(r'^\d{8}$')
+_KEY_COLUMNS = ('file_id', 'report_date', 'short_name', 'row_num', 'staff_code', 'hidden', 'cleared_from')
+BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    report_date TEXT NOT NULL,
+    short_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    file_hash TEXT NOT NULL,
+    rules_version TEXT,
+    row_count INTEGER NOT NULL,
+    col_count INTEGER NOT NULL,
+    columns TEXT,
+    source TEXT,
+    indexed_at TEXT NOT NULL,
+    UNIQUE (report_date, short_name)
+);
+CREATE TABLE IF NOT EXISTS rows (
+    file_id INTEGER NOT NULL,
+    report_date TEXT NOT NULL,
+    short_name TEXT NOT NULL,
+    row_num INTEGER NOT NULL,
+    staff_code TEXT,
+    hidden INTEGER NOT NULL DEFAULT 0,
+    cleared_from INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS rows_key ON rows (report_date, short_name, row_num);
+CREATE INDEX IF NOT EXISTS rows_staff ON rows (short_name, staff_code, report_date);
+CREATE VIEW IF NOT EXISTS visible_rows AS SELECT * FROM rows WHERE hidden = 0;
+"""
+
+
+def _sql_value(value):
+    """
+    Giá trị ô -> giá trị lưu SQLite: số/chuỗi giữ nguyên, ngày giờ dạng chuỗi ISO, bool -> 0/1
+    """
+    if value is None or isinstance(value, (int, float, str)):
+        return int(value) if isinstance(value, bool) else value
+    if isinstance(value, (datetime, date, dtime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _staff_code(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+
+def _column_titles(header_values, col_count):
+    """
+    {cột Excel: tiêu đề} theo dòng tiêu đề dưới cùng có chữ (như tên cột của excel_sidecar)
+    """
+    titles = {}
+    for idx in range(col_count):
+        for row_num in sorted(header_values, reverse=True):
+            values = header_values[row_num]
+            text = values[idx] if idx < len(values) else None
+            text = str(text).strip() if text is not None else ""
+            if text:
+                titles[get_column_letter(idx + 1)] = text
+                break
+    return titles
+
+
+def report_date_of(day_dir):
+    """
+    Thư mục ngày DDMMYYYY -> "YYYY-MM-DD" (None nếu không phải thư mục ngày)
+    """
+    if not _DAY_DIR_RE.match(day_dir.name):
+        return None
+    try:
+        return datetime.strptime(day_dir.name, "%d%m%Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+class HistoryIndex:
+    FILE_NAME = "history.sqlite"
+
+    def __init__(self, output_dir, rules_file):
+        self.output_dir = Path(output_dir)
+        self.rules_file = Path(rules_file)
+        self.db_file = self.output_dir / self.FILE_NAME
+
+    def connect(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    @staticmethod
+    def _value_columns(conn):
+        return {row[1] for row in conn.execute("PRAGMA table_info(rows)")} - set(_KEY_COLUMNS)
+
+    def _ensure_columns(self, conn, col_count, known):
+        """
+        Thêm cột "A", "B"... còn thiếu vào bảng rows (báo cáo có nhiều cột hơn các file đã có)
+        """
+        for col in range(1, col_count + 1):
+            letter = get_column_letter(col)
+            if letter not in known:
+                conn.execute(f'ALTER TABLE rows ADD COLUMN "{letter}"')
+                known.add(letter)
+
+    def _ensure_indexes(self, conn, book, known):
+        """
+        Chỉ mục (short_name, cột) cho các cột mà bộ rule (mặc định + profile) đọc, khi bảng đã có cột đó
+        """
+        rule_sets = [book.for_report(None)] + [book.for_report(name) for name in book.profiles]
+        columns = {col for rule_set in rule_sets for rule in rule_set.rules for col in rule.columns}
+        for col in sorted(columns):
+            letter = get_column_letter(col)
+            if letter in known:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "rows_{letter}" ON rows (short_name, "{letter}")')
+
+    def _candidates(self):
+        """
+        (report_date, file) của các file báo cáo trong các thư mục ngày, ngày cũ trước
+        """
+        if not self.output_dir.exists():
+            return []
+        candidates = []
+        for day_dir in self.output_dir.iterdir():
+            report_date = report_date_of(day_dir) if day_dir.is_dir() else None
+            if report_date is None:
+                continue
+            for excel_file in day_dir.glob("*.xlsx"):
+                if excel_file.name.startswith("~$") or excel_file.name == "Kết quả.xlsx":
+                    continue
+                candidates.append((report_date, excel_file))
+        candidates.sort(key=lambda item: (item[0], item[1].name))
+        return candidates
+
+    def _index_file(self, conn, report_date, excel_file, stat, digest, rules_version, rule_set, cache, known):
+        """
+        Ghi lại toàn bộ dòng của một file (xóa dữ liệu cũ cùng ngày + short_name), trả về số dòng
+        """
+        short_name = excel_file.stem
+        source, rows = read_report_rows(excel_file, cache, digest)
+        header_rows = set(rule_set.sidecar_header_rows)
+        staff_idx = rule_set.staff_column - 1 if rule_set.staff_column else None
+        header_values = {}
+        col_count = 0
+        row_count = 0
+        insert = None
+        batch = []
+        with conn:
+            conn.execute("DELETE FROM rows WHERE report_date = ? AND short_name = ?", (report_date, short_name))
+            conn.execute("DELETE FROM files WHERE report_date = ? AND short_name = ?", (report_date, short_name))
+            file_id = conn.execute(
+                "INSERT INTO files (report_date, short_name, path, size, mtime_ns, file_hash, rules_version,"
+                " row_count, col_count, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, ?)",
+                (report_date, short_name, str(excel_file), stat.st_size, stat.st_mtime_ns, digest, rules_version,
+                 datetime.now().isoformat(timespec='seconds'))).lastrowid
+            for row_num, values, hidden, cleared_from in rows:
+                if row_num < rule_set.data_start_row:
+                    if row_num in header_rows:
+                        header_values[row_num] = values
+                    continue
+                if all(value is None for value in values):
+                    continue
+                if insert is None:
+                    col_count = len(values)
+                    self._ensure_columns(conn, col_count, known)
+                    names = ', '.join(_KEY_COLUMNS + tuple(f'"{get_column_letter(col)}"'
+                                                           for col in range(1, col_count + 1)))
+                    insert = f"INSERT INTO rows ({names}) VALUES ({', '.join('?' * (len(_KEY_COLUMNS) + col_count))})"
+                staff = _staff_code(values[staff_idx]) if staff_idx is not None and staff_idx < len(values) else None
+                batch.append((file_id, report_date, short_name, row_num, staff, int(hidden), cleared_from,
+                               *(_sql_value(value) for value in values[:col_count])))
+                row_count += 1
+                if len(batch) >= BATCH_SIZE:
+                    conn.executemany(insert, batch)
+                    batch = []
+            if batch:
+                conn.executemany(insert, batch)
+            col_count = col_count or max((len(values) for values in header_values.values()), default=0)
+            conn.execute("UPDATE files SET row_count = ?, col_count = ?, columns = ?, source = ? WHERE id = ?",
+                         (row_count, col_count, json.dumps(_column_titles(header_values, col_count),
+                                                           ensure_ascii=False), source, file_id))
+        return row_count
+
+    def update(self, processed_files=None):
+        """
+        Đưa các file mới / đã đổi vào chỉ mục, trả về {'indexed', 'unchanged', 'pending', 'failed', 'rows'}
+        processed_files: các file vừa xử lý xong trong lần chạy (ExcelProcessor.finish_files) - cách duy nhất
+        để biết file ở thư mục không có manifest.json đã xử lý hay chưa
+        """
+        processed = {Path(excel_file).resolve() for excel_file in processed_files or ()}
+        book = load_rule_book(self.rules_file)
+        cache = ReportCache(self.output_dir / ReportCache.DIR_NAME, book.cache_mb) if book.cache_mb > 0 else None
+        stats = {'indexed': 0, 'unchanged': 0, 'pending': 0, 'failed': 0, 'rows': 0}
+        manifests = {}
+        conn = self.connect()
+        try:
+            known = self._value_columns(conn)
+            indexed = {(report_date, short_name): (size, mtime_ns, digest)
+                       for report_date, short_name, size, mtime_ns, digest
+                       in conn.execute("SELECT report_date, short_name, size, mtime_ns, file_hash FROM files")}
+            for report_date, excel_file in self._candidates():
+                short_name = excel_file.stem
+                try:
+                    stat = excel_file.stat()
+                    previous = indexed.get((report_date, short_name))
+                    if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                        stats['unchanged'] += 1
+                        continue
+                    digest = file_hash(excel_file)
+                    if previous and previous[2] == digest:
+                        with conn:
+                            conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE report_date = ? AND short_name = ?",
+                                         (stat.st_size, stat.st_mtime_ns, report_date, short_name))
+                        stats['unchanged'] += 1
+                        continue
+
+                    # Thư mục có manifest: chỉ lấy file đang là kết quả đã xử lý
+                    # Không có manifest: chỉ lấy file vừa xử lý trong lần chạy (còn lại có thể là file mới tải)
+                    day_dir = excel_file.parent
+                    if day_dir not in manifests:
+                        manifests[day_dir] = (ExcelManifest(day_dir)
+                                              if (day_dir / ExcelManifest.FILE_NAME).exists() else None)
+                    rules_version = None
+                    if manifests[day_dir] is None:
+                        if excel_file.resolve() not in processed:
+                            stats['pending'] += 1
+                            continue
+                    else:
+                        entry = manifests[day_dir].files.get(excel_file.name)
+                        if not entry or entry.get('output_hash') != digest:
+                            stats['pending'] += 1
+                            continue
+                        rules_version = entry.get('rules_version')
+
+                    rule_set = book.for_report(short_name)
+                    stats['rows'] += self._index_file(conn, report_date, excel_file, stat, digest, rules_version,
+                                                      rule_set, cache, known)
+                    stats['indexed'] += 1
+                except (OSError, ValueError, PatchUnsupported, sqlite3.Error) as e:
+                    print(f"⚠️ Không đưa được {excel_file.parent.name}/{excel_file.name} vào chỉ mục lịch sử: {str(e)}")
+                    stats['failed'] += 1
+            with conn:
+                self._ensure_indexes(conn, book, known)
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.close()
+        return stats
+
+    def query(self, sql, params=()):
+        """
+        Chạy câu SQL (chỉ đọc) trên chỉ mục, trả về (tên cột, list dòng)
+        """
+        if not self.db_file.exists():
+            raise FileNotFoundError(f"Chưa có chỉ mục lịch sử: {self.db_file}")
+        conn = sqlite3.connect(f"{self.db_file.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            cursor = conn.execute(sql, params)
+            columns = [description[0] for description in cursor.description or ()]
+            return columns, cursor.fetchall()
+        finally:
+            conn.close()
+
+    def empty_cells(self, column, short_name=None, days=30, include_hidden=False):
+        """
+        Nhân viên có ô trống ở cột column (vd "Q") trong days ngày gần nhất: số dòng theo ngày, báo cáo, mã NV
+        """
+        letter = get_column_letter(column_index(column))
+        sql = (f'SELECT report_date, short_name, staff_code, COUNT(*) AS so_dong FROM rows'
+               f' WHERE "{letter}" IS NULL AND report_date >= date(\'now\', \'localtime\', ?)')
+        params = [f"-{int(days)} days"]
+        if short_name:
+            sql += " AND short_name = ?"
+            params.append(short_name)
+        if not include_hidden:
+            sql += " AND hidden = 0"
+        sql += " GROUP BY report_date, short_name, staff_code ORDER BY report_date DESC, short_name, staff_code"
+        return self.query(sql, params)
+
+    def column_titles(self, short_name):
+        """
+        {cột Excel: tiêu đề} của file mới nhất của báo cáo
+        """
+        _, rows = self.query("SELECT columns FROM files WHERE short_name = ? ORDER BY report_date DESC LIMIT 1",
+                             (short_name,))
+        return json.loads(rows[0][0] or "{}") if rows else {}
+
+
+def print_update_stats(stats):
+    message = f"🗃️ Chỉ mục lịch sử: thêm {stats['indexed']} file ({stats['rows']} dòng), {stats['unchanged']} file không đổi"
+    if stats['pending']:
+        message += f", {stats['pending']} file chưa xác nhận đã xử lý (bỏ qua)"
+    if stats['failed']:
+        message += f", {stats['failed']} file lỗi"
+    print(message)
+
+
+def print_table(columns, rows, limit=50):
+    """
+    In kết quả truy vấn dạng bảng (tối đa limit dòng)
+    """
+    if not columns:
+        print("✅ Không có dữ liệu trả về")
+        return
+    shown = [["" if value is None else str(value) for value in row] for row in rows[:limit]]
+    widths = [min(40, max([len(name)] + [len(row[idx]) for row in shown])) for idx, name in enumerate(columns)]
+    print(" | ".join(name.ljust(width)[:width] for name, width in zip(columns, widths)))
+    print("-+-".join("-" * width for width in widths))
+    for row in shown:
+        print(" | ".join(value.ljust(width)[:width] for value, width in zip(row, widths)))
+    if len(rows) > limit:
+        print(f"... còn {len(rows) - limit} dòng")
+    print(f"📊 {len(rows)} dòng")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chỉ mục lịch sử các báo cáo đã xử lý (output/history.sqlite)")
+    parser.add_argument('--output', type=Path, default=BASE_PATH / "output", help="Thư mục output")
+    parser.add_argument('--rules', type=Path, default=BASE_PATH / "input" / "rules.json", help="File rules.json")
+    parser.add_argument('--no-update', action='store_true', help="Truy vấn ngay, không cập nhật chỉ mục trước")
+    parser.add_argument('--limit', type=int, default=50, help="Số dòng kết quả in ra tối đa")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('update', help="Đưa file mới / đã đổi vào chỉ mục")
+    query_parser = commands.add_parser('query', help="Chạy câu SQL chỉ đọc (bảng files, rows, view visible_rows)")
+    query_parser.add_argument('sql')
+    empty_parser = commands.add_parser('empty', help="Nhân viên có ô trống ở một cột")
+    empty_parser.add_argument('column', help="Cột Excel (vd Q)")
+    empty_parser.add_argument('--report', help="short_name báo cáo (vd DHTC)")
+    empty_parser.add_argument('--days', type=int, default=30, help="Số ngày gần nhất")
+    empty_parser.add_argument('--include-hidden', action='store_true', help="Tính cả dòng đã ẩn")
+    columns_parser = commands.add_parser('columns', help="Tên cột của báo cáo")
+    columns_parser.add_argument('report', help="short_name báo cáo")
+    args = parser.parse_args(argv)
+
+    index = HistoryIndex(args.output, args.rules)
+    if args.command == 'update' or not args.no_update:
+        print_update_stats(index.update())
+    if args.command == 'update':
+        return 0
+    started = time.perf_counter()
+    try:
+        if args.command == 'query':
+            columns, rows = index.query(args.sql)
+        elif args.command == 'empty':
+            columns, rows = index.empty_cells(args.column, args.report, args.days, args.include_hidden)
+        else:
+            titles = index.column_titles(args.report)
+            columns, rows = ["cot", "tieu_de"], list(titles.items())
+    except (sqlite3.Error, FileNotFoundError, ValueError) as e:
+        print(f"❌ Lỗi truy vấn: {str(e)}")
+        return 1
+    print_table(columns, rows, args.limit)
+    print(f"⏱️ {(time.perf_counter() - started) * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
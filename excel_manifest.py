@@ -0,0 +1,120 @@
+"""
+Manifest các file Excel đã xử lý trong thư mục ngày (output/DDMMYYYY/manifest.json)
+Mỗi file ghi lại: hash file tải về, hash file sau xử lý, phiên bản bộ rule, thời gian xử lý
+- File đang là kết quả đã xử lý (hash = hash sau xử lý, cùng bộ rule): bỏ qua
+- File tải lại nhưng giống hệt file đã xử lý trước đó (hash = hash tải về): dùng lại kết quả cũ
+  (bản sao kết quả lưu trong output/DDMMYYYY/.processed/)
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    """
+    SHA-256 của nội dung file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExcelManifest:
+    FILE_NAME = "manifest.json"
+    CACHE_DIR = ".processed"
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.manifest_file = self.directory / self.FILE_NAME
+        self.cache_dir = self.directory / self.CACHE_DIR
+        self.lock = threading.Lock()
+        self.files = {}  # tên file -> thông tin lần xử lý gần nhất
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"⚠️ {self.FILE_NAME} không hợp lệ ({e}), xử lý lại tất cả file")
+
+    def lookup(self, excel_file, rules_version):
+        """
+        Kiểm tra file trước khi xử lý, trả về (trạng thái, hash file hiện tại):
+        - "processed": file đã là kết quả xử lý với bộ rule này -> bỏ qua
+        - "reused": file giống hệt một file tải về đã xử lý -> đã chép kết quả cũ đè lên
+        - None: cần xử lý (ghi lại bằng record() sau khi xử lý xong)
+        """
+        excel_file = Path(excel_file)
+        current_hash = file_hash(excel_file)
+        with self.lock:
+            entry = self.files.get(excel_file.name)
+            if entry and entry.get('output_hash') == current_hash and entry.get('rules_version') == rules_version:
+                return "processed", current_hash
+
+            # Ưu tiên bản ghi cùng tên file, sau đó tới file khác có cùng nội dung tải về
+            candidates = sorted(self.files.items(), key=lambda item: item[0] != excel_file.name)
+            for _, candidate in candidates:
+                if candidate.get('input_hash') != current_hash or candidate.get('rules_version') != rules_version:
+                    continue
+                cached_output = self.cache_dir / f"{candidate.get('output_hash')}.xlsx"
+                if not cached_output.exists():
+                    continue
+                tmp_file = excel_file.with_name(excel_file.name + ".tmp")
+                shutil.copyfile(cached_output, tmp_file)
+                os.replace(tmp_file, excel_file)
+                self.files[excel_file.name] = dict(candidate, processed_at=datetime.now().isoformat(timespec='seconds'),
+                                                   reused=True)
+                self.save()
+                return "reused", current_hash
+        return None, current_hash
+
+    def record(self, excel_file, input_hash, rules_version, seconds, rule_stats=None):
+        """
+        Ghi lại file vừa xử lý xong (lưu bản sao kết quả để dùng lại khi tải lại file giống hệt)
+        """
+        excel_file = Path(excel_file)
+        output_hash = file_hash(excel_file)
+        cached_output = self.cache_dir / f"{output_hash}.xlsx"
+        with self.lock:
+            if not cached_output.exists():
+                self.cache_dir.mkdir(exist_ok=True)
+                tmp_file = cached_output.with_name(cached_output.name + ".tmp")
+                shutil.copyfile(excel_file, tmp_file)
+                os.replace(tmp_file, cached_output)
+            self.files[excel_file.name] = {
+                'input_hash': input_hash,
+                'output_hash': output_hash,
+                'rules_version': rules_version,
+                'processed_at': datetime.now().isoformat(timespec='seconds'),
+                'seconds': round(seconds, 3),
+                'rule_hits': {rule_id: stats['hits'] for rule_id, stats in (rule_stats or {}).items()},
+                'reused': False
+            }
+            self.save()
+
+    def save(self):
+        """
+        Ghi manifest.json (ghi file tạm rồi đổi tên) và xóa bản sao kết quả không còn dùng
+        """
+        tmp_file = self.manifest_file.with_name(self.FILE_NAME + ".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+        if self.cache_dir.exists():
+            used = {f"{entry.get('output_hash')}.xlsx" for entry in self.files.values()}
+            for cached_output in self.cache_dir.glob("*.xlsx"):
+                if cached_output.name not in used:
+                    try:
+                        cached_output.unlink()
+                    except OSError:
+                        pass
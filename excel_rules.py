@@ -0,0 +1,849 @@
+"""
+Bộ quy tắc ẩn dòng/xóa dữ liệu/ẩn cột cho file báo cáo (B1 -> B10 của process_excel.py)
+Đọc từ input/rules.json (cạnh config.json), biên dịch một lần thành các hàm kiểm tra,
+có profile riêng theo short_name để mỗi báo cáo chỉ chạy các rule nó cần.
+"""
+
+import json
+import copy
+import math
+import time
+import hashlib
+import unicodedata
+import threading
+from pathlib import Path
+from openpyxl.utils import column_index_from_string
+
+try:
+    import numpy as np
+except ImportError:  # numpy là tùy chọn, không có thì dùng engine duyệt từng dòng
+    np = None
+
+# Bộ quy tắc mặc định = hành vi cũ của process_single_excel (dùng khi không có input/rules.json)
+DEFAULT_RULES = {
+    "engine": "auto",
+    "writer": "auto",
+    "stream_min_mb": 200,
+    "sidecar": "none",
+    "cache_mb": 256,
+    "staff_column": "H",
+    "delta_key_columns": ["H"],
+    "data_start_row": 6,
+    "hide_rows": [1, 2, 3],
+    "row_rules": [
+        {"id": "B1.1", "action": "hide", "when": {"column": "K", "op": "contains", "value": "TMDT"}},
+        {"id": "B1.2", "action": "hide", "when": {"column": "J", "op": "equals", "value": "NVNPP015"}},
+        {"id": "B2", "action": "hide", "when": {"column": "A", "op": "empty"}},
+        {"id": "B3", "action": "hide", "only_visible": True, "when": {"all": [
+            {"column": "B", "op": "empty"},
+            {"column": "C", "op": "empty"},
+            {"column": "F", "op": "not_empty"}
+        ]}},
+        {"id": "B4", "action": "hide", "only_visible": True, "when": {"all": [
+            {"column": "D", "op": "empty"},
+            {"column": "C", "op": "not_empty"}
+        ]}},
+        {"id": "B4_clear", "action": "clear", "from_column": "K", "when": {"column": "C", "op": "empty"}},
+        {"id": "B5", "action": "hide", "only_visible": True, "when": {
+            "column": "K", "op": "contains_any",
+            "values": ["NPP Bán", "NPP tự bán", "TMDT Lazada", "TMDT Sendo", "TMDT Tiki", "TT Bán"]
+        }},
+        {"id": "B6", "action": "hide", "only_visible": True, "when": {"column": "Q", "op": "gt", "value": 0}},
+        {"id": "B7", "action": "hide", "only_visible": True, "consecutive": True, "when": {"column": "Q", "op": "empty"}}
+    ],
+    "hidden_columns": ["A:F", "H", "J", "L", "M", "N", "S:"],
+    "freeze_panes": "A6",
+    "autofit_columns": ["I", "K"],
+    "profiles": {}
+}
+
+# Chi phí ước lượng của từng phép so sánh (dùng để sắp xếp rule trước khi có số liệu đo thực tế)
+OP_COSTS = {
+    'empty': 1.0, 'not_empty': 1.0, 'equals': 1.5, 'contains': 2.0, 'contains_any': 1.5,
+    'gt': 3.0, 'ge': 3.0, 'lt': 3.0, 'le': 3.0
+}
+
+# Sau bao nhiêu dòng thì sắp xếp lại rule theo thời gian/tỷ lệ trúng đo được
+CALIBRATE_ROWS = 1000
+
+_book_cache = {}
+_book_lock = threading.Lock()
+
+
+def _is_empty(value):
+    return value is None or str(value).strip() == ""
+
+
+def _to_number(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def column_index(column):
+    """
+    "K" -> 11, 11 -> 11
+    """
+    if isinstance(column, int):
+        return column
+    return column_index_from_string(str(column).strip().upper())
+
+
+def parse_column_ranges(specs):
+    """
+    ["A:F", "H", "S:"] -> [(1, 6), (8, 8), (19, None)] (None = tới cột cuối)
+    """
+    ranges = []
+    for spec in specs:
+        spec = str(spec).strip()
+        if ':' in spec:
+            start, end = spec.split(':', 1)
+            ranges.append((column_index(start), column_index(end) if end.strip() else None))
+        else:
+            ranges.append((column_index(spec), column_index(spec)))
+    return ranges
+
+
+class RowReader:
+    """
+    Đọc giá trị ô của dòng đang xét, mỗi ô chỉ đọc một lần (chỉ đọc khi rule cần tới).
+    cleared (dict, tùy chọn): ghi nhận dòng bị xóa dữ liệu {dòng: (từ cột, tới cột)}
+    """
+    __slots__ = ('ws', 'row_num', 'values', 'cleared')
+
+    def __init__(self, ws, cleared=None):
+        self.ws = ws
+        self.row_num = 0
+        self.values = {}
+        self.cleared = cleared
+
+    def start(self, row_num):
+        self.row_num = row_num
+        self.values = {}
+
+    def value(self, col):
+        values = self.values
+        if col in values:
+            return values[col]
+        value = self.ws.cell(self.row_num, col).value
+        values[col] = value
+        return value
+
+    def forget_from(self, col):
+        for key in [key for key in self.values if key >= col]:
+            del self.values[key]
+
+    def clear(self, from_col, to_col):
+        clear_row_cells(self.ws, self.row_num, from_col, to_col)
+        self.forget_from(from_col)
+        if self.cleared is not None:
+            _record_clear(self.cleared, self.row_num, from_col, to_col)
+
+
+def _record_clear(cleared, row_num, from_col, to_col):
+    if row_num in cleared:
+        old_from, old_to = cleared[row_num]
+        from_col, to_col = min(from_col, old_from), max(to_col, old_to)
+    cleared[row_num] = (from_col, to_col)
+
+
+def clear_row_cells(ws, row_num, from_col, to_col):
+    """
+    Xóa giá trị các ô from_col -> to_col của một dòng (ô chưa có hoặc đã rỗng thì bỏ qua, MergedCell luôn rỗng).
+    Sheet của engine XML (xlsx_patch.PatchSheet) tự ghi nhận dòng cần xóa qua clear_row()
+    """
+    clear_row = getattr(ws, 'clear_row', None)
+    if clear_row is not None:
+        clear_row(row_num, from_col, to_col)
+        return
+    cells = ws._cells
+    for col_num in range(from_col, to_col + 1):
+        cell = cells.get((row_num, col_num))
+        if cell is not None and cell.value is not None:
+            cell.value = None
+
+
+# Độ rộng hiển thị của ký tự (đơn vị = độ rộng chữ số của font mặc định Calibri 11, như độ rộng cột Excel)
+_NARROW_CHARS = " .,:;!|'`ijlI"
+_SEMI_NARROW_CHARS = 'ftr-()[]{}/\\"'
+_WIDE_CHARS = "mwMW@%"
+AUTOFIT_MIN_WIDTH = 6
+AUTOFIT_MAX_WIDTH = 30
+AUTOFIT_NUMBER_WIDTH = 8
+
+
+class _CharWidths(dict):
+    """
+    Bảng độ rộng ký tự: tính sẵn cho ASCII và chữ tiếng Việt, ký tự khác tính khi gặp lần đầu.
+    Chữ có dấu (ế, ự, Ở...) rộng bằng chữ gốc, dấu tổ hợp (văn bản dạng NFD) không chiếm chỗ
+    """
+    def __missing__(self, char):
+        if unicodedata.combining(char):
+            width = 0.0
+        elif char in _NARROW_CHARS:
+            width = 0.5
+        elif char in _SEMI_NARROW_CHARS:
+            width = 0.6
+        elif char in _WIDE_CHARS:
+            width = 1.5
+        elif unicodedata.east_asian_width(char) in ('W', 'F'):
+            width = 2.0
+        elif char in 'Đđ':
+            width = self['D' if char == 'Đ' else 'd']
+        else:
+            base = unicodedata.normalize('NFD', char)[0]
+            if base != char:
+                width = self[base]
+            elif char.isupper():
+                width = 1.15
+            else:
+                width = 1.0
+        self[char] = width
+        return width
+
+
+_CHAR_WIDTHS = _CharWidths()
+for _code in list(range(0x20, 0x250)) + list(range(0x1EA0, 0x1F00)):
+    _CHAR_WIDTHS[chr(_code)]
+
+
+def display_width(text):
+    """
+    Độ rộng hiển thị của chuỗi (theo bảng _CHAR_WIDTHS)
+    """
+    return sum(map(_CHAR_WIDTHS.__getitem__, text))
+
+
+class AutofitMeter:
+    """
+    Đo độ rộng cột vừa với dữ liệu (mô phỏng double-click auto-fit Excel), thêm từng giá trị một:
+    độ rộng text lớn nhất + 1, giá trị số tính tối thiểu 8, giới hạn 6 -> 30
+    """
+    __slots__ = ('max_width',)
+
+    # Text dài hơn mức này chắc chắn chạm giới hạn (ký tự hẹp nhất rộng 0.5) - không cần đo
+    CAPPED_LENGTH = 2 * (AUTOFIT_MAX_WIDTH - 1)
+
+    def __init__(self):
+        self.max_width = 0
+
+    def add(self, value):
+        if not value or self.max_width >= AUTOFIT_MAX_WIDTH - 1:
+            return
+        if isinstance(value, str):
+            if len(value) >= self.CAPPED_LENGTH:
+                self.max_width = AUTOFIT_MAX_WIDTH - 1
+                return
+            width = display_width(value)
+            if width < AUTOFIT_NUMBER_WIDTH:
+                try:
+                    float(value)  # Chuỗi dạng số (" 3 ", "1e2"...) tính như số
+                    width = AUTOFIT_NUMBER_WIDTH
+                except ValueError:
+                    pass
+        elif isinstance(value, (int, float)):
+            width = max(display_width(str(value)), AUTOFIT_NUMBER_WIDTH)
+        else:
+            width = display_width(str(value))
+        if width > self.max_width:
+            self.max_width = width
+
+    @property
+    def width(self):
+        return min(max(math.ceil(self.max_width) + 1, AUTOFIT_MIN_WIDTH), AUTOFIT_MAX_WIDTH)
+
+
+def autofit_width(values):
+    """
+    Độ rộng cột vừa với dữ liệu cho cả dãy giá trị (xem AutofitMeter)
+    """
+    meter = AutofitMeter()
+    for value in values:
+        meter.add(value)
+    return meter.width
+
+
+def compile_condition(cond):
+    """
+    Biên dịch điều kiện trong rules.json thành (hàm kiểm tra(row), chi phí ước lượng, các cột đọc)
+    """
+    if 'all' in cond or 'any' in cond:
+        combinator = 'all' if 'all' in cond else 'any'
+        parts = [compile_condition(part) for part in cond[combinator]]
+        if not parts:
+            raise ValueError(f"Điều kiện '{combinator}' rỗng")
+        preds = tuple(part[0] for part in parts)
+        cost = sum(part[1] for part in parts)
+        columns = set().union(*(part[2] for part in parts))
+        if combinator == 'all':
+            def pred(row):
+                for p in preds:
+                    if not p(row):
+                        return False
+                return True
+        else:
+            def pred(row):
+                for p in preds:
+                    if p(row):
+                        return True
+                return False
+        return pred, cost, columns
+
+    if 'not' in cond:
+        inner, cost, columns = compile_condition(cond['not'])
+        return (lambda row: not inner(row)), cost, columns
+
+    if 'column' not in cond or 'op' not in cond:
+        raise ValueError(f"Điều kiện thiếu 'column'/'op': {cond}")
+    col = column_index(cond['column'])
+    op = cond['op']
+    if op not in OP_COSTS:
+        raise ValueError(f"Phép so sánh không hỗ trợ: {op}")
+
+    if op == 'empty':
+        pred = lambda row: _is_empty(row.value(col))
+    elif op == 'not_empty':
+        pred = lambda row: not _is_empty(row.value(col))
+    elif op == 'equals':
+        # So sánh sau khi bỏ khoảng trắng hai đầu; "values" = một trong các giá trị
+        targets = frozenset(str(v) for v in cond.get('values', [cond.get('value')]))
+
+        def pred(row):
+            value = row.value(col)
+            return value is not None and str(value).strip() in targets
+    elif op == 'contains':
+        needle = str(cond['value'])
+
+        def pred(row):
+            value = row.value(col)
+            return value is not None and needle in str(value)
+    elif op == 'contains_any':
+        needles = tuple(str(v) for v in cond['values'])
+
+        def pred(row):
+            value = row.value(col)
+            if value is None:
+                return False
+            text = str(value)
+            return any(needle in text for needle in needles)
+    else:
+        threshold = float(cond['value'])
+        compare = {
+            'gt': lambda number: number > threshold,
+            'ge': lambda number: number >= threshold,
+            'lt': lambda number: number < threshold,
+            'le': lambda number: number <= threshold,
+        }[op]
+
+        def pred(row):
+            number = _to_number(row.value(col))
+            return number is not None and compare(number)
+
+    cost = OP_COSTS[op]
+    if op == 'contains_any':
+        cost += 0.5 * len(cond['values'])
+    return pred, cost, {col}
+
+
+class ColumnArrays:
+    """
+    Giá trị các cột rule cần, đọc một lượt từ sheet thành mảng object (engine numpy).
+    Các dạng chuẩn hóa (rỗng, str, str đã strip, số) chỉ tính khi có rule dùng tới và dùng chung giữa các rule.
+    """
+    def __init__(self, ws, start_row, end_row, columns):
+        self.start_row = start_row
+        self.end_row = end_row
+        self.size = max(0, end_row - start_row + 1)
+        self.raw = {}
+        self.derived = {}
+
+        column_values = getattr(ws, 'column_values', None)
+        if column_values is not None:
+            # Sheet của engine XML (xlsx_patch.PatchSheet) đã đọc sẵn giá trị theo cột
+            values = {col: column_values(col, start_row, end_row) for col in columns}
+        else:
+            # Một lượt qua bảng ô của sheet (không tạo ô rỗng mới như ws.cell()/iter_cols())
+            values = {col: [None] * self.size for col in columns}
+            for (row_num, col), cell in ws._cells.items():
+                column = values.get(col)
+                if column is not None and start_row <= row_num <= end_row:
+                    column[row_num - start_row] = cell.value
+        for col, column in values.items():
+            array = np.empty(self.size, dtype=object)
+            array[:] = column
+            self.raw[col] = array
+
+    def _get(self, kind, col, build):
+        key = (kind, col)
+        if key not in self.derived:
+            self.derived[key] = build(self.raw[col])
+        return self.derived[key]
+
+    def is_none(self, col):
+        return self._get('none', col, lambda values: np.equal(values, None))
+
+    def is_empty(self, col):
+        # Giá trị không phải chuỗi (số, ngày...) của openpyxl không bao giờ thành chuỗi rỗng khi str()
+        return self._get('empty', col, lambda values: np.fromiter(
+            (value is None or (type(value) is str and not value.strip()) for value in values),
+            dtype=bool, count=self.size))
+
+    def text(self, col):
+        return self._get('text', col, lambda values: np.fromiter(
+            ("" if value is None else str(value) for value in values), dtype=object, count=self.size))
+
+    def stripped(self, col):
+        return self._get('stripped', col, lambda values: np.fromiter(
+            ("" if value is None else str(value).strip() for value in values), dtype=object, count=self.size))
+
+    def numbers(self, col):
+        def build(values):
+            numbers = np.full(self.size, np.nan)
+            kinds = np.fromiter((type(value) in (int, float, bool) for value in values), dtype=bool, count=self.size)
+            numbers[kinds] = values[kinds].astype(float)
+            # Chỉ chuỗi (hiếm gặp ở cột số) mới phải thử float() từng ô
+            for idx in np.flatnonzero(~kinds & ~self.is_none(col)).tolist():
+                numbers[idx] = _float_or_nan(values[idx])
+            return numbers
+        return self._get('numbers', col, build)
+
+    def clear(self, from_col, mask):
+        """
+        Rule clear đã xóa dữ liệu các dòng trong mask: giá trị đã đọc của cột >= from_col thành None
+        """
+        for col, values in self.raw.items():
+            if col >= from_col:
+                values[mask] = None
+        for key in [key for key in self.derived if key[1] >= from_col]:
+            del self.derived[key]
+
+
+def _float_or_nan(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return float('nan')
+
+
+def compile_mask(cond):
+    """
+    Biên dịch điều kiện thành hàm tính mask bool trên cả cột (engine numpy), cùng ngữ nghĩa với compile_condition
+    """
+    if 'all' in cond or 'any' in cond:
+        combinator = 'all' if 'all' in cond else 'any'
+        parts = [compile_mask(part) for part in cond[combinator]]
+        if combinator == 'all':
+            def mask(cols):
+                result = parts[0](cols)
+                for part in parts[1:]:
+                    result = result & part(cols)
+                return result
+        else:
+            def mask(cols):
+                result = parts[0](cols)
+                for part in parts[1:]:
+                    result = result | part(cols)
+                return result
+        return mask
+
+    if 'not' in cond:
+        inner = compile_mask(cond['not'])
+        return lambda cols: ~inner(cols)
+
+    col = column_index(cond['column'])
+    op = cond['op']
+    if op == 'empty':
+        return lambda cols: cols.is_empty(col)
+    if op == 'not_empty':
+        return lambda cols: ~cols.is_empty(col)
+    if op == 'equals':
+        targets = [str(v) for v in cond.get('values', [cond.get('value')])]
+        return lambda cols: ~cols.is_none(col) & np.isin(cols.stripped(col), targets)
+    if op in ('contains', 'contains_any'):
+        needles = [str(cond['value'])] if op == 'contains' else [str(v) for v in cond['values']]
+
+        def mask(cols):
+            text = cols.text(col)
+            return np.fromiter((any(needle in value for needle in needles) for value in text),
+                               dtype=bool, count=cols.size) & ~cols.is_none(col)
+        return mask
+    threshold = float(cond['value'])
+    compare = {'gt': np.greater, 'ge': np.greater_equal, 'lt': np.less, 'le': np.less_equal}[op]
+    # So sánh với NaN (ô rỗng/không phải số) luôn False, giống float() lỗi ở engine từng dòng
+    return lambda cols: compare(cols.numbers(col), threshold)
+
+
+class CompiledRule:
+    def __init__(self, spec):
+        self.id = str(spec.get('id', ''))
+        if not self.id:
+            raise ValueError(f"Rule thiếu 'id': {spec}")
+        self.action = spec.get('action', 'hide')
+        if self.action not in ('hide', 'clear'):
+            raise ValueError(f"Rule {self.id}: action không hỗ trợ: {self.action}")
+        self.consecutive = bool(spec.get('consecutive', False))
+        # Rule "consecutive" xét dòng liền trước trong các dòng chưa ẩn nên luôn chỉ xét dòng chưa ẩn
+        self.only_visible = bool(spec.get('only_visible', False)) or self.consecutive
+        self.from_column = column_index(spec['from_column']) if self.action == 'clear' else None
+        self.predicate, self.cost, self.columns = compile_condition(spec['when'])
+        self.mask = compile_mask(spec['when']) if np is not None else None
+        # Tỷ lệ dòng trúng ước lượng (có thể khai báo trong rules.json), dùng trước khi đo được
+        self.selectivity = float(spec.get('selectivity', 0.1))
+
+    @property
+    def is_barrier(self):
+        """
+        Rule không được đổi chỗ với rule khác: xóa dữ liệu (rule sau đọc giá trị đã xóa)
+        hoặc "2 dòng liên tiếp" (trạng thái phụ thuộc dòng nào còn hiện tới lúc xét)
+        """
+        return self.action == 'clear' or self.consecutive
+
+
+class RowEvaluator:
+    """
+    Áp dụng bộ rule lần lượt từng dòng (engine từng dòng và engine stream dùng chung).
+    Các dòng phải được xét theo thứ tự tăng dần; sau CALIBRATE_ROWS dòng, rule trong nhóm
+    được xếp lại theo số liệu đo của file đang xử lý
+    """
+    def __init__(self, rule_set, col_count):
+        self.rules = rule_set.rules
+        self.col_count = col_count
+        self.hits = {rule.id: 0 for rule in self.rules}
+        self.evaluated = {rule.id: 0 for rule in self.rules}
+        self.elapsed_ns = {rule.id: 0 for rule in self.rules}
+        self.prev_match = {rule.id: False for rule in self.rules if rule.consecutive}
+        # Bản sao thứ tự trong nhóm để sắp xếp lại theo số liệu đo của file này
+        self.stages = [list(stage) if isinstance(stage, list) else stage for stage in rule_set.stages]
+        self.row_count = 0
+
+    def evaluate(self, row, hidden):
+        """
+        Xét một dòng: row có value(col) và clear(from_col, to_col) (xem RowReader),
+        hidden = dòng đã ẩn từ trước. Trả về dòng có bị ẩn sau khi xét hay không
+        """
+        if self.row_count == CALIBRATE_ROWS:
+            RuleSet._reorder(self.stages, self.hits, self.evaluated, self.elapsed_ns)
+        self.row_count += 1
+
+        hits = self.hits
+        evaluated = self.evaluated
+        elapsed_ns = self.elapsed_ns
+        perf_counter_ns = time.perf_counter_ns
+        for stage in self.stages:
+            if isinstance(stage, list):
+                if hidden:
+                    continue
+                for rule in stage:
+                    start = perf_counter_ns()
+                    matched = rule.predicate(row)
+                    elapsed_ns[rule.id] += perf_counter_ns() - start
+                    evaluated[rule.id] += 1
+                    if matched:
+                        hidden = True
+                        hits[rule.id] += 1
+                        break
+            elif stage.action == 'clear':
+                if self.col_count < stage.from_column:
+                    continue
+                start = perf_counter_ns()
+                matched = stage.predicate(row)
+                if matched:
+                    row.clear(stage.from_column, self.col_count)
+                    hits[stage.id] += 1
+                elapsed_ns[stage.id] += perf_counter_ns() - start
+                evaluated[stage.id] += 1
+            else:
+                # Rule "consecutive": trúng khi dòng này và dòng chưa ẩn liền trước đều thỏa điều kiện
+                if hidden:
+                    continue
+                start = perf_counter_ns()
+                matched = stage.predicate(row)
+                if matched and self.prev_match[stage.id]:
+                    hidden = True
+                    hits[stage.id] += 1
+                self.prev_match[stage.id] = matched
+                elapsed_ns[stage.id] += perf_counter_ns() - start
+                evaluated[stage.id] += 1
+        return hidden
+
+    def stats(self):
+        """
+        Thống kê từng rule theo thứ tự khai báo (cùng dạng với RuleSet.apply)
+        """
+        return {
+            rule.id: {
+                'hits': self.hits[rule.id],
+                'evaluated': self.evaluated[rule.id],
+                'time_ms': round(self.elapsed_ns[rule.id] / 1e6, 3)
+            }
+            for rule in self.rules
+        }
+
+
+class RuleSet:
+    """
+    Bộ rule đã biên dịch cho một báo cáo.
+    Rule ẩn dòng nằm giữa hai "barrier" được xếp lại theo chi phí / tỷ lệ trúng: ẩn dòng là phép OR
+    nên thứ tự không đổi kết quả, và dòng đã ẩn thì bỏ qua các rule ẩn còn lại.
+    """
+    def __init__(self, spec, name="default"):
+        self.name = name
+        # Phiên bản bộ rule (đổi rules.json/profile thì file đã xử lý cần xử lý lại, xem excel_manifest.py).
+        # Cấu hình sidecar / chỉ mục lịch sử / delta không đổi nội dung file xlsx nên không tính vào
+        versioned = {key: value for key, value in spec.items()
+                     if key not in ('sidecar', 'sidecar_header_rows', 'staff_column', 'delta_key_columns')}
+        self.version = hashlib.sha1(
+            json.dumps(versioned, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+        self.engine = spec.get('engine', 'auto')
+        if self.engine not in ('auto', 'rows', 'numpy'):
+            raise ValueError(f"engine không hỗ trợ: {self.engine}")
+        self.writer = spec.get('writer', 'auto')
+        if self.writer not in ('auto', 'xml', 'stream', 'openpyxl'):
+            raise ValueError(f"writer không hỗ trợ: {self.writer}")
+        # writer "auto": sheet XML (chưa nén) từ mức này trở lên thì dùng engine stream (xlsx_stream.py)
+        self.stream_min_mb = float(spec.get('stream_min_mb', 200))
+        # File dữ liệu dạng cột của các dòng còn hiện ghi cạnh file xlsx (xem excel_sidecar.py)
+        self.sidecar = spec.get('sidecar', 'none')
+        if self.sidecar not in ('none', 'csv', 'parquet'):
+            raise ValueError(f"sidecar không hỗ trợ: {self.sidecar}")
+        self.sidecar_header_rows = [int(row) for row in spec.get('sidecar_header_rows', [4, 5])]
+        # Cột mã nhân viên: khóa tra cứu trong chỉ mục lịch sử (xem excel_history.py)
+        self.staff_column = column_index(spec['staff_column']) if spec.get('staff_column') else None
+        # Cột khóa để so dòng với lần chạy trước (xem excel_delta.py), rỗng = không ghi file delta
+        self.delta_key_columns = [column_index(col) for col in spec.get('delta_key_columns', [])]
+        self.data_start_row = int(spec.get('data_start_row', 6))
+        self.hide_rows = [int(row) for row in spec.get('hide_rows', [])]
+        self.hidden_columns = parse_column_ranges(spec.get('hidden_columns', []))
+        self.freeze_panes = spec.get('freeze_panes')
+        self.autofit_columns = [column_index(col) for col in spec.get('autofit_columns', [])]
+        self.rules = [CompiledRule(rule) for rule in spec.get('row_rules', [])]
+
+        ids = [rule.id for rule in self.rules]
+        if len(ids) != len(set(ids)):
+            raise ValueError(f"Trùng id rule trong profile {name}")
+
+        # Chia rule thành các nhóm: nhóm rule ẩn đổi chỗ được, hoặc một barrier đứng riêng
+        self.stages = []
+        group = []
+        for rule in self.rules:
+            if rule.is_barrier:
+                if group:
+                    self.stages.append(group)
+                    group = []
+                self.stages.append(rule)
+            else:
+                group.append(rule)
+        if group:
+            self.stages.append(group)
+        for stage in self.stages:
+            if isinstance(stage, list):
+                stage.sort(key=lambda rule: rule.cost / max(rule.selectivity, 0.001))
+
+    def apply(self, ws, row_count, col_count, cleared=None):
+        """
+        Áp dụng rule cho các dòng từ data_start_row tới row_count (một lượt duyệt).
+        Trả về thống kê từng rule theo thứ tự khai báo:
+        {rule_id: {'hits': số dòng ẩn/xóa, 'evaluated': số lần xét, 'time_ms': tổng thời gian}}
+        cleared (dict, tùy chọn): nhận các dòng bị xóa dữ liệu {dòng: (từ cột, tới cột)}
+        """
+        for row_num in self.hide_rows:
+            ws.row_dimensions[row_num].hidden = True
+
+        evaluator = RowEvaluator(self, col_count)
+        row_dimensions = ws.row_dimensions
+        row = RowReader(ws, cleared)
+        for row_num in range(self.data_start_row, row_count + 1):
+            row.start(row_num)
+            row_dim = row_dimensions[row_num]
+            if evaluator.evaluate(row, bool(row_dim.hidden)) and not row_dim.hidden:
+                row_dim.hidden = True
+        return evaluator.stats()
+
+    @property
+    def use_numpy(self):
+        """
+        Dùng engine numpy khi engine = "numpy"/"auto" và đã cài numpy
+        """
+        return np is not None and self.engine != 'rows'
+
+    def run(self, ws, row_count, col_count, cleared=None):
+        """
+        Áp dụng bộ rule bằng engine phù hợp (xem apply / apply_vectorized)
+        """
+        if self.use_numpy:
+            return self.apply_vectorized(ws, row_count, col_count, cleared)
+        return self.apply(ws, row_count, col_count, cleared)
+
+    def apply_vectorized(self, ws, row_count, col_count, cleared=None):
+        """
+        Engine numpy: đọc các cột rule cần thành mảng một lượt, tính mask ẩn/xóa cho cả cột,
+        rồi ghi kết quả vào sheet một lần. Cùng kết quả với apply():
+        - ẩn dòng là phép OR nên mask các rule ẩn gộp theo thứ tự khai báo
+        - rule clear xóa dữ liệu trước khi các rule sau đọc cột bị xóa
+        - rule consecutive so sánh từng dòng chưa ẩn với dòng chưa ẩn liền trước
+        Thống kê trả về giống apply() (hits tính theo thứ tự khai báo)
+        """
+        for row_num in self.hide_rows:
+            ws.row_dimensions[row_num].hidden = True
+
+        start_row = self.data_start_row
+        cols = ColumnArrays(ws, start_row, row_count, set().union(*(rule.columns for rule in self.rules)))
+        size = cols.size
+        row_dimensions = ws.row_dimensions
+        initial_hidden = np.zeros(size, dtype=bool)
+        for row_num, row_dim in row_dimensions.items():
+            if row_dim.hidden and start_row <= row_num <= row_count:
+                initial_hidden[row_num - start_row] = True
+        hidden = initial_hidden.copy()
+        stats = {}
+
+        for rule in self.rules:
+            started = time.perf_counter_ns()
+            evaluated = size
+            if rule.action == 'clear':
+                if col_count < rule.from_column:
+                    matched = np.zeros(size, dtype=bool)
+                    evaluated = 0
+                else:
+                    matched = rule.mask(cols)
+                    for row_num in (np.flatnonzero(matched) + start_row).tolist():
+                        clear_row_cells(ws, row_num, rule.from_column, col_count)
+                        if cleared is not None:
+                            _record_clear(cleared, row_num, rule.from_column, col_count)
+                    cols.clear(rule.from_column, matched)
+                hit_count = int(matched.sum())
+            elif rule.consecutive:
+                visible = np.flatnonzero(~hidden)
+                evaluated = len(visible)
+                matched = rule.mask(cols)[visible]
+                second = np.zeros(len(visible), dtype=bool)
+                second[1:] = matched[1:] & matched[:-1]
+                hidden[visible[second]] = True
+                hit_count = int(second.sum())
+            else:
+                matched = rule.mask(cols)
+                newly_hidden = matched & ~hidden
+                hidden |= newly_hidden
+                hit_count = int(newly_hidden.sum())
+            stats[rule.id] = {
+                'hits': hit_count,
+                'evaluated': evaluated,
+                'time_ms': round((time.perf_counter_ns() - started) / 1e6, 3)
+            }
+
+        for row_num in (np.flatnonzero(hidden & ~initial_hidden) + start_row).tolist():
+            row_dimensions[row_num].hidden = True
+        return stats
+
+    @staticmethod
+    def _reorder(stages, hits, evaluated, elapsed_ns):
+        """
+        Xếp lại rule trong từng nhóm theo thời gian trung bình / tỷ lệ trúng đo được
+        """
+        def rank(rule):
+            count = evaluated[rule.id]
+            if not count:
+                return rule.cost / max(rule.selectivity, 0.001)
+            return (elapsed_ns[rule.id] / count) / max(hits[rule.id] / count, 0.001)
+
+        for stage in stages:
+            if isinstance(stage, list):
+                stage.sort(key=rank)
+
+    def column_is_hidden(self, col_num, max_column):
+        """
+        Cột có nằm trong danh sách hidden_columns không (chỉ xét cột <= max_column)
+        """
+        if col_num > max_column:
+            return False
+        for start, end in self.hidden_columns:
+            if start <= col_num and (end is None or col_num <= end):
+                return True
+        return False
+
+
+class RuleBook:
+    """
+    Nội dung rules.json: bộ rule mặc định + profile theo short_name.
+    Profile: {"rules": [id...]} (chỉ chạy các rule này) hoặc {"disable": [id...]},
+    có thể ghi đè engine, writer, stream_min_mb, sidecar, staff_column, delta_key_columns, hide_rows, hidden_columns,
+    freeze_panes, autofit_columns.
+    """
+    PROFILE_OVERRIDES = ('engine', 'writer', 'stream_min_mb', 'sidecar', 'staff_column', 'delta_key_columns',
+                         'data_start_row', 'hide_rows', 'hidden_columns', 'freeze_panes', 'autofit_columns')
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.profiles = spec.get('profiles', {})
+        # Dung lượng tối đa cache dữ liệu báo cáo đã xử lý (0 = tắt, xem excel_cache.py), không theo profile
+        self.cache_mb = float(spec.get('cache_mb', 256))
+        self.compiled = {}
+        self.lock = threading.Lock()
+        # Biên dịch ngay để báo lỗi cấu hình khi load chứ không phải giữa lúc xử lý
+        self.for_report(None)
+        for short_name in self.profiles:
+            self.for_report(short_name)
+
+    def for_report(self, short_name):
+        """
+        RuleSet đã biên dịch cho báo cáo (profile theo short_name, không có thì dùng mặc định)
+        """
+        key = short_name if short_name in self.profiles else None
+        with self.lock:
+            if key not in self.compiled:
+                self.compiled[key] = RuleSet(self.profile_spec(key), name=key or "default")
+            return self.compiled[key]
+
+    def profile_spec(self, short_name):
+        spec = {key: value for key, value in self.spec.items() if key not in ('profiles', 'cache_mb')}
+        if short_name is None:
+            return spec
+        profile = self.profiles[short_name]
+        rule_ids = [rule.get('id') for rule in spec.get('row_rules', [])]
+        selected = profile.get('rules')
+        disabled = set(profile.get('disable', []))
+        unknown = (set(selected or []) | disabled) - set(rule_ids)
+        if unknown:
+            raise ValueError(f"Profile {short_name}: không có rule {', '.join(sorted(unknown))}")
+        spec['row_rules'] = [
+            rule for rule in spec.get('row_rules', [])
+            if (selected is None or rule.get('id') in selected) and rule.get('id') not in disabled
+        ]
+        for key in self.PROFILE_OVERRIDES:
+            if key in profile:
+                spec[key] = profile[key]
+        return spec
+
+
+def load_rule_book(rules_file):
+    """
+    Đọc và biên dịch rules.json (cache theo thời gian sửa file).
+    Không có file thì dùng DEFAULT_RULES; file lỗi thì báo và dùng DEFAULT_RULES.
+    """
+    rules_file = Path(rules_file)
+    try:
+        mtime = rules_file.stat().st_mtime
+    except OSError:
+        mtime = None
+
+    with _book_lock:
+        cached = _book_cache.get(rules_file)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    book = None
+    if mtime is not None:
+        try:
+            with open(rules_file, 'r', encoding='utf-8') as f:
+                book = RuleBook(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ {rules_file.name} không hợp lệ ({e}), dùng bộ rule mặc định")
+    if book is None:
+        book = RuleBook(copy.deepcopy(DEFAULT_RULES))
+
+    with _book_lock:
+        _book_cache[rules_file] = (mtime, book)
+    return book
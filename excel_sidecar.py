@@ -0,0 +1,182 @@
+"""
+File dữ liệu dạng cột ghi cạnh file Excel đã xử lý (output/DDMMYYYY/<short_name>.parquet hoặc .csv):
+các dòng dữ liệu còn hiện sau khi áp dụng bộ rule, tên cột lấy từ dòng tiêu đề (mặc định dòng 4-5),
+kèm short_name và tháng báo cáo. Dòng được đưa vào ngay trong lượt xử lý file (process_single_excel),
+không phải mở lại file xlsx để đọc.
+- "parquet": cột có kiểu (số nguyên, số thực, ngày giờ, chuỗi), cần pyarrow (pip install pyarrow);
+  chưa cài thì ghi CSV
+- "csv": UTF-8 có BOM (mở thẳng bằng Excel), ghi từng dòng
+"""
+
+import os
+import csv
+from datetime import datetime, date, time, timedelta
+from pathlib import Path
+from openpyxl.utils import get_column_letter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow là tùy chọn, không có thì ghi CSV
+    pa = None
+
+META_COLUMNS = ('short_name', 'report_month')
+
+
+def report_month_of(excel_file):
+    """
+    Tháng báo cáo "YYYY-MM" của file trong thư mục ngày DDMMYYYY: ngày chạy lùi 1 ngày
+    (như OrderChecker.get_report_month), thư mục không đúng dạng thì tính theo hôm nay
+    """
+    try:
+        run_date = datetime.strptime(Path(excel_file).parent.name, "%d%m%Y")
+    except ValueError:
+        run_date = datetime.now()
+    return f"{run_date - timedelta(days=1):%Y-%m}"
+
+
+def _column_type(values):
+    """
+    Kiểu dữ liệu của cột parquet theo các giá trị khác rỗng: bool, int64, float64, timestamp, date32, string
+    """
+    kinds = {type(value) for value in values if value is not None}
+    if not kinds:
+        return pa.string()
+    if kinds == {bool}:
+        return pa.bool_()
+    if kinds == {int}:
+        return pa.int64()
+    if kinds <= {int, float}:
+        return pa.float64()
+    if kinds == {datetime}:
+        return pa.timestamp('us')
+    if kinds == {date}:
+        return pa.date32()
+    return pa.string()
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+class SidecarWriter:
+    """
+    Nhận các dòng của sheet theo thứ tự (add_row) từ engine xử lý, giữ lại dòng tiêu đề và dòng dữ liệu còn hiện.
+    Engine gọi begin(số cột) trước dòng đầu tiên, wants() để bỏ qua dòng không cần đọc giá trị
+    """
+    def __init__(self, excel_file, rule_set, short_name, report_month=None):
+        excel_file = Path(excel_file)
+        self.format = rule_set.sidecar
+        if self.format == 'parquet' and pa is None:
+            print("⚠️ Chưa cài pyarrow (pip install pyarrow) - ghi file dữ liệu dạng CSV")
+            self.format = 'csv'
+        self.path = excel_file.with_suffix(f".{self.format}")
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.short_name = short_name
+        self.report_month = report_month or report_month_of(excel_file)
+        self.header_rows = set(rule_set.sidecar_header_rows)
+        self.data_start_row = rule_set.data_start_row
+        self.col_count = 0
+        self.headers = {}      # dòng tiêu đề -> giá trị
+        self.names = None
+        self.columns = None    # parquet: giá trị theo cột
+        self.csv_file = None
+        self.csv_writer = None
+        self.row_count = 0
+
+    def begin(self, col_count):
+        self.col_count = col_count
+
+    def wants(self, row_num, hidden):
+        """
+        Dòng có cần đưa vào không: dòng tiêu đề, hoặc dòng dữ liệu chưa bị ẩn
+        """
+        return row_num in self.header_rows or (row_num >= self.data_start_row and not hidden)
+
+    def add_row(self, row_num, values, hidden=False, cleared=None):
+        """
+        values: giá trị các ô theo cột (phần tử đầu = cột A); hidden/cleared không dùng (dòng ẩn đã bị loại ở wants)
+        """
+        values = list(values[:self.col_count])
+        values.extend([None] * (self.col_count - len(values)))
+        if row_num in self.header_rows and row_num < self.data_start_row:
+            self.headers[row_num] = values
+            return
+        if all(value is None for value in values):
+            return
+        if self.names is None:
+            self._start()
+        self.row_count += 1
+        if self.columns is not None:
+            for column, value in zip(self.columns, values):
+                column.append(value)
+        else:
+            self.csv_writer.writerow([self.short_name, self.report_month] + [_text(value) for value in values])
+
+    def _column_names(self):
+        """
+        Tên cột: dòng tiêu đề dưới cùng có chữ (vd dòng 5, trống thì dòng 4), không có thì tên cột Excel.
+        Tên trùng thêm tên cột Excel phía sau
+        """
+        names = []
+        used = set(META_COLUMNS)
+        for idx in range(self.col_count):
+            letter = get_column_letter(idx + 1)
+            name = letter
+            for row_num in sorted(self.headers, reverse=True):
+                text = self.headers[row_num][idx]
+                text = str(text).strip() if text is not None else ""
+                if text:
+                    name = text
+                    break
+            if name in used:
+                name = f"{name} ({letter})"
+            used.add(name)
+            names.append(name)
+        return names
+
+    def _start(self):
+        self.names = self._column_names()
+        if self.format == 'parquet':
+            self.columns = [[] for _ in range(self.col_count)]
+        else:
+            self.csv_file = open(self.tmp_path, 'w', encoding='utf-8-sig', newline='')
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(list(META_COLUMNS) + self.names)
+
+    def close(self):
+        """
+        Ghi xong file (ghi file tạm rồi đổi tên), trả về đường dẫn
+        """
+        if self.names is None:
+            self._start()
+        if self.columns is not None:
+            arrays = [pa.array([self.short_name] * self.row_count, pa.string()),
+                      pa.array([self.report_month] * self.row_count, pa.string())]
+            for column in self.columns:
+                column_type = _column_type(column)
+                if column_type == pa.string():
+                    column = [_text(value) for value in column]
+                arrays.append(pa.array(column, column_type))
+            table = pa.Table.from_arrays(arrays, names=list(META_COLUMNS) + self.names)
+            pq.write_table(table, self.tmp_path, compression='zstd')
+            self.columns = None
+        else:
+            self.csv_file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def discard(self):
+        """
+        Bỏ file đang ghi dở (xử lý lỗi / chuyển sang engine khác)
+        """
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+        self.columns = None
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
@@ -20,6 +20,8 @@ def show_menu():
     print("5. 📁 Mở thư mục kết quả")
     print("6. 📖 Xem hướng dẫn")
     print("7. 🔧 Cài đặt/kiểm tra môi trường")
+    print("8. 🗃️ Tra cứu lịch sử báo cáo")
+    print("9. ⏰ Chạy nền theo lịch (daemon)")
     print("0. ❌ Thoát")
     print("="*60)
 
@@ -51,6 +53,17 @@ def run_full_system():
     """Chạy hệ thống hoàn chỉnh"""
     print("\n🚀 Đang khởi chạy hệ thống hoàn chỉnh...")
     
+    # Daemon đang chạy (menu 9): gửi yêu cầu chạy ngay, dùng Chromium đang mở sẵn
+    try:
+        from check_daemon import request_run
+        reply = request_run(wait=True)
+    except Exception:
+        reply = None
+    if reply is not None:
+        print("⏰ Đã chạy qua daemon (xem chi tiết ở cửa sổ daemon)")
+        print("✅ Hoàn thành tất cả!" if reply.get('success') else "❌ Có lỗi xảy ra!")
+        return
+    
     try:
         # Kiểm tra xem có đang chạy trong package không
         import sys
@@ -249,6 +262,65 @@ def setup_environment():
             print(f"❌ {dir_name}/: KHÔNG TỒN TẠI")
             print(f"🔧 Tạo thư mục: mkdir {dir_name}")
 
+def query_history():
+    """Tra cứu chỉ mục lịch sử các báo cáo đã xử lý (output/history.sqlite)"""
+    print("\n🗃️ TRA CỨU LỊCH SỬ BÁO CÁO")
+    print("-"*40)
+    
+    try:
+        from process_excel import ExcelProcessor
+        from excel_history import HistoryIndex, print_table, print_update_stats
+        processor = ExcelProcessor()
+        index = HistoryIndex(processor.output_dir, processor.rules_file)
+        print_update_stats(index.update())
+    except Exception as e:
+        print(f"❌ Lỗi cập nhật chỉ mục lịch sử: {e}")
+        return
+    
+    while True:
+        print("\n1. Nhân viên có ô trống ở một cột")
+        print("2. Xem tên cột của báo cáo")
+        print("3. Chạy câu lệnh SQL")
+        print("0. Quay lại")
+        choice = input("\nChọn: ").strip()
+        if choice == "0":
+            break
+        try:
+            if choice == "1":
+                column = input("Cột (vd Q): ").strip() or "Q"
+                short_name = input("Báo cáo (vd DHTC, Enter = tất cả): ").strip() or None
+                days = input("Số ngày gần nhất (Enter = 30): ").strip()
+                columns, rows = index.empty_cells(column, short_name, int(days) if days else 30)
+            elif choice == "2":
+                short_name = input("Báo cáo (vd DHTC): ").strip()
+                columns, rows = ["cot", "tieu_de"], list(index.column_titles(short_name).items())
+            elif choice == "3":
+                print("Bảng: files, rows, visible_rows (cột Excel viết trong ngoặc kép, vd \"Q\")")
+                columns, rows = index.query(input("SQL: ").strip())
+            else:
+                print("❌ Lựa chọn không hợp lệ!")
+                continue
+            print_table(columns, rows)
+        except Exception as e:
+            print(f"❌ Lỗi truy vấn: {e}")
+
+def run_daemon():
+    """Chạy daemon: chạy theo lịch trong config.json, giữ sẵn Chromium giữa các lần chạy"""
+    print("\n⏰ Đang khởi động daemon (Ctrl+C để dừng)...")
+    
+    try:
+        import sys
+        if getattr(sys, 'frozen', False):
+            from check_daemon import main as check_daemon_main
+            check_daemon_main(['start'])
+        else:
+            script_path = get_script_path("check_daemon.py")
+            os.system(f'python "{script_path}" start')
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"❌ Lỗi chạy daemon: {e}")
+
 def main():
     """Hàm chính"""
     while True:
@@ -269,6 +341,10 @@ def main():
             show_guide()
         elif choice == "7":
             setup_environment()
+        elif choice == "8":
+            query_history()
+        elif choice == "9":
+            run_daemon()
         elif choice == "0":
             print("\n👋 Tạm biệt!")
             break
@@ -278,4 +354,7 @@ def main():
         input("\n🔄 Nhấn Enter để tiếp tục...")
 
 if __name__ == "__main__":
+    # Cần cho process pool xử lý Excel khi chạy bản đóng gói
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
@@ -1,20 +1,62 @@
 import os
 import sys
 import copy
+import json
 import shutil
+import time
+import sqlite3
 import openpyxl
+import multiprocessing
+from openpyxl.utils import get_column_letter
 import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+from run_trace import RunTracer, NULL_TRACER
+from excel_rules import load_rule_book, AutofitMeter
+from xlsx_patch import patch_excel_file, PatchUnsupported
+from xlsx_stream import stream_excel_file, use_streaming
+from excel_manifest import ExcelManifest
+from excel_history import HistoryIndex, print_update_stats
+from excel_delta import write_delta
+from excel_sidecar import SidecarWriter
+from excel_cache import ReportCache
+from xlsx_merge import merge_workbooks
+
 # Tắt warning openpyxl về default style
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
+class ProcessResult:
+    """
+    Kết quả xử lý một file: dùng như True/False, kèm thống kê từng rule
+    rule_stats: {rule_id: {'hits': ..., 'evaluated': ..., 'time_ms': ...}}
+    """
+    def __init__(self, success, rule_stats=None, error=None):
+        self.success = success
+        self.rule_stats = rule_stats or {}
+        self.error = error
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        return f"ProcessResult(success={self.success}, rules={len(self.rule_stats)})"
+
 class ExcelProcessor:
-    def __init__(self):
+    def __init__(self, tracer=None, workers=1, file_timeout=None, use_manifest=True, use_history=True):
         self.base_path = Path(__file__).parent
         self.output_dir = self.base_path / "output"
         self.create_summary = False  # Tắt tạo file tổng hợp mặc định
+        self.tracer = tracer or NULL_TRACER  # Ghi thời gian từng bước (xem run_trace.py)
+        self.rules_file = self.base_path / "input" / "rules.json"  # Bộ rule B1 -> B10 (xem excel_rules.py)
+        self.workers = workers            # Số process xử lý song song (0 = theo số CPU, 1 = tuần tự)
+        self.file_timeout = file_timeout  # Thời gian tối đa (giây) cho mỗi file khi chạy song song
+        self.use_manifest = use_manifest  # Bỏ qua file đã xử lý (xem excel_manifest.py)
+        self.manifests = {}               # thư mục -> ExcelManifest
+        self.manifest_lock = threading.Lock()
+        self.use_history = use_history    # Cập nhật chỉ mục lịch sử output/history.sqlite (xem excel_history.py)
         
     def get_daily_directory(self):
         """
@@ -43,26 +85,268 @@ class ExcelProcessor:
             print(f"❌ Không tìm thấy file Excel nào trong: {daily_dir}")
             return False
         
+        excel_files.sort(key=lambda f: f.name)
+        
         success_count = 0
         processed_files = []  # Danh sách file đã xử lý thành công
         
-        for i, excel_file in enumerate(excel_files, 1):
-            print(f"🔄 Xử lý file {i}/{len(excel_files)}: {excel_file.name}")
-            
-            if self.process_single_excel(excel_file):
+        # Bỏ qua file đã xử lý / dùng lại kết quả của file tải lại giống hệt (theo manifest.json)
+        pending_files = []
+        tickets = {}
+        for excel_file in excel_files:
+            done, ticket = self.check_manifest(excel_file)
+            if done:
                 success_count += 1
                 processed_files.append(excel_file)
             else:
-                print(f"❌ Thất bại: {excel_file.name}")
+                pending_files.append(excel_file)
+                tickets[excel_file] = ticket
+        
+        workers = self.get_worker_count(len(pending_files))
+        if workers > 1:
+            print(f"⚡ Xử lý song song {len(pending_files)} file trên {workers} process...")
+            outcomes = self.process_files_parallel(pending_files, workers)
+            for i, (excel_file, outcome) in enumerate(zip(pending_files, outcomes), 1):
+                if outcome['success']:
+                    print(f"✅ {i}/{len(pending_files)}: {excel_file.name} ({outcome['seconds']:.1f}s)")
+                    self.record_manifest(excel_file, tickets[excel_file], outcome['seconds'], outcome['rule_stats'])
+                    success_count += 1
+                    processed_files.append(excel_file)
+                else:
+                    print(f"❌ Thất bại: {excel_file.name} ({outcome['error']})")
+        else:
+            for i, excel_file in enumerate(pending_files, 1):
+                print(f"🔄 Xử lý file {i}/{len(pending_files)}: {excel_file.name}")
+                
+                started = time.perf_counter()
+                result = self.process_single_excel(excel_file)
+                if result:
+                    self.record_manifest(excel_file, tickets[excel_file], time.perf_counter() - started,
+                                         result.rule_stats)
+                    success_count += 1
+                    processed_files.append(excel_file)
+                else:
+                    print(f"❌ Thất bại: {excel_file.name}")
         
+        processed_files.sort(key=lambda f: f.name)
         print(f"📊 Kết quả: {success_count}/{len(excel_files)} file được xử lý thành công")
         
-        # Tạo file tổng hợp nếu được bật và có file được xử lý thành công
-        if self.create_summary and processed_files:
+        # File tổng hợp (nếu bật), file delta, chỉ mục lịch sử cho các file được xử lý thành công
+        self.finish_files(processed_files)
+        
+        return success_count > 0
+    
+    def get_manifest(self, directory):
+        """
+        Manifest của thư mục ngày (None nếu tắt use_manifest)
+        """
+        if not self.use_manifest:
+            return None
+        directory = Path(directory)
+        with self.manifest_lock:
+            if directory not in self.manifests:
+                self.manifests[directory] = ExcelManifest(directory)
+            return self.manifests[directory]
+    
+    def check_manifest(self, excel_file):
+        """
+        Kiểm tra file với manifest trước khi xử lý.
+        Trả về (True, None) nếu không cần xử lý nữa, (False, ticket) nếu cần - ticket dùng cho record_manifest
+        """
+        excel_file = Path(excel_file)
+        manifest = self.get_manifest(excel_file.parent)
+        if manifest is None:
+            return False, None
+        try:
+            with self.tracer.span("manifest_check", short_name=excel_file.stem) as span:
+                rules_version = load_rule_book(self.rules_file).for_report(excel_file.stem).version
+                status, input_hash = manifest.lookup(excel_file, rules_version)
+                span['status'] = status
+        except OSError as e:
+            print(f"⚠️ Không kiểm tra được manifest cho {excel_file.name}: {str(e)}")
+            return False, None
+        if status == "processed":
+            print(f"⏭️ Bỏ qua {excel_file.name}: đã xử lý")
+            self.restore_sidecar(excel_file, input_hash, rules_version)
+            return True, None
+        if status == "reused":
+            print(f"♻️ {excel_file.name}: giống file đã xử lý trước đó, dùng lại kết quả")
+            self.restore_sidecar(excel_file, input_hash, rules_version)
+            return True, None
+        return False, (manifest, input_hash, rules_version)
+    
+    def restore_sidecar(self, excel_file, digest, rules_version):
+        """
+        File không cần xử lý lại nhưng chưa có file dữ liệu sidecar (vd mới bật sidecar, dùng lại kết quả
+        của file khác): tạo từ cache dữ liệu, không mở file xlsx. digest: hash file từ manifest
+        """
+        rule_set = load_rule_book(self.rules_file).for_report(excel_file.stem)
+        cache = self.get_cache()
+        if rule_set.sidecar == 'none' or cache is None:
+            return
+        sidecar = SidecarWriter(excel_file, rule_set, excel_file.stem)
+        if sidecar.path.exists():
+            return
+        report = cache.load(digest=digest, rules_version=rules_version)
+        if report is None:
+            return
+        try:
+            report.feed(sidecar)
+            print(f"📄 {excel_file.stem}: tạo file dữ liệu {sidecar.path.name} từ cache")
+            sidecar.close()
+        except (OSError, ValueError) as e:
+            sidecar.discard()
+            print(f"⚠️ Không tạo được {sidecar.path.name}: {str(e)}")
+    
+    def record_manifest(self, excel_file, ticket, seconds, rule_stats=None):
+        """
+        Ghi file vừa xử lý thành công vào manifest (ticket từ check_manifest)
+        """
+        if ticket is None:
+            return
+        manifest, input_hash, rules_version = ticket
+        try:
+            manifest.record(excel_file, input_hash, rules_version, seconds, rule_stats)
+        except OSError as e:
+            print(f"⚠️ Không ghi được manifest cho {Path(excel_file).name}: {str(e)}")
+    
+    def finish_files(self, processed_files):
+        """
+        Các bước sau khi xử lý xong các file của lần chạy: file tổng hợp (nếu bật),
+        file delta so với lần chạy trước, chỉ mục lịch sử
+        """
+        if not processed_files:
+            return
+        if self.create_summary:
             print("📋 Đang tạo file tổng hợp...")
             self.create_summary_workbook(processed_files)
+        self.write_deltas(processed_files)
+        self.update_history(processed_files)
+    
+    def write_deltas(self, processed_files):
+        """
+        Ghi file delta (dòng mới / không còn / thay đổi so với thư mục ngày trước đó) cho từng file đã xử lý
+        """
+        book = load_rule_book(self.rules_file)
+        cache = self.get_cache()
+        for excel_file in processed_files:
+            excel_file = Path(excel_file)
+            rule_set = book.for_report(excel_file.stem)
+            if not rule_set.delta_key_columns:
+                continue
+            try:
+                with self.tracer.span("delta", short_name=excel_file.stem):
+                    delta = write_delta(excel_file, rule_set, cache)
+            except (OSError, ValueError, PatchUnsupported) as e:
+                print(f"⚠️ Không so được {excel_file.name} với lần chạy trước: {str(e)}")
+                continue
+            if delta is not None:
+                print(f"🔁 {excel_file.stem} so với {delta['previous']}: {delta['added']} dòng mới, "
+                      f"{delta['removed']} dòng không còn, {delta['changed']} dòng thay đổi -> {delta['path'].name}")
+    
+    def update_history(self, processed_files=None):
+        """
+        Đưa các file đã xử lý (mọi thư mục ngày) chưa có vào chỉ mục lịch sử SQLite
+        processed_files: file vừa xử lý trong lần chạy (cần khi thư mục ngày không có manifest.json)
+        """
+        if not self.use_history:
+            return
+        try:
+            with self.tracer.span("history_index") as span:
+                stats = HistoryIndex(self.output_dir, self.rules_file).update(processed_files)
+                span['files'] = stats['indexed']
+            print_update_stats(stats)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️ Không cập nhật được chỉ mục lịch sử: {str(e)}")
+    
+    def get_worker_count(self, file_count):
+        """
+        Số process xử lý song song: workers = 0 là theo số CPU, không vượt quá số file
+        """
+        try:
+            workers = int(self.workers)
+        except (TypeError, ValueError):
+            workers = 1
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        return max(1, min(workers, file_count))
+    
+    def process_files_parallel(self, excel_files, workers):
+        """
+        Chạy process_single_excel cho từng file trong pool process (các process được khởi tạo sẵn
+        openpyxl và bộ rule). Mỗi file một process riêng nên lỗi/crash của file này không ảnh hưởng file khác.
+        Trả về danh sách theo đúng thứ tự excel_files: {'success', 'seconds', 'error', 'rule_stats'}
+        - File chạy quá file_timeout giây hoặc process bị chết giữa chừng: ghi nhận thất bại
+        - Khi mọi process đều kẹt ở file quá giờ: dừng pool và chạy các file còn lại trong pool mới
+        """
+        tracing = isinstance(self.tracer, RunTracer)
+        outcomes = [None] * len(excel_files)
+        remaining = list(range(len(excel_files)))
         
-        return success_count > 0
+        while remaining:
+            # SimpleQueue ghi thẳng vào pipe: thông báo không bị mất nếu worker chết ngay sau đó
+            started_events = multiprocessing.SimpleQueue()
+            pool = multiprocessing.Pool(processes=workers, initializer=_init_excel_worker,
+                                        initargs=(started_events, str(self.rules_file)))
+            jobs = {
+                idx: pool.apply_async(_process_excel_job, (idx, str(excel_files[idx]), tracing))
+                for idx in remaining
+            }
+            all_jobs = list(jobs.values())
+            remaining = []
+            started = {}      # idx -> (pid, thời điểm bắt đầu)
+            timed_out = set()  # File quá giờ, process vẫn đang chạy
+            
+            try:
+                while jobs:
+                    while not started_events.empty():
+                        idx, pid, start_time = started_events.get()
+                        started[idx] = (pid, start_time)
+                    
+                    alive_pids = {process.pid for process in multiprocessing.active_children()}
+                    for idx, job in list(jobs.items()):
+                        if job.ready():
+                            try:
+                                result, seconds = job.get()
+                                timed_out.discard(idx)
+                                if tracing:
+                                    result, events = result
+                                    self.tracer.add_events(events)
+                                outcomes[idx] = {'success': bool(result), 'seconds': seconds,
+                                                 'error': getattr(result, 'error', None) or "lỗi xử lý",
+                                                 'rule_stats': getattr(result, 'rule_stats', None)}
+                            except Exception as e:
+                                outcomes[idx] = {'success': False, 'seconds': 0.0, 'error': str(e)}
+                            del jobs[idx]
+                        elif idx in started and idx not in timed_out:
+                            pid, start_time = started[idx]
+                            elapsed = time.time() - start_time
+                            if pid not in alive_pids:
+                                outcomes[idx] = {'success': False, 'seconds': elapsed, 'error': "process xử lý bị dừng đột ngột"}
+                                del jobs[idx]
+                            elif self.file_timeout and elapsed > self.file_timeout:
+                                outcomes[idx] = {'success': False, 'seconds': elapsed,
+                                                 'error': f"quá {self.file_timeout}s"}
+                                timed_out.add(idx)
+                    
+                    # File quá giờ vẫn chiếm process cho tới khi pool bị dừng
+                    waiting = [idx for idx in jobs if idx not in timed_out]
+                    if not waiting:
+                        break
+                    if len(timed_out) >= workers:
+                        # Mọi process đều kẹt: các file chưa chạy chuyển sang pool mới
+                        remaining = waiting
+                        break
+                    time.sleep(0.05)
+            finally:
+                # Còn việc chưa xong (file quá giờ, process đã chết) thì pool.close() sẽ chờ mãi
+                if all(job.ready() for job in all_jobs):
+                    pool.close()
+                else:
+                    pool.terminate()
+                pool.join()
+        
+        return outcomes
     
     def process_single_excel(self, excel_file):
         """
@@ -81,253 +365,244 @@ class ExcelProcessor:
         B9: Cố định xem được tiêu đề
         B10: Tối ưu cột I, K (bỏ xuống dòng + tự động điều chỉnh độ rộng)
         B11: Tạo file tổng hợp Kết quả.xlsx (tùy chọn - mặc định tắt)
+        Các bước trên được khai báo trong input/rules.json (profile theo tên file = short_name),
+        trả về ProcessResult kèm số dòng trúng và thời gian của từng rule
         """
+        short_name = Path(excel_file).stem
+        steps = self.tracer.steps("process_single_excel", short_name=short_name)
+        sidecar = None
+        cache_writer = None
         try:
+            rule_set = load_rule_book(self.rules_file).for_report(short_name)
+
+            if rule_set.writer != 'openpyxl':
+                # Sửa trực tiếp sheet XML trong file (không load/save cả workbook),
+                # file rất lớn thì đọc/ghi từng dòng với bộ nhớ cố định
+                writer = 'stream' if use_streaming(excel_file, rule_set) else 'xml'
+                steps.next(f"{writer}_patch")
+                try:
+                    patch = stream_excel_file if writer == 'stream' else patch_excel_file
+                    sidecar = self.create_sidecar(excel_file, rule_set, short_name)
+                    # Writer stream giữ bộ nhớ cố định nên không gom dữ liệu cả sheet vào cache
+                    if writer != 'stream':
+                        cache_writer = self.create_cache_writer(excel_file, rule_set, short_name)
+                    rule_stats, _ = patch(excel_file, rule_set, [sink for sink in (sidecar, cache_writer) if sink])
+                    if sidecar is not None:
+                        sidecar.close()
+                    if cache_writer is not None:
+                        steps.next("cache")
+                        self.close_cache_writer(cache_writer, excel_file, rule_stats)
+                    steps.end(success=True, profile=rule_set.name, writer=writer,
+                              rule_hits={rule_id: stats['hits'] for rule_id, stats in rule_stats.items()})
+                    return ProcessResult(True, rule_stats)
+                except PatchUnsupported as e:
+                    if rule_set.writer in ('xml', 'stream'):
+                        raise
+                    print(f"ℹ️ {short_name}: {e} - xử lý bằng openpyxl")
+                    for sink in (sidecar, cache_writer):
+                        if sink is not None:
+                            sink.discard()
+
             # Mở file Excel
+            steps.next("load_workbook")
             wb = openpyxl.load_workbook(excel_file)
             ws = wb.active
             
             row_count = ws.max_row
             col_count = ws.max_column
             
-            # B1: Ẩn từ dòng 1 đến dòng 3
-            for row_num in range(1, 4):  # Dòng 1, 2, 3
-                ws.row_dimensions[row_num].hidden = True
-            # B1.1: Ẩn các dòng có cột K chứa nội dung "TMDT" (chỉ cần chứa, không cần chính xác)
-            hidden_count_k_tmdt = 0
-            for row_num in range(6, row_count + 1):
-                cell_k = ws.cell(row_num, 11)  # Cột K
-                if cell_k.value is not None and "TMDT" in str(cell_k.value):
-                    ws.row_dimensions[row_num].hidden = True
-                    hidden_count_k_tmdt += 1
-            # B1.2: Ẩn dòng có cột J = "NVNPP015"
-            hidden_count_j_nvnpp015 = 0
-            for row_num in range(6, row_count + 1):
-                cell_j = ws.cell(row_num, 10)  # Cột J
-                if cell_j.value is not None and str(cell_j.value).strip() == "NVNPP015":
-                    ws.row_dimensions[row_num].hidden = True
-                    hidden_count_j_nvnpp015 += 1
-            
-            # B2: Ẩn dòng có cột A rỗng (từ dòng 6 trở đi, bỏ qua tiêu đề dòng 4-5)
-            hidden_count_a = 0
-            for row_num in range(6, row_count + 1):
-                cell_a = ws.cell(row_num, 1)
-                if cell_a.value is None or str(cell_a.value).strip() == "":
-                    ws.row_dimensions[row_num].hidden = True
-                    hidden_count_a += 1
-            
-            # B3: Ẩn dòng có cột B rỗng, C rỗng VÀ F KHÁC rỗng (chỉ xét dòng chưa bị ẩn)
-            hidden_count_b = 0
-            for row_num in range(6, row_count + 1):
-                if not ws.row_dimensions[row_num].hidden:
-                    cell_b = ws.cell(row_num, 2) # Cột B
-                    cell_c = ws.cell(row_num, 3) # Cột C
-                    cell_f = ws.cell(row_num, 6) # Cột F
-                    
-                    b_is_empty = cell_b.value is None or str(cell_b.value).strip() == ""
-                    c_is_empty = cell_c.value is None or str(cell_c.value).strip() == ""
-                    f_is_not_empty = cell_f.value is not None and str(cell_f.value).strip() != ""
-                    
-                    if b_is_empty and c_is_empty and f_is_not_empty:
-                        ws.row_dimensions[row_num].hidden = True
-                        hidden_count_b += 1
-            
-            # B4: Ẩn dòng có cột D rỗng AND cột C <> ""
-            hidden_count_d = 0
-            for row_num in range(6, row_count + 1):
-                if not ws.row_dimensions[row_num].hidden:
-                    cell_c = ws.cell(row_num, 3)
-                    cell_d = ws.cell(row_num, 4)
-                    
-                    c_not_empty = (cell_c.value is not None and str(cell_c.value).strip() != "")
-                    d_empty = (cell_d.value is None or str(cell_d.value).strip() == "")
-                    
-                    if d_empty and c_not_empty:
-                        ws.row_dimensions[row_num].hidden = True
-                        hidden_count_d += 1
-            
-            # B4: Xóa dữ liệu của các dòng có cột C rỗng, xóa từ K trở đi
-            cleared_count_c = 0
-            for row_num in range(6, row_count + 1):
-                cell_c = ws.cell(row_num, 3)
-                if cell_c.value is None or str(cell_c.value).strip() == "":
-                    # Xóa dữ liệu từ cột K (11) trở đi
-                    if col_count >= 11:
-                        for col_num in range(11, col_count + 1):
-                            try:
-                                ws.cell(row_num, col_num).value = None
-                            except AttributeError:
-                                pass  # Bỏ qua MergedCell
-                        cleared_count_c += 1
-            
-            # B5: Ẩn các dòng ở cột K chứa các từ khóa chỉ định (NPP Bán, NPP tự bán, TMDT...)
-            hidden_count_k = 0
-            keywords_to_hide = ["NPP Bán", "NPP tự bán", "TMDT Lazada", "TMDT Sendo", "TMDT Tiki", "TT Bán"]
-            for row_num in range(6, row_count + 1):
-                if not ws.row_dimensions[row_num].hidden:
-                    cell_k = ws.cell(row_num, 11)  # Cột K
-                    if cell_k.value is not None:
-                        cell_value_str = str(cell_k.value)
-                        if any(keyword in cell_value_str for keyword in keywords_to_hide):
-                            ws.row_dimensions[row_num].hidden = True
-                            hidden_count_k += 1
-            
-            # B6: Ẩn dòng có cột Q > 0 (giữ lại dòng rỗng và 0)
-            hidden_count_q = 0
-            for row_num in range(6, row_count + 1):
-                if not ws.row_dimensions[row_num].hidden:
-                    cell_q = ws.cell(row_num, 17)  # Cột Q
-                    if cell_q.value is not None:
-                        try:
-                            q_value = float(cell_q.value)
-                            if q_value > 0:
-                                ws.row_dimensions[row_num].hidden = True
-                                hidden_count_q += 1
-                        except (ValueError, TypeError):
-                            pass
-            
-            # B7: Kiểm tra cột Q nếu có 2 dòng rỗng liên tiếp thì ẩn dòng thứ 2
-            hidden_count_q2 = 0
-            prev_row_q_empty = False
-            for row_num in range(6, row_count + 1):
-                if not ws.row_dimensions[row_num].hidden:
-                    cell_q = ws.cell(row_num, 17)  # Cột Q
-                    current_row_q_empty = (cell_q.value is None or str(cell_q.value).strip() == "")
-                    
-                    if prev_row_q_empty and current_row_q_empty:
-                        ws.row_dimensions[row_num].hidden = True
-                        hidden_count_q2 += 1
-                    
-                    prev_row_q_empty = current_row_q_empty
+            steps.next("rules")
+            # B1 -> B7: Ẩn/xóa dòng theo bộ rule của báo cáo, duyệt dữ liệu một lượt
+            cleared = {}
+            rule_stats = rule_set.run(ws, row_count, col_count, cleared)
             
+            steps.next("B8")
             # B8: Ẩn cột S trở đi, cột A đến F, cột M và N
-            hidden_cols = self.hide_unwanted_columns(ws)
+            hidden_cols = self.hide_unwanted_columns(ws, rule_set)
             
+            steps.next("B9")
             # B9: Cố định xem được tiêu đề
-            ws.freeze_panes = "A6"  # Cố định dòng 4-5 (tiêu đề)
+            if rule_set.freeze_panes:
+                ws.freeze_panes = rule_set.freeze_panes  # Mặc định "A6": cố định dòng 4-5 (tiêu đề)
             
+            steps.next("B10")
             # B10: Tối ưu cột I, K (bỏ xuống dòng + tự động điều chỉnh độ rộng)
-            self.optimize_columns_i_k(ws)
+            self.optimize_columns_i_k(ws, rule_set.autofit_columns)
             
+            # File dữ liệu các dòng còn hiện và cache dữ liệu (tùy chọn, đọc luôn từ sheet đang mở)
+            sidecar = self.create_sidecar(excel_file, rule_set, short_name)
+            cache_writer = self.create_cache_writer(excel_file, rule_set, short_name)
+            sinks = [sink for sink in (sidecar, cache_writer) if sink]
+            if sinks:
+                steps.next("sinks")
+                self.fill_sinks(sinks, ws, row_count, col_count, cleared)
+            
+            steps.next("save")
             # Lưu file
             wb.save(excel_file)
             wb.close()
+            if sidecar is not None:
+                sidecar.close()
+            if cache_writer is not None:
+                steps.next("cache")
+                self.close_cache_writer(cache_writer, excel_file, rule_stats)
+            steps.end(success=True, profile=rule_set.name,
+                      rule_hits={rule_id: stats['hits'] for rule_id, stats in rule_stats.items()})
             
-            return True
+            return ProcessResult(True, rule_stats)
             
         except Exception as e:
+            for sink in (sidecar, cache_writer):
+                if sink is not None:
+                    sink.discard()
+            steps.end(success=False, error=str(e))
             print(f"❌ Lỗi xử lý: {str(e)}")
-            return False
+            return ProcessResult(False, error=str(e))
+    
+    def create_sidecar(self, excel_file, rule_set, short_name):
+        """
+        File dữ liệu dạng cột ghi cạnh file xlsx (None nếu bộ rule không bật sidecar, xem excel_sidecar.py)
+        """
+        if rule_set.sidecar == 'none':
+            return None
+        return SidecarWriter(excel_file, rule_set, short_name)
+    
+    def get_cache(self):
+        """
+        Cache dữ liệu báo cáo đã xử lý trong output/.report_cache (None nếu rules.json đặt cache_mb = 0)
+        """
+        cache_mb = load_rule_book(self.rules_file).cache_mb
+        if cache_mb <= 0:
+            return None
+        return ReportCache(self.output_dir / ReportCache.DIR_NAME, cache_mb)
+    
+    def create_cache_writer(self, excel_file, rule_set, short_name):
+        """
+        Ghi cache dữ liệu của file đang xử lý (None nếu tắt cache hoặc file tải về này đã có trong cache)
+        """
+        cache = self.get_cache()
+        if cache is None:
+            return None
+        try:
+            return cache.writer(excel_file, rule_set, short_name)
+        except OSError as e:
+            print(f"⚠️ Không tạo được cache cho {Path(excel_file).name}: {str(e)}")
+            return None
+    
+    def close_cache_writer(self, cache_writer, excel_file, rule_stats):
+        """
+        Lưu entry cache sau khi ghi xong file (lỗi cache không làm hỏng kết quả xử lý)
+        """
+        try:
+            cache_writer.close(excel_file, rule_stats)
+        except OSError as e:
+            cache_writer.discard()
+            print(f"⚠️ Không lưu được cache cho {Path(excel_file).name}: {str(e)}")
+    
+    def fill_sinks(self, sinks, ws, row_count, col_count, cleared):
+        """
+        Đưa các dòng của sheet đã xử lý vào sidecar / cache (mỗi sink chọn dòng qua wants)
+        (chỉ đọc bảng ô có sẵn, không tạo ô/dòng mới trong sheet)
+        """
+        for sink in sinks:
+            sink.begin(col_count)
+        cells = ws._cells
+        row_dimensions = ws.row_dimensions
+        for row_num in range(1, row_count + 1):
+            row_dim = row_dimensions.get(row_num)
+            hidden = row_dim is not None and bool(row_dim.hidden)
+            wanted = [sink for sink in sinks if sink.wants(row_num, hidden)]
+            if not wanted:
+                continue
+            values = []
+            for col_num in range(1, col_count + 1):
+                cell = cells.get((row_num, col_num))
+                values.append(cell.value if cell is not None else None)
+            for sink in wanted:
+                sink.add_row(row_num, values, hidden, cleared.get(row_num))
+    
+    def process_with_manifest(self, excel_file):
+        """
+        process_single_excel có kiểm tra và ghi manifest (bỏ qua file đã xử lý / dùng lại kết quả cũ)
+        """
+        done, ticket = self.check_manifest(excel_file)
+        if done:
+            return ProcessResult(True)
+        started = time.perf_counter()
+        result = self.process_single_excel(excel_file)
+        if result:
+            self.record_manifest(excel_file, ticket, time.perf_counter() - started, result.rule_stats)
+        return result
     
-    def hide_unwanted_columns(self, ws):
+    def hide_unwanted_columns(self, ws, rule_set=None):
         """
-        Ẩn cột A đến F, cột H, J, L, M, N và từ cột S trở đi.
+        Ẩn các cột trong hidden_columns của bộ rule (mặc định: A đến F, H, J, L, M, N và từ S trở đi).
         Trả về số cột đã ẩn.
         """
         try:
+            if rule_set is None:
+                rule_set = load_rule_book(self.rules_file).for_report(None)
             total_cols = ws.max_column
             hidden_count = 0
             
-            # Ẩn cột A đến F (cột 1 đến 6)
-            for col_num in range(1, 7):  # Cột A=1 đến F=6
-                if col_num <= total_cols:
-                    ws.column_dimensions[ws.cell(1, col_num).column_letter].hidden = True
+            for col_num in range(1, total_cols + 1):
+                if rule_set.column_is_hidden(col_num, total_cols):
+                    ws.column_dimensions[get_column_letter(col_num)].hidden = True
                     hidden_count += 1
             
-            # Ẩn cột H (cột 8)
-            if total_cols >= 8:
-                ws.column_dimensions[ws.cell(1, 8).column_letter].hidden = True
-                hidden_count += 1
-            
-            # Ẩn cột J (cột 10)
-            if total_cols >= 10:
-                ws.column_dimensions[ws.cell(1, 10).column_letter].hidden = True
-                hidden_count += 1
-            
-            # Ẩn cột L (cột 12)
-            if total_cols >= 12:
-                ws.column_dimensions[ws.cell(1, 12).column_letter].hidden = True
-                hidden_count += 1
-            
-            # Ẩn cột M (cột 13)
-            if total_cols >= 13:
-                ws.column_dimensions[ws.cell(1, 13).column_letter].hidden = True
-                hidden_count += 1
-            
-            # Ẩn cột N (cột 14)
-            if total_cols >= 14:
-                ws.column_dimensions[ws.cell(1, 14).column_letter].hidden = True
-                hidden_count += 1
-            
-            # Ẩn từ cột S trở đi (cột 19 trở đi)
-            for col_num in range(19, total_cols + 1):  # Từ S=19 đến cuối
-                ws.column_dimensions[ws.cell(1, col_num).column_letter].hidden = True
-                hidden_count += 1
-            
             return hidden_count
             
         except Exception as e:
             print(f"❌ Lỗi ẩn cột: {str(e)}")
             return 0
     
-    def optimize_columns_i_k(self, ws):
+    def optimize_columns_i_k(self, ws, columns=None):
         """
-        Tối ưu cột I, K (mô phỏng double-click auto-fit Excel):
+        Tối ưu cột I, K hoặc các cột trong autofit_columns của bộ rule (mô phỏng double-click auto-fit Excel):
         1. Bỏ thuộc tính xuống dòng (word wrap)
         2. Tự động điều chỉnh độ rộng cột vừa đủ với dữ liệu (auto-fit)
         Chỉ tác động lên cột I và K, không động vào cột G
+        Một lượt qua các ô đã có trong vùng dữ liệu; mỗi kiểu alignment chỉ tạo bản "tắt wrap" một lần
         """
         try:
             from openpyxl.styles import Alignment
+            from openpyxl.styles.cell_style import StyleArray
             
             # Chỉ xử lý cột I=9, K=11 (bỏ cột G=7)
-            target_columns = [9, 11]  # I, K
+            target_columns = columns or [9, 11]  # I, K
+            alignments = ws.parent._alignments
+            no_wrap = {}  # alignmentId cũ -> alignmentId đã tắt wrap_text
+            meters = {col_num: AutofitMeter() for col_num in target_columns}
+            cells = ws._cells
             
-            for col_num in target_columns:
-                col_letter = ws.cell(1, col_num).column_letter
-                
-                # 1. Bỏ thuộc tính xuống dòng cho tất cả cell trong cột
-                for row in ws.iter_rows(min_col=col_num, max_col=col_num):
-                    for cell in row:
-                        if cell.alignment:
-                            # Giữ nguyên các thuộc tính khác, chỉ tắt wrap_text
-                            cell.alignment = Alignment(
-                                horizontal=cell.alignment.horizontal,
-                                vertical=cell.alignment.vertical,
-                                text_rotation=cell.alignment.text_rotation,
-                                wrap_text=False,  # Tắt xuống dòng
-                                shrink_to_fit=cell.alignment.shrink_to_fit,
-                                indent=cell.alignment.indent
-                            )
-                        else:
-                            # Nếu chưa có alignment, tạo mới với wrap_text=False
-                            cell.alignment = Alignment(wrap_text=False)
-                
-                # 2. Tự động điều chỉnh độ rộng cột (mô phỏng double-click auto-fit)
-                max_length = 0
-                for row in ws.iter_rows(min_col=col_num, max_col=col_num):
-                    for cell in row:
-                        if cell.value:
-                            # Tính độ dài text, xử lý cả số và text
-                            cell_text = str(cell.value)
-                            # Ước lượng độ rộng: text thường + số có thể có định dạng
-                            cell_length = len(cell_text)
-                            
-                            # Nếu là số, có thể cần thêm không gian cho định dạng
-                            try:
-                                float(cell.value)
-                                # Nếu là số, thêm 1-2 ký tự cho định dạng
-                                cell_length = max(cell_length, 8)
-                            except (ValueError, TypeError):
-                                pass
-                            
-                            if cell_length > max_length:
-                                max_length = cell_length
-                
-                # Auto-fit: độ rộng = max_length + 1 (tương tự double-click Excel)
-                # Giới hạn tối thiểu 6, tối đa 30 để tránh cột quá rộng
-                auto_fit_width = min(max(max_length + 1, 6), 30)
-                ws.column_dimensions[col_letter].width = auto_fit_width
+            for row_num in range(1, ws.max_row + 1):
+                for col_num, meter in meters.items():
+                    cell = cells.get((row_num, col_num))
+                    if cell is None:
+                        continue  # Ô chưa có: không có dữ liệu, không có style
+                    
+                    # 1. Bỏ thuộc tính xuống dòng, giữ nguyên các thuộc tính alignment khác
+                    if cell._style is None:
+                        cell._style = StyleArray()
+                    alignment_id = cell._style.alignmentId
+                    if alignment_id not in no_wrap:
+                        alignment = alignments[alignment_id]
+                        no_wrap[alignment_id] = alignments.add(Alignment(
+                            horizontal=alignment.horizontal,
+                            vertical=alignment.vertical,
+                            text_rotation=alignment.text_rotation,
+                            wrap_text=False,  # Tắt xuống dòng
+                            shrink_to_fit=alignment.shrink_to_fit,
+                            indent=alignment.indent
+                        ))
+                    cell._style.alignmentId = no_wrap[alignment_id]
+                    
+                    # 2. Đo độ rộng (xem excel_rules.AutofitMeter)
+                    meter.add(cell.value)
+            
+            # Auto-fit: độ rộng = độ rộng hiển thị lớn nhất + 1, giới hạn 6 -> 30
+            for col_num, meter in meters.items():
+                ws.column_dimensions[get_column_letter(col_num)].width = meter.width
                 
         except Exception as e:
             print(f"❌ Lỗi tối ưu cột I, K: {str(e)}")
@@ -341,6 +616,7 @@ class ExcelProcessor:
             return
         
         excel_files = list(daily_dir.glob("*.xlsx"))
+        cache = self.get_cache()
         
         print(f"📁 Thư mục: {daily_dir}")
         print(f"📄 Số file Excel: {len(excel_files)}")
@@ -348,7 +624,14 @@ class ExcelProcessor:
         
         for i, excel_file in enumerate(excel_files, 1):
             file_size = excel_file.stat().st_size
-            print(f"{i:2}. {excel_file.name} ({file_size:,} bytes)")
+            # File đã xử lý có trong cache: số dòng lấy từ cache, không mở file
+            report = cache.load(excel_file) if cache is not None else None
+            if report is not None:
+                hidden_count = sum(report.hidden_mask())
+                print(f"{i:2}. {excel_file.name} ({file_size:,} bytes, "
+                      f"{report.row_count - hidden_count:,}/{report.row_count:,} dòng hiện)")
+            else:
+                print(f"{i:2}. {excel_file.name} ({file_size:,} bytes)")
         
         if not excel_files:
             print("   (Không có file Excel nào)")
@@ -356,15 +639,28 @@ class ExcelProcessor:
     def create_summary_workbook(self, processed_files):
         """
         Tạo file Kết quả.xlsx tổng hợp tất cả các file đã xử lý
-        Mỗi sheet có tên theo tên file gốc (copy trực tiếp file đã xử lý)
+        Mỗi sheet có tên theo tên file gốc: ghép trực tiếp sheet XML của các file đã xử lý
+        (xem xlsx_merge.py), file có cấu trúc không ghép được thì tạo bằng openpyxl
+        """
+        daily_dir = self.get_daily_directory()
+        if not daily_dir:
+            return False
+        
+        summary_file = daily_dir / "Kết quả.xlsx"
+        try:
+            with self.tracer.span("summary_merge", sheets=len(processed_files)):
+                sheet_count = merge_workbooks([(f, f.stem) for f in processed_files], summary_file)
+            print(f"📋 Đã tạo file tổng hợp: {summary_file.name} ({sheet_count} sheet)")
+            return True
+        except Exception as e:
+            print(f"ℹ️ Không ghép trực tiếp được ({str(e)}) - tạo file tổng hợp bằng openpyxl")
+        return self.create_summary_openpyxl(processed_files, summary_file)
+    
+    def create_summary_openpyxl(self, processed_files, summary_file):
+        """
+        Tạo file tổng hợp bằng openpyxl: copy từng ô kèm format sang workbook mới
         """
         try:
-            daily_dir = self.get_daily_directory()
-            if not daily_dir:
-                return False
-            
-            summary_file = daily_dir / "Kết quả.xlsx"
-            
             if len(processed_files) == 1:
                 # Nếu chỉ có 1 file, copy trực tiếp và đổi tên
                 source_file = processed_files[0]
@@ -469,11 +765,113 @@ class ExcelProcessor:
         """
         self.create_summary = False
 
+def process_excel_file(excel_file, trace=False):
+    """
+    Xử lý một file Excel trong process/thread worker (hàm cấp module để gửi được sang process khác)
+    trace=True: trả về (kết quả, danh sách span) để process chính ghép vào trace của lần chạy
+    """
+    if not trace:
+        return ExcelProcessor().process_single_excel(Path(excel_file))
+    tracer = RunTracer()
+    result = ExcelProcessor(tracer=tracer).process_single_excel(Path(excel_file))
+    return result, tracer.export_events()
+
+_started_events = None  # Queue báo file bắt đầu xử lý (trong process worker)
+
+def _init_excel_worker(started_events, rules_file):
+    """
+    Khởi tạo process worker: import openpyxl (khi import module này) và biên dịch sẵn bộ rule
+    """
+    global _started_events
+    _started_events = started_events
+    load_rule_book(rules_file)
+
+def _process_excel_job(idx, excel_file, trace):
+    """
+    Chạy trong process worker: báo thời điểm bắt đầu rồi xử lý file, trả về (kết quả, số giây)
+    """
+    _started_events.put((idx, os.getpid(), time.time()))
+    return process_excel_file_timed(excel_file, trace)
+
+def process_excel_file_timed(excel_file, trace=False):
+    """
+    process_excel_file kèm số giây xử lý: (kết quả, số giây)
+    """
+    started = time.perf_counter()
+    result = process_excel_file(excel_file, trace)
+    return result, time.perf_counter() - started
+
+class ExcelPipeline:
+    """
+    Xử lý file Excel ngay khi tải xong (producer/consumer):
+    luồng tải gọi submit() sau mỗi file, worker nền chạy process_single_excel
+    song song với việc tải các báo cáo tiếp theo
+    """
+    def __init__(self, processor=None, workers=1):
+        self.processor = processor or ExcelProcessor()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="excel")
+        self.futures = {}  # short_name -> Future
+        self.files = {}    # short_name -> đường dẫn file
+        self.lock = threading.Lock()
+
+    def submit(self, short_name, excel_file):
+        """
+        Đưa file vừa tải vào hàng đợi xử lý
+        """
+        excel_file = Path(excel_file)
+        with self.lock:
+            self.files[short_name] = excel_file
+            self.futures[short_name] = self.executor.submit(self.processor.process_with_manifest, excel_file)
+
+    def wait(self):
+        """
+        Chờ xử lý xong tất cả file, trả về dict {short_name: True/False}
+        """
+        self.executor.shutdown(wait=True)
+        results = {}
+        for short_name, future in self.futures.items():
+            try:
+                results[short_name] = bool(future.result())
+            except Exception as e:
+                print(f"❌ Lỗi xử lý {short_name}: {str(e)}")
+                results[short_name] = False
+        return results
+
+    def finish(self):
+        """
+        Chờ xử lý xong, tạo file tổng hợp (nếu bật), file delta và cập nhật chỉ mục lịch sử
+        """
+        results = self.wait()
+        processed_files = [self.files[name] for name, ok in results.items() if ok]
+        self.processor.finish_files(processed_files)
+        return results
+
+def load_settings(config_file=None):
+    """
+    settings trong input/config.json (cùng file cấu hình với check_oder.py), không đọc được thì trả về {}
+    """
+    config_file = config_file or Path(__file__).parent / "input" / "config.json"
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('settings', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"⚠️ Không đọc được {config_file.name} ({e}), dùng cấu hình mặc định")
+        return {}
+
 def main():
     """
     Hàm main để xử lý Excel tích hợp vào check order
+    Số process, timeout, manifest, chỉ mục lịch sử lấy từ settings của config.json như check_oder.py
     """
-    processor = ExcelProcessor()
+    settings = load_settings()
+    processor = ExcelProcessor(
+        workers=settings.get('excel_workers', 1),
+        file_timeout=settings.get('excel_file_timeout', 600),
+        use_manifest=settings.get('excel_manifest', True),
+        use_history=settings.get('history_index', True)
+    )
     
     # Xử lý các file Excel
     success = processor.process_excel_files()
@@ -483,17 +881,19 @@ def main():
     else:
         print("❌ Có lỗi trong quá trình xử lý!")
 
-def process_excel_for_check_order():
+def process_excel_for_check_order(tracer=None, workers=1, file_timeout=None, use_manifest=True, use_history=True):
     """
     Hàm để tích hợp vào hệ thống check order
     Trả về True nếu xử lý thành công, False nếu có lỗi
     """
     try:
-        processor = ExcelProcessor()
+        processor = ExcelProcessor(tracer=tracer, workers=workers, file_timeout=file_timeout,
+                                   use_manifest=use_manifest, use_history=use_history)
         return processor.process_excel_files()
     except Exception as e:
         print(f"❌ Lỗi xử lý Excel: {str(e)}")
         return False
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,183 @@
+"""
+Ghi trace thời gian theo từng bước của một lần chạy (đăng nhập, điều hướng, chọn tháng,
+chờ export, lưu file, từng bước xử lý Excel...)
+File trace dạng Chrome Trace Event JSON - mở bằng chrome://tracing hoặc https://ui.perfetto.dev
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def _now_us():
+    # Dùng đồng hồ hệ thống để ghép được span từ nhiều process
+    return time.time_ns() // 1000
+
+
+def _current_track():
+    """
+    Tên luồng hiển thị trên trace: task asyncio (nếu đang chạy trong event loop) hoặc tên thread
+    """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return task.get_name()
+    return threading.current_thread().name
+
+
+class RunTracer:
+    def __init__(self):
+        self.events = []
+        self.tracks = {}  # tên luồng -> tid
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def _tid(self, track):
+        with self.lock:
+            if track not in self.tracks:
+                self.tracks[track] = len(self.tracks) + 1
+            return self.tracks[track]
+
+    @contextmanager
+    def span(self, name, track=None, **attrs):
+        """
+        Ghi một span từ lúc vào tới lúc ra khỏi khối with
+        attrs: thuộc tính đi kèm (short_name, worker...), có thể bổ sung trong khối qua dict trả về
+        """
+        start = _now_us()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs['error'] = str(e)
+            raise
+        finally:
+            self.add_span(name, start, _now_us(), track, attrs)
+
+    def add_span(self, name, start_us, end_us, track=None, attrs=None):
+        """
+        Thêm một span đã đo sẵn (thời gian tính bằng micro giây)
+        """
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': start_us,
+            'dur': max(0, end_us - start_us),
+            'pid': self.pid,
+            'tid': self._tid(track or _current_track()),
+            'args': {key: str(value) for key, value in (attrs or {}).items()}
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def steps(self, name, track=None, **attrs):
+        """
+        Đo các bước nối tiếp nhau trong một hàm dài mà không phải bọc từng khối with:
+            steps = tracer.steps("process_single_excel", file="DHTC.xlsx")
+            steps.next("B1")  ...  steps.next("B2")  ...  steps.end()
+        """
+        return StepTimer(self, name, track, attrs)
+
+    def add_events(self, events):
+        """
+        Ghép span ghi ở process khác (xem export_events)
+        Luồng của process khác đặt tên kèm pid (các worker trong process pool đều là "MainThread")
+        """
+        for event in events:
+            track = event.get('track')
+            if event.get('pid', self.pid) != self.pid:
+                track = f"pid {event['pid']} {track}"
+            self.add_span(event['name'], event['ts'], event['ts'] + event['dur'],
+                          track, event.get('args'))
+
+    def export_events(self):
+        """
+        Danh sách span dạng gửi được giữa các process (kèm tên luồng thay cho tid)
+        """
+        tracks = {tid: track for track, tid in self.tracks.items()}
+        with self.lock:
+            return [dict(event, track=tracks.get(event['tid'])) for event in self.events]
+
+    def save(self, directory):
+        """
+        Ghi file trace_HHMMSS.json vào thư mục (output/DDMMYYYY/)
+        """
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': track}}
+            for track, tid in self.tracks.items()
+        ]
+        trace_file = directory / f"trace_{datetime.now().strftime('%H%M%S')}.json"
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        return trace_file
+
+
+class StepTimer:
+    def __init__(self, tracer, name, track, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.track = track or _current_track()
+        self.attrs = attrs
+        self.start = _now_us()
+        self.step_name = None
+        self.step_start = None
+
+    def next(self, step_name):
+        """
+        Kết thúc bước hiện tại (nếu có) và bắt đầu bước mới
+        """
+        now = _now_us()
+        self._close_step(now)
+        self.step_name = step_name
+        self.step_start = now
+
+    def end(self, **attrs):
+        """
+        Kết thúc bước cuối và span bao ngoài
+        """
+        now = _now_us()
+        self._close_step(now)
+        self.attrs.update(attrs)
+        self.tracer.add_span(self.name, self.start, now, self.track, self.attrs)
+
+    def _close_step(self, now):
+        if self.step_name is not None:
+            self.tracer.add_span(self.step_name, self.step_start, now, self.track, self.attrs)
+            self.step_name = None
+
+
+class NullTracer:
+    """
+    Tracer không ghi gì - dùng khi tắt trace để code gọi không cần kiểm tra
+    """
+    @contextmanager
+    def span(self, name, track=None, **attrs):
+        yield attrs
+
+    def add_span(self, name, start_us, end_us, track=None, attrs=None):
+        pass
+
+    def steps(self, name, track=None, **attrs):
+        return NullStepTimer()
+
+    def add_events(self, events):
+        pass
+
+    def export_events(self):
+        return []
+
+
+class NullStepTimer:
+    def next(self, step_name):
+        pass
+
+    def end(self, **attrs):
+        pass
+
+
+NULL_TRACER = NullTracer()
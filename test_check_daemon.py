@@ -0,0 +1,54 @@
+"""
+Kiểm tra lịch cron của daemon (check_daemon.CronSchedule): phân tích biểu thức và tính lần chạy kế tiếp.
+Chạy: python -m pytest -q test_check_daemon.py
+"""
+
+from datetime import datetime
+
+import pytest
+
+from check_daemon import CronSchedule
+
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    # Mỗi phút: luôn là đầu phút kế tiếp, bỏ giây
+    ("* * * * *", datetime(2024, 1, 1, 10, 0, 30, 5), datetime(2024, 1, 1, 10, 1)),
+    # Đúng thời điểm chạy thì lấy lần sau, không chạy lại
+    ("30 7 * * *", datetime(2024, 1, 1, 7, 30), datetime(2024, 1, 2, 7, 30)),
+    ("30 7 * * *", datetime(2024, 1, 1, 7, 29, 59), datetime(2024, 1, 1, 7, 30)),
+    # Thứ 2 - thứ 7: sáng thứ 7 chạy, sau đó nhảy qua Chủ nhật sang thứ 2
+    ("30 7 * * 1-6", datetime(2024, 3, 9, 6, 0), datetime(2024, 3, 9, 7, 30)),
+    ("30 7 * * 1-6", datetime(2024, 3, 9, 8, 0), datetime(2024, 3, 11, 7, 30)),
+    # 0 và 7 đều là Chủ nhật
+    ("0 9 * * 7", datetime(2024, 3, 4), datetime(2024, 3, 10, 9, 0)),
+    ("0 9 * * 0", datetime(2024, 3, 4), datetime(2024, 3, 10, 9, 0)),
+    # Bước, danh sách, khoảng có bước
+    ("*/15 * * * *", datetime(2024, 1, 1, 10, 44), datetime(2024, 1, 1, 10, 45)),
+    ("0,30 8-10 * * *", datetime(2024, 1, 1, 10, 30), datetime(2024, 1, 2, 8, 0)),
+    ("0 8-18/5 * * *", datetime(2024, 1, 1, 13, 1), datetime(2024, 1, 1, 18, 0)),
+    ("5/20 * * * *", datetime(2024, 1, 1, 10, 46), datetime(2024, 1, 1, 11, 5)),
+    # Qua tháng / năm, năm nhuận
+    ("0 0 1 * *", datetime(2024, 1, 31, 23, 59), datetime(2024, 2, 1, 0, 0)),
+    ("59 23 31 12 *", datetime(2024, 12, 31, 23, 59), datetime(2025, 12, 31, 23, 59)),
+    ("0 6 29 2 *", datetime(2024, 3, 1), datetime(2028, 2, 29, 6, 0)),
+    # Giới hạn cả ngày lẫn thứ: khớp một trong hai (ngày 15 hoặc thứ 2)
+    ("0 8 15 * 1", datetime(2024, 3, 12), datetime(2024, 3, 15, 8, 0)),
+    ("0 8 15 * 1", datetime(2024, 3, 15, 9, 0), datetime(2024, 3, 18, 8, 0)),
+    # Chỉ giới hạn ngày thì thứ không tính
+    ("0 8 15 * *", datetime(2024, 3, 16), datetime(2024, 4, 15, 8, 0)),
+])
+def test_next_after(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+
+def test_next_after_impossible_date():
+    assert CronSchedule("0 0 31 2 *").next_after(datetime(2024, 1, 1)) is None
+
+
+@pytest.mark.parametrize('expression', [
+    "* * * *", "* * * * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8",
+    "*/0 * * * *", "10-5 * * * *", "a * * * *", "1-x * * * *",
+])
+def test_invalid_expression(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
@@ -0,0 +1,206 @@
+"""
+Kiểm tra thứ tự cấp khôi phục khi tải báo cáo lỗi (OrderChecker.click_search_and_download và
+AsyncOrderChecker.select_kpi_and_download): lên cấp khi cấp hiện tại khôi phục thất bại hoặc lần thử
+ngay sau nó vẫn lỗi, bỏ cuộc khi không cấp nào khôi phục được trang.
+Trang giả thay cho trang Playwright, recover_for_retry thay bằng hàm ghi lại cấp đã dùng.
+Chạy: python -m pytest -q test_check_oder.py
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("playwright")
+
+from check_oder import OrderChecker, RECOVERY_TIERS
+from check_oder_async import AsyncOrderChecker
+from run_trace import NULL_TRACER
+
+
+class FakeSite:
+    """
+    Số lần export còn lỗi (timeout) trước khi tải được, ghi lại trang đã dùng cho từng lần Search
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        self.searches = []
+
+    def export(self, page):
+        self.searches.append(page.name)
+        if self.failures > 0:
+            self.failures -= 1
+            raise TimeoutError("Timeout 180000ms exceeded")
+
+
+class FakeDownload:
+    def save_as(self, path):
+        with open(path, 'wb') as f:
+            f.write(b'xlsx')
+
+
+class AsyncFakeDownload:
+    async def save_as(self, path):
+        FakeDownload().save_as(path)
+
+
+class FakeDownloadInfo:
+    """
+    page.expect_download(): export chạy khi thoát khối with, value là file tải về (awaitable ở engine async)
+    """
+    def __init__(self, page):
+        self.page = page
+
+    @property
+    def value(self):
+        if not self.page.is_async:
+            return FakeDownload()
+
+        async def download():
+            return AsyncFakeDownload()
+        return download()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.page.site.export(self.page)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.__exit__(exc_type, exc, traceback)
+
+
+class FakeButton:
+    def click(self):
+        pass
+
+
+class AsyncFakeButton:
+    async def click(self):
+        pass
+
+
+class FakePage:
+    def __init__(self, site, name="page 1", is_async=False):
+        self.site = site
+        self.name = name
+        self.is_async = is_async
+
+    def locator(self, selector):
+        return AsyncFakeButton() if self.is_async else FakeButton()
+
+    def expect_download(self, timeout=None):
+        return FakeDownloadInfo(self)
+
+
+def make_checker(tmp_path, max_attempts=5, run_budget=20):
+    checker = OrderChecker.__new__(OrderChecker)
+    checker.config = {
+        'selectors': {'search_button': '#search'},
+        'settings': {'retry': {'max_attempts': max_attempts, 'backoff_ms': 0, 'backoff_max_ms': 0,
+                               'run_budget': run_budget}},
+    }
+    checker.tracer = NULL_TRACER
+    checker.daily_output_dir = tmp_path
+    checker.excel_pipeline = None
+    checker.retry_budget_left = None
+    checker._retry_lock = threading.Lock()
+    checker.select_month_year_before_search = lambda page: True
+    checker.retry_backoff = lambda attempt, retry_settings: None
+    return checker
+
+
+def recorder(failed_tiers=()):
+    """
+    recover_for_retry giả: ghi lại cấp đã dùng, cấp trong failed_tiers khôi phục thất bại, cấp 3 trả về trang mới
+    """
+    tiers = []
+
+    def recover(page, tier, *args):
+        tiers.append(tier)
+        if tier in failed_tiers:
+            return None
+        if tier == RECOVERY_TIERS:
+            return FakePage(page.site, f"page {len(tiers) + 1}", page.is_async)
+        return page
+    return tiers, recover
+
+
+@pytest.mark.parametrize('failures, failed_tiers, expected_tiers, searches, downloaded', [
+    # Export lỗi liên tục dù khôi phục "thành công": lên cấp sau mỗi lần thử lại vẫn lỗi, rồi giữ cấp 3
+    (99, (), [1, 2, 3, 3], 5, False),
+    # Tải được sau khi điều hướng lại (cấp 2)
+    (2, (), [1, 2], 3, True),
+    # Cấp 2 khôi phục thất bại -> cấp 3 ngay trong cùng lần thử lại
+    (99, (2,), [1, 2, 3, 3, 3], 5, False),
+    (2, (2,), [1, 2, 3], 3, True),
+    # Không cấp nào khôi phục được trang: bỏ cuộc, không Search trên trang hỏng
+    (99, (1, 2, 3), [1, 2, 3], 1, False),
+])
+def test_recovery_tiers(tmp_path, failures, failed_tiers, expected_tiers, searches, downloaded):
+    site = FakeSite(failures)
+    checker = make_checker(tmp_path)
+    tiers, recover = recorder(failed_tiers)
+    checker.recover_for_retry = recover
+
+    result = checker.click_search_and_download(FakePage(site), "DHTC", kpi_text="KPI")
+    assert result is downloaded
+    assert tiers == expected_tiers
+    assert (tmp_path / "DHTC.xlsx").exists() is downloaded
+    assert len(site.searches) == searches
+
+
+def test_retry_after_fresh_page_uses_new_page(tmp_path):
+    site = FakeSite(3)
+    checker = make_checker(tmp_path)
+    tiers, recover = recorder()
+    checker.recover_for_retry = recover
+
+    assert checker.click_search_and_download(FakePage(site), "DHTC", kpi_text="KPI")
+    assert tiers == [1, 2, 3]
+    assert site.searches == ["page 1", "page 1", "page 1", "page 4"]
+
+
+def test_retry_budget_stops_escalation(tmp_path):
+    site = FakeSite(99)
+    checker = make_checker(tmp_path, run_budget=2)
+    tiers, recover = recorder()
+    checker.recover_for_retry = recover
+
+    assert not checker.click_search_and_download(FakePage(site), "DHTC", kpi_text="KPI")
+    assert tiers == [1, 2]
+    assert len(site.searches) == 3
+
+
+@pytest.mark.parametrize('failures, failed_tiers, expected_tiers, downloaded', [
+    (99, (), [1, 2, 3, 3], False),
+    (2, (), [1, 2], True),
+    (99, (1, 2, 3), [1, 2, 3], False),
+])
+def test_async_recovery_tiers(tmp_path, failures, failed_tiers, expected_tiers, downloaded):
+    site = FakeSite(failures)
+    engine = AsyncOrderChecker.__new__(AsyncOrderChecker)
+    engine.checker = make_checker(tmp_path)
+    engine.config = engine.checker.config
+    tiers, recover = recorder(failed_tiers)
+
+    async def ready(*args):
+        return True
+
+    async def recover_for_retry(page, tier):
+        return recover(page, tier)
+
+    engine.relogin_if_needed = ready
+    engine.select_kpi_option = ready
+    engine.select_month = ready
+    engine.recover_for_retry = recover_for_retry
+
+    download_path, page = asyncio.run(engine.select_kpi_and_download(FakePage(site, is_async=True), "KPI", "DHTC"))
+    assert (download_path is not None) is downloaded
+    assert tiers == expected_tiers
+    if RECOVERY_TIERS in tiers and failed_tiers != (1, 2, 3):
+        assert page.name != "page 1"
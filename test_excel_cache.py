@@ -0,0 +1,140 @@
+"""
+Kiểm tra cache dữ liệu báo cáo (excel_cache.py): ghi bằng ReportCacheWriter rồi đọc lại bằng CachedReport
+phải ra đúng giá trị, dòng ẩn, dòng bị xóa dữ liệu; cache ghi trong lượt xử lý khớp với dữ liệu đọc từ file xlsx.
+Chạy: python -m pytest -q test_excel_cache.py
+"""
+
+import json
+import shutil
+from datetime import datetime, date, time
+
+import pytest
+
+from benchmark import generate_kpi_workbook
+from excel_cache import ReportCache, CachedReport, read_report_rows
+from excel_manifest import file_hash
+from excel_rules import DEFAULT_RULES, load_rule_book
+from process_excel import ExcelProcessor
+
+# (số dòng, giá trị, ẩn, khoảng cột bị xóa) - dòng 3, 4 bỏ trống để kiểm tra phần đệm giữa các dòng
+ROWS = [
+    (1, ["Báo cáo KPI", None, None, None], True, None),
+    (2, ["STT", "Mã NV", "Ngày", "Số lượng"], False, None),
+    (5, [1, "NV001", datetime(2024, 1, 2, 3, 4, 5, 678), 2.5], False, None),
+    (6, [2, "NV001", date(2023, 5, 6), -7], True, (3, 4)),
+    (7, [True, "Ơ ư tiếng việt", time(5, 6, 7, 89), 1 << 70], False, None),
+    (8, [False, "", 0.0, None], False, None),
+    (9, [None, "NV002", None, 1e20], False, (2, 4)),
+    (10, [None, None, None, None], False, None),  # Dòng rỗng ở cuối không được ghi
+]
+
+
+@pytest.fixture
+def rule_set(tmp_path):
+    return load_rule_book(tmp_path / "rules.json").for_report("DHTC")
+
+
+def write_entry(cache, tmp_path, rule_set, rows=ROWS, name="DHTC"):
+    """
+    Ghi một entry cache cho file tải về giả + file đã xử lý giả, trả về (file tải về, file đã xử lý, entry)
+    """
+    input_file = tmp_path / f"{name}.raw.xlsx"
+    output_file = tmp_path / f"{name}.xlsx"
+    input_file.write_bytes(f"raw {name}".encode('utf-8'))
+    output_file.write_bytes(f"processed {name}".encode('utf-8'))
+    writer = cache.writer(input_file, rule_set, name)
+    writer.begin(4)
+    for row_num, values, hidden, cleared in rows:
+        if writer.wants(row_num, hidden):
+            writer.add_row(row_num, values, hidden, cleared)
+    entry = writer.close(output_file, {'B2': {'hits': 3}})
+    return input_file, output_file, entry
+
+
+def test_round_trip(tmp_path, rule_set):
+    cache = ReportCache(tmp_path / "cache", 10)
+    input_file, output_file, entry = write_entry(cache, tmp_path, rule_set)
+    assert entry is not None and entry.exists()
+
+    report = CachedReport(entry)
+    assert (report.row_count, report.col_count) == (9, 4)
+    assert report.short_name == "DHTC"
+    assert report.rules_version == rule_set.version
+    assert report.rule_hits == {'B2': 3}
+
+    expected = {row_num: values for row_num, values, _, _ in ROWS if row_num <= 9}
+    for row_num, values in report.rows():
+        # Số nguyên ngoài phạm vi 64 bit lưu dạng chuỗi
+        wanted = [str(value) if isinstance(value, int) and value >= 1 << 63 else value
+                  for value in expected.get(row_num, [None] * 4)]
+        assert values == wanted, f"dòng {row_num}"
+        assert [type(value) for value in values] == [type(value) for value in wanted], f"dòng {row_num}"
+    assert report.hidden_rows() == {1, 6}
+    assert report.cleared_rows() == {6: 3, 9: 2}
+    assert [row_num for row_num, _ in report.rows(start_row=5, visible_only=True)] == [5, 7, 8, 9]
+    assert list(report.rows(start_row=9, columns=[4, 2])) == [(9, [1e20, "NV002"])]
+    assert report.column(99) == [None] * 9
+
+
+def test_load_by_output_and_input_hash(tmp_path, rule_set):
+    cache = ReportCache(tmp_path / "cache", 10)
+    input_file, output_file, entry = write_entry(cache, tmp_path, rule_set)
+
+    assert cache.load(output_file).path == entry
+    assert cache.load(digest=file_hash(output_file)).path == entry
+    assert cache.load(input_file, rules_version=rule_set.version).path == entry
+    assert cache.load(input_file, rules_version="khác") is None
+    # File tải về đã có trong cache với bộ rule này thì không ghi lại
+    assert cache.writer(input_file, rule_set, "DHTC") is None
+
+
+def test_oversized_entry_is_discarded(tmp_path, rule_set):
+    cache = ReportCache(tmp_path / "cache", 0.001)
+    rows = [(row_num, [row_num, f"NV{row_num:05d}", row_num * 1.5, "x" * 20], False, None)
+            for row_num in range(1, 4097)]
+    _, _, entry = write_entry(cache, tmp_path, rule_set, rows)
+    assert entry is None
+    assert not list((tmp_path / "cache").glob(f"*{ReportCache.SUFFIX}"))
+
+
+def test_evicts_least_recently_used(tmp_path, rule_set):
+    cache = ReportCache(tmp_path / "cache", 10)
+    _, first_output, first = write_entry(cache, tmp_path, rule_set, name="A")
+    _, _, second = write_entry(cache, tmp_path, rule_set, name="B")
+    cache.max_bytes = second.stat().st_size
+    cache.evict()
+    assert not first.exists() and second.exists()
+    assert cache.load(first_output) is None
+    assert not (tmp_path / "cache" / f"{file_hash(first_output)}.ref").exists()
+
+
+def test_cache_matches_processed_xlsx(tmp_path):
+    """
+    Cache ghi trong lượt xử lý (writer XML) đọc ra giống hệt sheet của file đã xử lý
+    """
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps(dict(DEFAULT_RULES, writer='xml')), encoding='utf-8')
+    processor = ExcelProcessor(use_manifest=False, use_history=False)
+    processor.rules_file = rules_file
+    processor.output_dir = tmp_path / "output"
+    excel_file = tmp_path / "DHTC.xlsx"
+    generate_kpi_workbook(excel_file, 300, seed=3)
+    raw_copy = tmp_path / "raw.xlsx"
+    shutil.copy(excel_file, raw_copy)
+    assert processor.process_single_excel(excel_file)
+
+    cache = processor.get_cache()
+    source, cached_rows = read_report_rows(excel_file, cache)
+    assert source == "cache"
+    _, xlsx_rows = read_report_rows(excel_file)
+    cached = {row_num: (values, hidden) for row_num, values, hidden, _ in cached_rows}
+    from_xlsx = {row_num: (values, hidden) for row_num, values, hidden, _ in xlsx_rows
+                 if any(value is not None for value in values)}
+    assert cached.keys() >= from_xlsx.keys()
+    for row_num, (values, hidden) in from_xlsx.items():
+        cached_values, cached_hidden = cached[row_num]
+        assert cached_values[:len(values)] == values, f"dòng {row_num}"
+        assert cached_hidden == hidden, f"dòng {row_num}"
+    # File tải về giống hệt sẽ tìm thấy entry theo hash file + phiên bản bộ rule
+    rule_set = load_rule_book(rules_file).for_report("DHTC")
+    assert cache.load(raw_copy, rules_version=rule_set.version) is not None
@@ -0,0 +1,116 @@
+"""
+Kiểm tra file delta so với lần chạy trước (excel_delta.write_delta): dòng mới / không còn / thay đổi,
+khóa trùng, dòng ẩn, cột ẩn, chỉ so với thư mục ngày trước đó cùng tháng báo cáo.
+Chạy: python -m pytest -q test_excel_delta.py
+"""
+
+import csv
+import os
+
+import openpyxl
+import pytest
+
+from excel_delta import write_delta, SUFFIX
+from excel_rules import load_rule_book
+
+TITLES = {7: "Tên NV", 8: "Mã NV", 9: "Tên KH", 11: "Kênh", 15: "Doanh số", 16: "Chỉ tiêu", 17: "Thiếu", 18: "Ghi chú"}
+
+
+@pytest.fixture
+def rule_set(tmp_path):
+    return load_rule_book(tmp_path / "rules.json").for_report("DHTC")
+
+
+def write_report(output_dir, day, rows):
+    """
+    File đã xử lý output/<day>/DHTC.xlsx, rows: [(mã NV, doanh số, ẩn, cột phụ {cột: giá trị})]
+    """
+    day_dir = output_dir / day
+    day_dir.mkdir(parents=True, exist_ok=True)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.cell(1, 1, "Báo cáo DHTC")
+    for col, title in TITLES.items():
+        ws.cell(5, col, title)
+    for row_num, (staff, sales, hidden, extra) in enumerate(rows, start=6):
+        ws.cell(row_num, 1, row_num - 5)
+        ws.cell(row_num, 7, f"Tên {staff}")
+        ws.cell(row_num, 8, staff)
+        ws.cell(row_num, 15, sales)
+        for col, value in (extra or {}).items():
+            ws.cell(row_num, col, value)
+        ws.row_dimensions[row_num].hidden = hidden
+    path = day_dir / "DHTC.xlsx"
+    wb.save(path)
+    return path
+
+
+def read_delta(path):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        header, *rows = list(csv.reader(f))
+    return header, [dict(zip(header, row)) for row in rows]
+
+
+def test_added_removed_changed(tmp_path, rule_set):
+    output_dir = tmp_path / "output"
+    write_report(output_dir, "01032024", [("NV1", 999, False, None)])  # Cũ hơn, không được chọn để so
+    write_report(output_dir, "04032024", [
+        ("NV1", 100, False, None),
+        ("NV2", 200, False, None),
+        ("NV3", 300, False, {1: 99}),        # Chỉ đổi cột ẩn (STT) -> không tính là thay đổi
+        ("NV4", 400, False, None),
+        ("NV4", 410, False, None),           # Khóa trùng -> "NV4 #2"
+        ("NV5", 500, True, None),            # Dòng ẩn không so
+    ])
+    current = write_report(output_dir, "05032024", [
+        ("NV1", 150, False, {18: "tăng"}),   # Thay đổi doanh số + ghi chú
+        ("NV3", 300, False, None),
+        ("NV4", 400, False, None),
+        ("NV4", 420, False, None),           # "NV4 #2" thay đổi
+        ("NV5", 500, True, None),
+        ("NV6", 600, False, None),           # Mới
+    ])
+
+    result = write_delta(current, rule_set)
+    assert result['previous'] == "04032024"
+    assert (result['added'], result['removed'], result['changed']) == (1, 1, 2)
+    assert result['path'] == current.with_name("DHTC" + SUFFIX)
+
+    header, rows = read_delta(result['path'])
+    assert header == ['change', 'key', 'prev_row', 'row', 'changed_columns',
+                      "Tên NV", "Tên KH", "Kênh", "Doanh số", "Chỉ tiêu", "Thiếu", "Ghi chú"]
+    changes = {(row['change'], row['key']): row for row in rows}
+    assert sorted(changes) == [('added', 'NV6'), ('changed', 'NV1'), ('changed', 'NV4 #2'), ('removed', 'NV2')]
+    assert changes['changed', 'NV1']['changed_columns'] == "Doanh số, Ghi chú"
+    assert (changes['changed', 'NV1']['prev_row'], changes['changed', 'NV1']['row']) == ("6", "6")
+    assert changes['changed', 'NV1']['Doanh số'] == "150"
+    assert changes['changed', 'NV4 #2']['changed_columns'] == "Doanh số"
+    assert (changes['added', 'NV6']['prev_row'], changes['added', 'NV6']['row']) == ("", "11")
+    assert (changes['removed', 'NV2']['prev_row'], changes['removed', 'NV2']['row']) == ("7", "")
+    assert changes['removed', 'NV2']['Doanh số'] == "200"
+
+
+def test_unchanged_report_has_empty_delta(tmp_path, rule_set):
+    output_dir = tmp_path / "output"
+    rows = [("NV1", 100, False, None), ("NV2", 200, True, None)]
+    write_report(output_dir, "04032024", rows)
+    current = write_report(output_dir, "05032024", rows)
+
+    result = write_delta(current, rule_set)
+    assert (result['added'], result['removed'], result['changed']) == (0, 0, 0)
+    assert read_delta(result['path'])[1] == []
+    # Delta đã mới hơn cả hai file thì không ghi lại
+    assert write_delta(current, rule_set) is None
+    delta_mtime = result['path'].stat().st_mtime_ns
+    os.utime(current, ns=(delta_mtime + 10 ** 9, delta_mtime + 10 ** 9))
+    assert write_delta(current, rule_set) is not None
+
+
+def test_no_previous_report_in_same_month(tmp_path, rule_set):
+    output_dir = tmp_path / "output"
+    # 01/03 là số liệu tháng 2, 02/03 là tháng 3 (ngày chạy lùi 1 ngày)
+    write_report(output_dir, "01032024", [("NV1", 100, False, None)])
+    current = write_report(output_dir, "02032024", [("NV1", 200, False, None)])
+    assert write_delta(current, rule_set) is None
+    assert not current.with_name("DHTC" + SUFFIX).exists()
+    assert write_delta(write_report(output_dir, "not-a-day", []), rule_set) is None
@@ -0,0 +1,233 @@
+"""
+Kiểm tra các engine xử lý Excel cho kết quả giống hệt process_single_excel bản gốc (openpyxl, duyệt từng dòng)
+trên file mẫu sinh ngẫu nhiên: giá trị ô, dòng ẩn, cột ẩn, độ rộng + bỏ xuống dòng cột I/K, cố định tiêu đề.
+Chạy: python -m pytest -q test_excel_engines.py
+"""
+
+import json
+import random
+import shutil
+import datetime
+
+import openpyxl
+import pytest
+from openpyxl.styles import Alignment
+from openpyxl.utils import get_column_letter
+
+from excel_rules import DEFAULT_RULES, autofit_width, np
+from process_excel import ExcelProcessor
+
+# 1061: vùng merge B10:C12 vượt dòng cuối có ô (openpyxl tính max_row = 12)
+SEEDS = [*range(40), 1061]
+
+# writer + engine của rules.json cần so với bản gốc
+ENGINES = {
+    'openpyxl-rows': {'writer': 'openpyxl', 'engine': 'rows'},
+    'openpyxl-numpy': {'writer': 'openpyxl', 'engine': 'numpy'},
+    'xml-rows': {'writer': 'xml', 'engine': 'rows'},
+    'xml-numpy': {'writer': 'xml', 'engine': 'numpy'},
+    'stream': {'writer': 'stream', 'engine': 'rows'},
+}
+
+# Giá trị ô hay gặp trong báo cáo + các trường hợp biên (chuỗi trắng, số dạng chuỗi, ký tự XML, ngày giờ)
+VALUES = [
+    None, "", " ", True, False, "nan", " 3 ", "1e2", "x", "abc", "TMDT abc", "NPP Bán 1", "NPP tự bán", "TT Bán",
+    "NVNPP015", " NVNPP015 ", 0, 1, -1, "0", "2", 0.0, 2.5, 1e20, 12345678901, "a&b<c>", "line\r\nbreak",
+    "x005F_y", "Ơ ư tiếng việt", datetime.datetime(2024, 1, 2, 3, 4), datetime.date(2023, 5, 6),
+    datetime.time(5, 6)
+]
+
+
+def _is_empty(value):
+    return value is None or str(value).strip() == ""
+
+
+def baseline_process(excel_file):
+    """
+    process_single_excel bản gốc (B1 -> B10), khác bản gốc ở 2 chỗ đã sửa có chủ đích:
+    - Lấy chữ cột bằng get_column_letter: ô gộp ở dòng 1 không có column_letter nên bản gốc bỏ qua
+      toàn bộ bước ẩn cột và tối ưu cột I/K
+    - Độ rộng cột I/K đo theo độ rộng hiển thị (excel_rules.autofit_width) thay cho len(str(value))
+    """
+    wb = openpyxl.load_workbook(excel_file)
+    ws = wb.active
+    row_count = ws.max_row
+    col_count = ws.max_column
+    data_rows = range(6, row_count + 1)
+
+    def hidden(row_num):
+        return ws.row_dimensions[row_num].hidden
+
+    def hide(row_num):
+        ws.row_dimensions[row_num].hidden = True
+
+    for row_num in range(1, 4):
+        hide(row_num)
+    for row_num in data_rows:
+        value = ws.cell(row_num, 11).value
+        if value is not None and "TMDT" in str(value):
+            hide(row_num)
+    for row_num in data_rows:
+        value = ws.cell(row_num, 10).value
+        if value is not None and str(value).strip() == "NVNPP015":
+            hide(row_num)
+    for row_num in data_rows:
+        if _is_empty(ws.cell(row_num, 1).value):
+            hide(row_num)
+    for row_num in data_rows:
+        if not hidden(row_num) and _is_empty(ws.cell(row_num, 2).value) and _is_empty(ws.cell(row_num, 3).value) \
+                and not _is_empty(ws.cell(row_num, 6).value):
+            hide(row_num)
+    for row_num in data_rows:
+        if not hidden(row_num) and _is_empty(ws.cell(row_num, 4).value) and not _is_empty(ws.cell(row_num, 3).value):
+            hide(row_num)
+    for row_num in data_rows:
+        if _is_empty(ws.cell(row_num, 3).value) and col_count >= 11:
+            for col_num in range(11, col_count + 1):
+                try:
+                    ws.cell(row_num, col_num).value = None
+                except AttributeError:
+                    pass  # MergedCell
+    keywords = ["NPP Bán", "NPP tự bán", "TMDT Lazada", "TMDT Sendo", "TMDT Tiki", "TT Bán"]
+    for row_num in data_rows:
+        value = ws.cell(row_num, 11).value
+        if not hidden(row_num) and value is not None and any(keyword in str(value) for keyword in keywords):
+            hide(row_num)
+    for row_num in data_rows:
+        value = ws.cell(row_num, 17).value
+        if not hidden(row_num) and value is not None:
+            try:
+                if float(value) > 0:
+                    hide(row_num)
+            except (ValueError, TypeError):
+                pass
+    prev_empty = False
+    for row_num in data_rows:
+        if not hidden(row_num):
+            current_empty = _is_empty(ws.cell(row_num, 17).value)
+            if prev_empty and current_empty:
+                hide(row_num)
+            prev_empty = current_empty
+
+    for col_num in [*range(1, 7), 8, 10, 12, 13, 14, *range(19, col_count + 1)]:
+        if col_num <= col_count:
+            ws.column_dimensions[get_column_letter(col_num)].hidden = True
+    ws.freeze_panes = "A6"
+
+    for col_num in (9, 11):
+        values = []
+        for (cell,) in ws.iter_rows(min_col=col_num, max_col=col_num):
+            alignment = cell.alignment
+            cell.alignment = Alignment(horizontal=alignment.horizontal, vertical=alignment.vertical,
+                                       text_rotation=alignment.text_rotation, wrap_text=False,
+                                       shrink_to_fit=alignment.shrink_to_fit, indent=alignment.indent)
+            values.append(cell.value)
+        ws.column_dimensions[get_column_letter(col_num)].width = autofit_width(values)
+
+    wb.save(excel_file)
+    wb.close()
+
+
+def make_workbook(path, seed):
+    """
+    File báo cáo ngẫu nhiên: số cột/dòng, ô trống, dòng đã ẩn sẵn, ô gộp (cả ở dòng 1 và sau ô cuối), sheet phụ,
+    định dạng
+    """
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    if rnd.random() < 0.3:
+        other = wb.create_sheet("Other")
+        other['A1'] = 'x'
+        if rnd.random() < 0.5:
+            wb.active = 1
+            ws = other
+    col_count = rnd.choice([12, 17, 18, 20])
+    row_count = rnd.randint(5, 60)
+    for row_num in range(1, row_count + 1):
+        if rnd.random() < 0.1:
+            continue
+        for col_num in range(1, col_count + 1):
+            if rnd.random() < 0.6:
+                cell = ws.cell(row_num, col_num, rnd.choice(VALUES))
+                if rnd.random() < 0.2:
+                    cell.alignment = Alignment(wrap_text=True, horizontal=rnd.choice([None, 'center']))
+                if rnd.random() < 0.1:
+                    cell.number_format = '0.00%'
+        if rnd.random() < 0.1:
+            ws.row_dimensions[row_num].hidden = True
+    if rnd.random() < 0.2:
+        ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=col_count)
+    if rnd.random() < 0.3 and row_count > 8:
+        ws.merge_cells(start_row=7, start_column=11, end_row=8, end_column=12)
+    if rnd.random() < 0.3 and row_count > 12:
+        ws.merge_cells(start_row=10, start_column=2, end_row=12, end_column=3)
+    if rnd.random() < 0.3:
+        ws.column_dimensions['B'].width = 20
+        ws.column_dimensions['I'].width = 50
+    if rnd.random() < 0.3:
+        ws.freeze_panes = 'B2'
+    if rnd.random() < 0.2:
+        # Vùng merge nằm ngoài dòng/cột cuối có ô: openpyxl vẫn tính vào max_row/max_column
+        ws.merge_cells(start_row=row_count + 1, start_column=col_count, end_row=row_count + 3, end_column=col_count + 2)
+    wb.save(path)
+
+
+def snapshot(path):
+    """
+    Những gì người xem file thấy được: giá trị, dòng/cột ẩn, độ rộng I/K, bỏ xuống dòng I/K, cố định tiêu đề
+    """
+    wb = openpyxl.load_workbook(path)
+    ws = wb.active
+    columns = {}
+    for dimension in ws.column_dimensions.values():
+        for col_num in range(dimension.min or 1, (dimension.max or dimension.min or 1) + 1):
+            if col_num <= ws.max_column:
+                width = dimension.width if col_num in (9, 11) or dimension.customWidth else None
+                columns[col_num] = (bool(dimension.hidden), width)
+    return {
+        'title': ws.title,
+        'values': [[cell.value for cell in row] for row in ws.iter_rows()],
+        'hidden_rows': sorted(row_num for row_num, dimension in ws.row_dimensions.items() if dimension.hidden),
+        'columns': {col_num: state for col_num, state in columns.items() if state != (False, None)},
+        'wrap': [(cell.row, cell.column) for col_num in (9, 11)
+                 for (cell,) in ws.iter_rows(min_col=col_num, max_col=col_num) if cell.alignment.wrap_text],
+        'freeze_panes': ws.freeze_panes,
+        'dimensions': (ws.max_row, ws.max_column),
+    }
+
+
+@pytest.fixture(scope='module')
+def baselines(tmp_path_factory):
+    """
+    seed -> (file gốc, snapshot sau khi xử lý bằng bản gốc)
+    """
+    work_dir = tmp_path_factory.mktemp("baseline")
+    results = {}
+    for seed in SEEDS:
+        source = work_dir / f"report_{seed}.xlsx"
+        make_workbook(source, seed)
+        expected = work_dir / f"expected_{seed}.xlsx"
+        shutil.copy(source, expected)
+        baseline_process(expected)
+        results[seed] = (source, snapshot(expected))
+    return results
+
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+def test_engine_matches_baseline(engine, baselines, tmp_path):
+    if ENGINES[engine]['engine'] == 'numpy' and np is None:
+        pytest.skip("chưa cài numpy")
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps(dict(DEFAULT_RULES, cache_mb=0, **ENGINES[engine])), encoding='utf-8')
+    processor = ExcelProcessor(use_manifest=False, use_history=False)
+    processor.rules_file = rules_file
+    processor.output_dir = tmp_path / "output"
+
+    for seed, (source, expected) in baselines.items():
+        excel_file = tmp_path / f"{seed}.xlsx"
+        shutil.copy(source, excel_file)
+        assert processor.process_single_excel(excel_file), f"seed {seed}"
+        actual = snapshot(excel_file)
+        for key in expected:
+            assert actual[key] == expected[key], f"seed {seed}: {key} khác bản gốc"
@@ -0,0 +1,548 @@
+"""
+Ghép sheet đã xử lý của nhiều file xlsx thành một file (Kết quả.xlsx) ở mức zip/XML,
+không mở workbook bằng openpyxl và không copy từng ô:
+- Mỗi file nguồn góp sheet active của nó, đổi tên sheet theo tên file, đánh số lại sheet1..N
+- Gộp styles.xml (numFmts, fonts, fills, borders, cellStyleXfs, cellXfs, cellStyles, dxfs) và
+  sharedStrings.xml, bỏ phần tử trùng; chỉ số style/shared string trong sheet được đổi theo bảng mới
+- Viết lại workbook.xml, các file quan hệ (.rels) và [Content_Types].xml
+Sheet không cần đổi chỉ số nào được chép nguyên byte đã nén. Cấu trúc không hỗ trợ (drawing, comment,
+table, external link...) thì raise PatchUnsupported để dùng cách tạo file tổng hợp bằng openpyxl.
+"""
+
+import os
+import re
+import time
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from xml.sax.saxutils import quoteattr
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+from xlsx_patch import XlsxPackage, ZipStreamWriter, PatchUnsupported, CHUNK_SIZE
+
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+CONTENT_TYPES = {
+    'workbook': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml",
+    'worksheet': "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml",
+    'styles': "application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml",
+    'sharedStrings': "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml",
+    'theme': "application/vnd.openxmlformats-officedocument.theme+xml",
+    'printerSettings': "application/vnd.openxmlformats-officedocument.spreadsheetml.printerSettings",
+}
+
+# Quan hệ ở mức workbook mà sheet có thể tham chiếu tới nhưng không chép sang file tổng hợp
+UNSUPPORTED_WORKBOOK_RELS = ('/externalLink', '/sheetMetadata')
+MAX_SHEET_NAME = 31
+
+_SHEET_DATA_START_RE = re.compile(rb'<(?:[\w.-]+:)?sheetData\b')
+_XF_ATTR_RE = re.compile(rb'(<(?:[\w.-]+:)?(?:c|row)\s[^>]*?\bs=["\'])(\d+)')
+_SST_VALUE_RE = re.compile(
+    rb'(<(?:[\w.-]+:)?c\s[^>]*?\bt=["\']s["\'][^>]*>\s*<(?:[\w.-]+:)?v>)(\d+)')
+_DXF_ATTR_RE = re.compile(rb'(\bdxfId=["\'])(\d+)')
+_UNSTYLED_CELL_RE = re.compile(rb'(<(?:[\w.-]+:)?c)(?=\s)(?![^>]*?\bs=)')
+_STYLE_ID_ATTR_RE = re.compile(r'\s(numFmtId|fontId|fillId|borderId|xfId)=["\'](\d+)["\']')
+_XMLNS_RE = re.compile(r'\sxmlns(?::([\w.-]+))?=["\']([^"\']*)["\']')
+_PREFIX_RE = re.compile(r'</?([\w.-]+):[\w.-]+|\s([\w.-]+):[\w.-]+\s*=')
+_INVALID_SHEET_CHARS_RE = re.compile(r'[\[\]:*?/\\]')
+
+_STYLE_TABLES = ('fonts', 'fills', 'borders', 'cellStyleXfs', 'cellXfs', 'dxfs')
+_STYLE_CHILD = {'fonts': 'font', 'fills': 'fill', 'borders': 'border',
+                'cellStyleXfs': 'xf', 'cellXfs': 'xf', 'dxfs': 'dxf'}
+
+
+def _section(text, name):
+    return re.search(rf'<{name}\b[^>]*?(?:/>|>(.*?)</{name}\s*>)', text, re.S)
+
+
+def _children(content, child):
+    return re.findall(rf'<{child}\b[^>]*?(?:/>|>.*?</{child}\s*>)', content or '', re.S)
+
+
+class _Namespaces:
+    """
+    Khai báo namespace gộp từ thẻ gốc của các file nguồn (cùng prefix phải cùng URI)
+    """
+    def __init__(self):
+        self.declared = {}
+
+    def add(self, root_tag):
+        for prefix, uri in _XMLNS_RE.findall(root_tag):
+            if self.declared.setdefault(prefix, uri) != uri:
+                raise PatchUnsupported(f"Namespace '{prefix}' khác nhau giữa các file")
+
+    def check(self, element):
+        for tag_prefix, attr_prefix in _PREFIX_RE.findall(element):
+            prefix = tag_prefix or attr_prefix
+            if prefix not in self.declared and prefix not in ('xml', 'xmlns'):
+                raise PatchUnsupported(f"Không rõ namespace '{prefix}'")
+
+    def attributes(self):
+        return ''.join(
+            f' xmlns="{uri}"' if not prefix else f' xmlns:{prefix}="{uri}"'
+            for prefix, uri in self.declared.items()
+        )
+
+
+class _StyleMerger:
+    """
+    Gộp styles.xml của các file nguồn, bỏ phần tử trùng.
+    add() trả về bảng đổi chỉ số cellXfs và dxfs của file nguồn đó sang file tổng hợp
+    """
+    def __init__(self):
+        self.namespaces = _Namespaces()
+        self.num_fmts = {}  # formatCode -> (id mới, phần tử numFmt)
+        self.items = {name: [] for name in _STYLE_TABLES}
+        self.index = {name: {} for name in _STYLE_TABLES}
+        self.cell_styles = []
+        self.cell_style_names = set()
+        self.extra = ''     # tableStyles, colors của file đầu tiên
+
+    def _intern(self, table, element):
+        index = self.index[table]
+        if element not in index:
+            self.namespaces.check(element)
+            index[element] = len(self.items[table])
+            self.items[table].append(element)
+        return index[element]
+
+    @staticmethod
+    def _remap(element, maps):
+        end = element.index('>')
+        if element[end - 1] == '/':
+            end -= 1
+        found = set()
+
+        def replace(match):
+            found.add(match.group(1))
+            mapping = maps.get(match.group(1))
+            if mapping is None:
+                return match.group(0)
+            return f' {match.group(1)}="{mapping(int(match.group(2)))}"'
+
+        tag = _STYLE_ID_ATTR_RE.sub(replace, element[:end])
+        # Thuộc tính không ghi = 0, nhưng chỉ số 0 của file nguồn có thể khác chỉ số 0 của file tổng hợp
+        for name, mapping in maps.items():
+            if name not in found and mapping(0) != 0:
+                tag += f' {name}="{mapping(0)}"'
+        return tag + element[end:]
+
+    @staticmethod
+    def _lookup(table_map, name):
+        def lookup(value):
+            if value >= len(table_map):
+                raise PatchUnsupported(f"styles.xml tham chiếu {name} không tồn tại")
+            return table_map[value]
+        return lookup
+
+    def add(self, text):
+        root = re.search(r'<styleSheet\b[^>]*>', text)
+        if root is None:
+            raise PatchUnsupported("styles.xml không đọc được")
+        self.namespaces.add(root.group(0))
+        first = not any(self.items.values())
+
+        fmt_map = {}
+        num_fmts = _section(text, 'numFmts')
+        for element in _children(num_fmts.group(1) if num_fmts else '', 'numFmt'):
+            fmt_id = int(re.search(r'\snumFmtId=["\'](\d+)["\']', element).group(1))
+            code = re.search(r'\sformatCode=("[^"]*"|\'[^\']*\')', element).group(1)
+            if code not in self.num_fmts:
+                new_id = 164 + len(self.num_fmts)
+                self.num_fmts[code] = (new_id, self._remap(element, {'numFmtId': lambda _: new_id}))
+            fmt_map[fmt_id] = self.num_fmts[code][0]
+
+        maps = {}
+        for table in ('fonts', 'fills', 'borders', 'dxfs'):
+            section = _section(text, table)
+            maps[table] = [self._intern(table, element)
+                           for element in _children(section.group(1) if section else '', _STYLE_CHILD[table])]
+
+        attr_maps = {
+            'numFmtId': lambda value: fmt_map.get(value, value),
+            'fontId': self._lookup(maps['fonts'], 'font'),
+            'fillId': self._lookup(maps['fills'], 'fill'),
+            'borderId': self._lookup(maps['borders'], 'border'),
+        }
+        section = _section(text, 'cellStyleXfs')
+        maps['cellStyleXfs'] = [self._intern('cellStyleXfs', self._remap(element, attr_maps))
+                                for element in _children(section.group(1) if section else '', 'xf')]
+        attr_maps['xfId'] = self._lookup(maps['cellStyleXfs'], 'cellStyleXf')
+        section = _section(text, 'cellXfs')
+        if section is None:
+            raise PatchUnsupported("styles.xml không có cellXfs")
+        maps['cellXfs'] = [self._intern('cellXfs', self._remap(element, attr_maps))
+                           for element in _children(section.group(1), 'xf')]
+
+        section = _section(text, 'cellStyles')
+        for element in _children(section.group(1) if section else '', 'cellStyle'):
+            name = re.search(r'\sname=("[^"]*"|\'[^\']*\')', element)
+            name = name.group(1)[1:-1] if name else ''
+            if name not in self.cell_style_names:
+                self.cell_style_names.add(name)
+                self.cell_styles.append(self._remap(element, {'xfId': attr_maps['xfId']}))
+
+        if first:
+            for name in ('tableStyles', 'colors'):
+                section = _section(text, name)
+                if section:
+                    self.namespaces.check(section.group(0))
+                    self.extra += section.group(0)
+        return maps['cellXfs'], maps['dxfs']
+
+    def to_xml(self):
+        parts = [XML_DECLARATION, f'<styleSheet{self.namespaces.attributes()}>']
+        if self.num_fmts:
+            parts.append(f'<numFmts count="{len(self.num_fmts)}">')
+            parts.extend(element for _, element in self.num_fmts.values())
+            parts.append('</numFmts>')
+        for table in ('fonts', 'fills', 'borders', 'cellStyleXfs', 'cellXfs'):
+            parts.append(f'<{table} count="{len(self.items[table])}">{"".join(self.items[table])}</{table}>')
+        if self.cell_styles:
+            parts.append(f'<cellStyles count="{len(self.cell_styles)}">{"".join(self.cell_styles)}</cellStyles>')
+        parts.append(f'<dxfs count="{len(self.items["dxfs"])}">{"".join(self.items["dxfs"])}</dxfs>')
+        parts.append(self.extra)
+        parts.append('</styleSheet>')
+        return ''.join(parts).encode('utf-8')
+
+
+class _StringMerger:
+    """
+    Gộp sharedStrings.xml của các file nguồn, chuỗi trùng (cùng nội dung XML) chỉ giữ một
+    """
+    def __init__(self):
+        self.namespaces = _Namespaces()
+        self.items = []
+        self.index = {}
+        self.count = 0
+
+    def add(self, text):
+        root = re.search(r'<sst\b[^>]*>', text)
+        if root is None:
+            if re.search(r'<sst\b[^>]*/>', text):
+                return []
+            raise PatchUnsupported("sharedStrings.xml không đọc được")
+        self.namespaces.add(root.group(0))
+        count = re.search(r'\scount=["\'](\d+)["\']', root.group(0))
+        self.count += int(count.group(1)) if count else 0
+        string_map = []
+        for element in _children(text[root.end():], 'si'):
+            if element not in self.index:
+                self.namespaces.check(element)
+                self.index[element] = len(self.items)
+                self.items.append(element)
+            string_map.append(self.index[element])
+        return string_map
+
+    def to_xml(self):
+        count = max(self.count, len(self.items))
+        return (f'{XML_DECLARATION}<sst{self.namespaces.attributes()} count="{count}" '
+                f'uniqueCount="{len(self.items)}">{"".join(self.items)}</sst>').encode('utf-8')
+
+
+def _is_identity(mapping):
+    return all(new == old for old, new in enumerate(mapping))
+
+
+def _byte_replacer(mapping, name):
+    table = [str(value).encode('ascii') for value in mapping]
+
+    def replace(match):
+        value = int(match.group(2))
+        if value >= len(table):
+            raise PatchUnsupported(f"Sheet tham chiếu {name} không tồn tại")
+        return match.group(1) + table[value]
+    return replace
+
+
+def sheet_title(name, used):
+    """
+    Tên sheet hợp lệ (bỏ ký tự cấm, tối đa 31 ký tự) và không trùng các tên trong used
+    """
+    title = _INVALID_SHEET_CHARS_RE.sub('_', name).strip("'") or "Sheet"
+    title = title[:MAX_SHEET_NAME]
+    candidate = title
+    counter = 1
+    while candidate.lower() in used:
+        counter += 1
+        suffix = f" ({counter})"
+        candidate = title[:MAX_SHEET_NAME - len(suffix)] + suffix
+    used.add(candidate.lower())
+    return candidate
+
+
+class _Source:
+    """
+    Một file nguồn: sheet active, các quan hệ của sheet, bảng đổi chỉ số style/shared string
+    """
+    def __init__(self, excel_file, title, zin):
+        self.excel_file = Path(excel_file)
+        self.title = title
+        self.zin = zin
+        self.package = XlsxPackage(zin)
+        if any(rel_type.endswith(UNSUPPORTED_WORKBOOK_RELS) for rel_type in self.package.rel_types):
+            raise PatchUnsupported(f"{self.excel_file.name} có external link/metadata")
+        if self.package.styles_path is None:
+            raise PatchUnsupported(f"{self.excel_file.name} không có styles.xml")
+
+        sheet_path = self.package.sheet_path
+        self.rels_path = posixpath.join(posixpath.dirname(sheet_path), '_rels',
+                                        posixpath.basename(sheet_path) + '.rels')
+        self.rels = []  # (Id, Type, Target ngoài file / None, phần printerSettings trong file / None)
+        if self.rels_path in zin.namelist():
+            for rel in ET.fromstring(zin.read(self.rels_path)):
+                rel_id, rel_type, target = rel.get('Id'), rel.get('Type', ''), rel.get('Target', '')
+                if rel.get('TargetMode') == 'External':
+                    self.rels.append((rel_id, rel_type, target, None))
+                elif rel_type.endswith('/printerSettings'):
+                    part = posixpath.normpath(posixpath.join(posixpath.dirname(sheet_path), target))
+                    self.rels.append((rel_id, rel_type, None, part))
+                else:
+                    raise PatchUnsupported(f"{self.excel_file.name}: sheet có {rel_type.rsplit('/', 1)[-1]}")
+
+        # Tên sheet cũ (để đổi tham chiếu trong defined name) và defined name của riêng sheet này
+        sheets = [element for element in self.package.workbook.iter() if element.tag == f'{{{MAIN_NS}}}sheet']
+        self.old_title = sheets[self.package.active].get('name', '')
+        self.defined_names = [
+            element for element in self.package.workbook.iter()
+            if element.tag == f'{{{MAIN_NS}}}definedName' and element.get('localSheetId') == str(self.package.active)
+        ]
+
+    def defined_names_xml(self, sheet_idx):
+        old_refs = [f"'{self.old_title.replace(chr(39), chr(39) * 2)}'!", f"{self.old_title}!"]
+        new_ref = f"'{self.title.replace(chr(39), chr(39) * 2)}'!"
+        parts = []
+        for element in self.defined_names:
+            formula = element.text or ''
+            for old_ref in old_refs:
+                formula = formula.replace(old_ref, new_ref)
+            attrs = ''.join(f' {key}={quoteattr(value)}' for key, value in element.attrib.items()
+                            if key != 'localSheetId')
+            parts.append(f'<definedName{attrs} localSheetId="{sheet_idx}">{_escape_text(formula)}</definedName>')
+        return ''.join(parts)
+
+
+def _escape_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _patch_sheet_header(header, selected, xf_map):
+    """
+    Phần đầu sheet (trước sheetData): chỉ sheet đầu tiên được chọn (tabSelected), đổi style của <col>
+    """
+    header = re.sub(r'\stabSelected=["\'](?:1|true|0|false)["\']', '', header)
+    if selected:
+        header = re.sub(r'<((?:[\w.-]+:)?sheetView)\b', r'<\1 tabSelected="1"', header, count=1)
+
+    def replace(match):
+        value = int(match.group(2))
+        if value >= len(xf_map):
+            raise PatchUnsupported("Cột tham chiếu style không tồn tại")
+        return f'{match.group(1)}{xf_map[value]}'
+    return re.sub(r'(<(?:[\w.-]+:)?col\b[^>]*?\sstyle=["\'])(\d+)', replace, header)
+
+
+def _read_header(source):
+    """
+    Đọc sheet XML tới trước <sheetData> -> (phần đầu, phần đã đọc sau đó)
+    """
+    buffer = b''
+    while True:
+        match = _SHEET_DATA_START_RE.search(buffer)
+        if match:
+            return buffer[:match.start()], buffer[match.start():]
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            raise PatchUnsupported("Không tìm thấy sheetData")
+        buffer += chunk
+
+
+def _write_sheet(writer, raw_source, source, sheet_name, selected, xf_map, dxf_map, string_map):
+    """
+    Ghi sheet của một file nguồn vào file tổng hợp (đổi chỉ số style/shared string nếu cần)
+    """
+    zin = source.zin
+    info = zin.getinfo(source.package.sheet_path)
+    with zin.open(info) as stream:
+        header, _ = _read_header(stream)
+    if re.match(rb'^\s*<\?xml[^>]*encoding=["\'](?!utf-?8)', header, re.I):
+        raise PatchUnsupported("Sheet XML không phải UTF-8")
+    new_header = _patch_sheet_header(header.decode('utf-8'), selected, xf_map).encode('utf-8')
+    replacers = []
+    if not _is_identity(xf_map):
+        replacers.append((_XF_ATTR_RE, _byte_replacer(xf_map, 'style')))
+        if xf_map and xf_map[0] != 0:
+            # Ô không ghi style dùng xf 0 của file nguồn
+            default_style = b' s="%d"' % xf_map[0]
+            replacers.append((_UNSTYLED_CELL_RE, lambda match: match.group(1) + default_style))
+    if not _is_identity(string_map):
+        replacers.append((_SST_VALUE_RE, _byte_replacer(string_map, 'shared string')))
+    if not _is_identity(dxf_map):
+        replacers.append((_DXF_ATTR_RE, _byte_replacer(dxf_map, 'dxf')))
+
+    if not replacers and new_header == header:
+        writer.copy_raw(raw_source, info, sheet_name)
+        return
+
+    def produce(write):
+        with zin.open(info) as stream:
+            _, buffer = _read_header(stream)  # Phần đầu cũ thay bằng new_header
+            write(new_header)
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                buffer += chunk
+                # Chỉ xử lý tới trước thẻ đóng cuối cùng: các thẻ <c>/<row> phía trước đã đầy đủ
+                cut = buffer.rfind(b'</') if chunk else len(buffer)
+                if cut > 0:
+                    data = buffer[:cut]
+                    for pattern, replace in replacers:
+                        data = pattern.sub(replace, data)
+                    write(data)
+                    buffer = buffer[cut:]
+                if not chunk:
+                    break
+
+    writer.write_stream(zipfile.ZipInfo(sheet_name, info.date_time), produce, level=1)
+
+
+def merge_workbooks(sources, target_file):
+    """
+    Ghép sheet active của các file nguồn thành target_file.
+    sources: [(đường dẫn file, tên sheet)]; trả về số sheet đã ghép
+    """
+    target_file = Path(target_file)
+    zips = []
+    try:
+        used_titles = set()
+        items = []
+        styles = _StyleMerger()
+        strings = _StringMerger()
+        epoch = None
+        for excel_file, title in sources:
+            zin = zipfile.ZipFile(excel_file)
+            zips.append(zin)
+            source = _Source(excel_file, sheet_title(title, used_titles), zin)
+            if epoch is not None and source.package.epoch != epoch:
+                raise PatchUnsupported("Các file dùng hệ ngày khác nhau (1900/1904)")
+            epoch = source.package.epoch
+            xf_map, dxf_map = styles.add(zin.read(source.package.styles_path).decode('utf-8'))
+            string_map = []
+            if source.package.strings_path:
+                string_map = strings.add(zin.read(source.package.strings_path).decode('utf-8'))
+            items.append((source, xf_map, dxf_map, string_map))
+        if not items:
+            raise PatchUnsupported("Không có file nguồn")
+
+        theme_source = next((source for source, *_ in items if source.package.theme_path), None)
+        now = time.localtime()[:6]
+
+        # [Content_Types].xml, quan hệ và workbook.xml của file tổng hợp
+        overrides = [('/xl/workbook.xml', CONTENT_TYPES['workbook']), ('/xl/styles.xml', CONTENT_TYPES['styles'])]
+        workbook_rels = []
+        sheets_xml = []
+        defined_names = []
+        printer_count = 0
+        sheet_rels = {}
+        printer_parts = []
+        for idx, (source, *_) in enumerate(items, 1):
+            overrides.append((f'/xl/worksheets/sheet{idx}.xml', CONTENT_TYPES['worksheet']))
+            workbook_rels.append((f'rId{idx}', 'worksheet', f'worksheets/sheet{idx}.xml'))
+            sheets_xml.append(f'<sheet name={quoteattr(source.title)} sheetId="{idx}" r:id="rId{idx}"/>')
+            defined_names.append(source.defined_names_xml(idx - 1))
+            rels = []
+            for rel_id, rel_type, target, part in source.rels:
+                if part is None:
+                    rels.append(f'<Relationship Id={quoteattr(rel_id)} Type={quoteattr(rel_type)} '
+                                f'Target={quoteattr(target)} TargetMode="External"/>')
+                else:
+                    printer_count += 1
+                    printer_parts.append((source, part, f'xl/printerSettings/printerSettings{printer_count}.bin'))
+                    overrides.append((f'/xl/printerSettings/printerSettings{printer_count}.bin',
+                                      CONTENT_TYPES['printerSettings']))
+                    rels.append(f'<Relationship Id={quoteattr(rel_id)} Type={quoteattr(rel_type)} '
+                                f'Target="../printerSettings/printerSettings{printer_count}.bin"/>')
+            if rels:
+                sheet_rels[idx] = (f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_NS}">'
+                                   f'{"".join(rels)}</Relationships>').encode('utf-8')
+        rel_idx = len(items) + 1
+        workbook_rels.append((f'rId{rel_idx}', 'styles', 'styles.xml'))
+        if strings.items:
+            rel_idx += 1
+            workbook_rels.append((f'rId{rel_idx}', 'sharedStrings', 'sharedStrings.xml'))
+            overrides.append(('/xl/sharedStrings.xml', CONTENT_TYPES['sharedStrings']))
+        if theme_source:
+            rel_idx += 1
+            workbook_rels.append((f'rId{rel_idx}', 'theme', 'theme/theme1.xml'))
+            overrides.append(('/xl/theme/theme1.xml', CONTENT_TYPES['theme']))
+
+        content_types = (
+            f'{XML_DECLARATION}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            + ''.join(f'<Override PartName="{name}" ContentType="{content_type}"/>' for name, content_type in overrides)
+            + '</Types>'
+        ).encode('utf-8')
+        root_rels = (
+            f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+        ).encode('utf-8')
+        date1904 = ' date1904="1"' if epoch == CALENDAR_MAC_1904 else ''
+        names = ''.join(defined_names)
+        workbook = (
+            f'{XML_DECLARATION}<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+            f'<workbookPr{date1904}/><bookViews><workbookView activeTab="0"/></bookViews>'
+            f'<sheets>{"".join(sheets_xml)}</sheets>'
+            + (f'<definedNames>{names}</definedNames>' if names else '')
+            + '<calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>'
+        ).encode('utf-8')
+        workbook_rels_xml = (
+            f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_REL_NS}">'
+            + ''.join(f'<Relationship Id="{rel_id}" Type="{REL_NS}/{rel_type}" Target="{target}"/>'
+                      for rel_id, rel_type, target in workbook_rels)
+            + '</Relationships>'
+        ).encode('utf-8')
+
+        def write_part(writer, name, data):
+            writer.write_stream(zipfile.ZipInfo(name, now), lambda write: write(data))
+
+        tmp_file = target_file.with_name(target_file.name + ".tmp")
+        raw_sources = {}
+        try:
+            with open(tmp_file, 'wb') as out:
+                writer = ZipStreamWriter(out)
+                write_part(writer, '[Content_Types].xml', content_types)
+                write_part(writer, '_rels/.rels', root_rels)
+                write_part(writer, 'xl/workbook.xml', workbook)
+                write_part(writer, 'xl/_rels/workbook.xml.rels', workbook_rels_xml)
+                write_part(writer, 'xl/styles.xml', styles.to_xml())
+                if strings.items:
+                    write_part(writer, 'xl/sharedStrings.xml', strings.to_xml())
+                for source, *_ in items:
+                    raw_sources[source] = open(source.excel_file, 'rb')
+                if theme_source:
+                    writer.copy_raw(raw_sources[theme_source], theme_source.zin.getinfo(theme_source.package.theme_path),
+                                    'xl/theme/theme1.xml')
+                for idx, (source, xf_map, dxf_map, string_map) in enumerate(items, 1):
+                    _write_sheet(writer, raw_sources[source], source, f'xl/worksheets/sheet{idx}.xml', idx == 1,
+                                 xf_map, dxf_map, string_map)
+                    if idx in sheet_rels:
+                        write_part(writer, f'xl/worksheets/_rels/sheet{idx}.xml.rels', sheet_rels[idx])
+                for source, part, name in printer_parts:
+                    writer.copy_raw(raw_sources[source], source.zin.getinfo(part), name)
+                writer.close()
+        except BaseException:
+            if tmp_file.exists():
+                tmp_file.unlink()
+            raise
+        finally:
+            for raw_source in raw_sources.values():
+                raw_source.close()
+        os.replace(tmp_file, target_file)
+        return len(items)
+    finally:
+        for zin in zips:
+            zin.close()
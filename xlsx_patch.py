@@ -0,0 +1,920 @@
+"""
+Engine "vá XML" cho process_single_excel: sửa trực tiếp sheet XML bên trong file xlsx
+thay vì load_workbook/save dựng lại toàn bộ object model và style.
+- Đọc sheet XML dạng stream, chỉ lấy giá trị các cột bộ rule cần (shared string chỉ giải mã cho các ô đó)
+- Áp dụng cùng bộ rule (excel_rules.RuleSet) lên một sheet "ảo" chứa các cột đã đọc
+- Ghi lại sheet (ẩn dòng, xóa ô, ẩn cột/độ rộng cột, cố định tiêu đề) và styles.xml nếu cần,
+  các file khác trong zip được chép nguyên byte
+Gặp cấu trúc không hỗ trợ (công thức ở cột rule đọc, ô thiếu tọa độ...) thì raise PatchUnsupported
+để process_single_excel chuyển sang engine openpyxl.
+"""
+
+import os
+import re
+import html
+import time
+import zlib
+import struct
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from bisect import bisect_right
+from pathlib import Path
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+
+from excel_rules import autofit_width
+
+CHUNK_SIZE = 1 << 20
+
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+_SHEET_DATA_START_RE = re.compile(rb'<((?:[\w.-]+:)?)sheetData\b[^>]*?(/?)>')
+_SHEET_DATA_END_RE = re.compile(rb'</(?:[\w.-]+:)?sheetData\s*>')
+_ROW_RE = re.compile(rb'<((?:[\w.-]+:)?row)\b([^>]*?)(?:/>|>(.*?)</\1\s*>)', re.S)
+_CELL_RE = re.compile(
+    rb'<((?:[\w.-]+:)?c)\b(?=[^>]*?\br=["\']([A-Z]+)\d+["\'])([^>]*?)(?:/>|>(.*?)</\1\s*>)', re.S)
+# Ô dạng thường gặp (không tiền tố, thuộc tính r s t theo thứ tự), đọc nhanh hơn _CELL_RE ở lượt lấy giá trị
+_PLAIN_CELL_RE = re.compile(
+    rb'<c r="([A-Z]+)\d+"(?: s="(\d+)")?(?: t="(\w+)")?(?:/>|>(?:<v>([^<]+)</v>|<is><t>([^<]+)</t></is>|(.*?))</c>)',
+    re.S)
+_ANY_CELL_RE = re.compile(rb'<(?:[\w.-]+:)?c\b')
+_ATTR_RE = re.compile(r'([\w:.-]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+_ROW_NUM_RE = re.compile(rb'\br=["\'](\d+)["\']')
+_HIDDEN_RE = re.compile(rb'\bhidden=["\'](?:1|true)["\']')
+_TYPE_RE = re.compile(rb'\bt=["\'](\w+)["\']')
+_STYLE_RE = re.compile(rb'\bs=["\'](\d+)["\']')
+_VALUE_RE = re.compile(rb'<(?:[\w.-]+:)?v>(.*?)</(?:[\w.-]+:)?v\s*>', re.S)
+_FORMULA_RE = re.compile(rb'<(?:[\w.-]+:)?f\b')
+_TEXT_RE = re.compile(rb'<(?:[\w.-]+:)?t(?:\s[^>]*)?>(.*?)</(?:[\w.-]+:)?t\s*>', re.S)
+_PHONETIC_RE = re.compile(rb'<((?:[\w.-]+:)?rPh)\b.*?</\1\s*>', re.S)
+_MERGE_RE = re.compile(rb'<(?:[\w.-]+:)?mergeCell\b[^>]*?\bref=["\']([^"\']+)["\']')
+_ENCODING_RE = re.compile(rb'^\s*<\?xml[^>]*encoding=["\']([\w-]+)["\']')
+
+
+class PatchUnsupported(Exception):
+    """
+    File có cấu trúc engine vá XML không xử lý được -> dùng engine openpyxl
+    """
+
+
+class _RowDimension:
+    __slots__ = ('hidden',)
+
+    def __init__(self, hidden=False):
+        self.hidden = hidden
+
+
+class _RowDimensions(dict):
+    def __missing__(self, row_num):
+        dimension = self[row_num] = _RowDimension()
+        return dimension
+
+
+class _CellValue:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class PatchSheet:
+    """
+    Sheet "ảo" cho excel_rules.RuleSet: giá trị các cột đã đọc (theo số dòng), trạng thái ẩn dòng,
+    ghi nhận các dòng bị xóa dữ liệu
+    """
+    def __init__(self, columns, hidden_rows, max_row, max_column):
+        self.columns = columns  # cột -> list giá trị, chỉ số = số dòng
+        self.row_dimensions = _RowDimensions()
+        for row_num in hidden_rows:
+            self.row_dimensions[row_num] = _RowDimension(True)
+        self.cleared = {}       # dòng -> (từ cột, tới cột)
+        self.max_row = max_row
+        self.max_column = max_column
+
+    def cell(self, row, column):
+        values = self.columns.get(column)
+        return _CellValue(values[row] if values is not None and row < len(values) else None)
+
+    def column_values(self, col, start_row, end_row):
+        return list(self.columns[col][start_row:end_row + 1])
+
+    def clear_row(self, row_num, from_col, to_col):
+        if row_num in self.cleared:
+            old_from, old_to = self.cleared[row_num]
+            from_col, to_col = min(from_col, old_from), max(to_col, old_to)
+        self.cleared[row_num] = (from_col, to_col)
+        for col, values in self.columns.items():
+            if from_col <= col <= to_col and row_num < len(values):
+                values[row_num] = None
+
+    def hidden_rows(self):
+        return {row_num for row_num, dimension in self.row_dimensions.items() if dimension.hidden}
+
+
+class _Styles:
+    """
+    Thông tin styles.xml cần cho engine: định dạng ngày của từng xf và các xf có wrapText
+    """
+    def __init__(self, xml_bytes):
+        self.xml = xml_bytes
+        self.date_xfs = set()
+        self.timedelta_xfs = set()
+        self.wrap_xfs = set()
+        self.xf_count = 0
+        if xml_bytes is None:
+            return
+
+        root = ET.fromstring(xml_bytes)
+        custom = {}
+        for element in root.iter():
+            if _local(element.tag) == 'numFmt':
+                custom[int(element.get('numFmtId'))] = element.get('formatCode')
+        cell_xfs = next((element for element in root if _local(element.tag) == 'cellXfs'), None)
+        if cell_xfs is None:
+            return
+        for idx, xf in enumerate(element for element in cell_xfs if _local(element.tag) == 'xf'):
+            num_fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom[num_fmt_id] if num_fmt_id in custom else BUILTIN_FORMATS.get(num_fmt_id)
+            if is_date_format(fmt):
+                self.date_xfs.add(idx)
+            if is_timedelta_format(fmt):
+                self.timedelta_xfs.add(idx)
+            for child in xf:
+                if _local(child.tag) == 'alignment' and child.get('wrapText') in ('1', 'true'):
+                    self.wrap_xfs.add(idx)
+            self.xf_count = idx + 1
+
+    def without_wrap(self, xf_ids):
+        """
+        Thêm vào cellXfs bản sao các xf (bỏ wrapText) -> (styles.xml mới, {xf cũ: xf mới})
+        """
+        text = self.xml.decode('utf-8')
+        match = re.search(r'<((?:[\w.-]+:)?cellXfs)\b([^>]*)>(.*?)</\1\s*>', text, re.S)
+        if match is None:
+            raise PatchUnsupported("styles.xml không có cellXfs")
+        xfs = re.findall(r'<(?:[\w.-]+:)?xf\b[^>]*?(?:/>|>.*?</(?:[\w.-]+:)?xf\s*>)', match.group(3), re.S)
+        if len(xfs) != self.xf_count:
+            raise PatchUnsupported("Không đọc được cellXfs")
+
+        style_map = {}
+        added = []
+        for xf_id in sorted(xf_ids):
+            xf = re.sub(r'(<(?:[\w.-]+:)?alignment\b[^>]*?)\s+wrapText=["\'](?:1|true)["\']', r'\1', xfs[xf_id])
+            if 'applyAlignment' not in xf:
+                xf = re.sub(r'^(<(?:[\w.-]+:)?xf\b)', r'\1 applyAlignment="1"', xf)
+            style_map[xf_id] = len(xfs) + len(added)
+            added.append(xf)
+            # Bản sao giữ định dạng số: ô đã đổi sang xf mới vẫn đọc ra ngày tháng (giá trị cho sink)
+            if xf_id in self.date_xfs:
+                self.date_xfs.add(style_map[xf_id])
+            if xf_id in self.timedelta_xfs:
+                self.timedelta_xfs.add(style_map[xf_id])
+
+        attrs = re.sub(r'\bcount=["\']\d+["\']', '', match.group(2)).rstrip()
+        attrs += f' count="{len(xfs) + len(added)}"'
+        new_block = f'<{match.group(1)}{attrs}>{match.group(3)}{"".join(added)}</{match.group(1)}>'
+        new_text = text[:match.start()] + new_block + text[match.end():]
+        return new_text.encode('utf-8'), style_map
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1].rsplit(':', 1)[-1]
+
+
+def _unescape(raw):
+    # Giống XML parser: chuẩn hóa xuống dòng rồi giải mã entity
+    text = raw.decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return html.unescape(text) if '&' in text else text
+
+
+def _cast_number(text):
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+class XlsxPackage:
+    """
+    Đường dẫn các phần trong file xlsx: sheet đang active (như wb.active), sharedStrings, styles, theme
+    """
+    def __init__(self, zin):
+        names = set(zin.namelist())
+        rels = ET.fromstring(zin.read('_rels/.rels'))
+        workbook_path = next(
+            (rel.get('Target').lstrip('/') for rel in rels
+             if rel.get('Type', '').endswith('/officeDocument')), 'xl/workbook.xml')
+        workbook = ET.fromstring(zin.read(workbook_path))
+        workbook_dir = posixpath.dirname(workbook_path)
+        workbook_rels_path = posixpath.join(workbook_dir, '_rels', posixpath.basename(workbook_path) + '.rels')
+        targets = {}
+        types = {}
+        for rel in ET.fromstring(zin.read(workbook_rels_path)):
+            target = rel.get('Target', '')
+            target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(
+                posixpath.join(workbook_dir, target))
+            targets[rel.get('Id')] = target
+            types[rel.get('Id')] = rel.get('Type', '')
+
+        self.epoch = CALENDAR_WINDOWS_1900
+        active = 0
+        sheets = []
+        for element in workbook.iter():
+            tag = _local(element.tag)
+            if tag == 'workbookPr' and element.get('date1904') in ('1', 'true'):
+                self.epoch = CALENDAR_MAC_1904
+            elif tag == 'workbookView' and not active and element.get('activeTab') is not None:
+                active = int(element.get('activeTab'))
+            elif tag == 'sheet':
+                rel_id = next((value for key, value in element.attrib.items() if key.endswith('}id')), None)
+                sheets.append((element.get('state'), rel_id))
+        if not sheets or active >= len(sheets):
+            raise PatchUnsupported("Không xác định được sheet active")
+        state, rel_id = sheets[active]
+        if state not in (None, 'visible') or not types.get(rel_id, '').endswith('/worksheet'):
+            raise PatchUnsupported("Sheet active không phải worksheet hiển thị")
+
+        self.workbook_path = workbook_path
+        self.workbook = workbook
+        self.rel_types = set(types.values())
+        self.active = active
+        self.sheet_path = targets[rel_id]
+        self.strings_path = next((targets[key] for key, value in types.items()
+                                  if value.endswith('/sharedStrings')), None)
+        self.styles_path = next((targets[key] for key, value in types.items()
+                                 if value.endswith('/styles')), None)
+        self.theme_path = next((targets[key] for key, value in types.items()
+                                if value.endswith('/theme')), None)
+        for path in (self.sheet_path, self.strings_path, self.styles_path, self.theme_path):
+            if path is not None and path not in names:
+                raise PatchUnsupported(f"Thiếu {path} trong file")
+
+
+class _SheetScan:
+    """
+    Lượt đọc thứ nhất của sheet XML: phần đầu (trước sheetData), vị trí từng dòng,
+    giá trị thô của các cột cần đọc, dòng đang ẩn, kích thước sheet, vùng merge
+    """
+    def __init__(self, stream, loaded_cols, style_cols, wrap_xfs):
+        self.loaded_cols = loaded_cols
+        self.style_cols = style_cols      # Cột cần bỏ wrapText (autofit_columns)
+        self.wrap_xfs = wrap_xfs
+        self.raw_values = {col: {} for col in loaded_cols}  # cột -> {dòng: (t, nội dung, s)}
+        self.row_offsets = []             # [(dòng, vị trí byte)] theo thứ tự trong file
+        self.hidden_rows = set()
+        self.style_rows = set()           # Dòng có ô ở style_cols dùng xf có wrapText
+        self.wrap_styles_used = set()
+        self.string_indices = set()
+        self.max_row = 0
+        self.max_column = 0
+        self.letters = {}
+        self._scan(stream)
+
+    def _column(self, letters):
+        col = self.letters.get(letters)
+        if col is None:
+            col = self.letters[letters] = column_index_from_string(letters.decode('ascii'))
+        return col
+
+    def _scan(self, stream):
+        buffer = b''
+        offset = 0  # Vị trí byte của buffer[0] trong sheet XML
+        while True:
+            match = _SHEET_DATA_START_RE.search(buffer)
+            if match:
+                break
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                raise PatchUnsupported("Không tìm thấy sheetData")
+            buffer += chunk
+        encoding = _ENCODING_RE.match(buffer)
+        if encoding and encoding.group(1).lower() not in (b'utf-8', b'utf8'):
+            raise PatchUnsupported("Sheet XML không phải UTF-8")
+        if match.group(2):
+            raise PatchUnsupported("Sheet không có dữ liệu")
+        self.prefix = match.group(1).decode('ascii')
+        self.header = buffer[:match.start()]
+        self.sheet_data_tag_end = match.end()
+
+        buffer = buffer[match.end():]
+        offset = match.end()
+        while True:
+            end_match = _SHEET_DATA_END_RE.search(buffer)
+            limit = end_match.start() if end_match else len(buffer)
+            consumed = 0
+            for row_match in _ROW_RE.finditer(buffer, 0, limit):
+                self._scan_row(row_match, offset)
+                consumed = row_match.end()
+            if end_match:
+                if buffer[consumed:limit].strip():
+                    raise PatchUnsupported("Không đọc được dòng trong sheetData")
+                self.sheet_data_end = offset + end_match.start()
+                trailer = buffer[end_match.end():]
+                break
+            buffer = buffer[consumed:]
+            offset += consumed
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                raise PatchUnsupported("Sheet XML bị cắt ngang")
+            buffer += chunk
+
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            trailer += chunk
+        self.merged = [ref.decode('ascii') for ref in _MERGE_RE.findall(trailer)]
+        # openpyxl tạo MergedCell cho cả vùng merge nên kích thước sheet tính tới góc dưới phải của vùng
+        for ref in self.merged:
+            _, _, max_col, max_row = range_boundaries(ref)
+            self.max_row = max(self.max_row, max_row)
+            self.max_column = max(self.max_column, max_col)
+
+    def _scan_row(self, row_match, offset):
+        attrs = row_match.group(2)
+        row_num = _ROW_NUM_RE.search(attrs)
+        if row_num is None:
+            raise PatchUnsupported("Dòng thiếu thuộc tính r")
+        row_num = int(row_num.group(1))
+        self.row_offsets.append((row_num, offset + row_match.start()))
+        if _HIDDEN_RE.search(attrs):
+            self.hidden_rows.add(row_num)
+
+        content = row_match.group(3)
+        if not content:
+            return
+        cells = _CELL_RE.findall(content)
+        if len(cells) != len(_ANY_CELL_RE.findall(content)):
+            raise PatchUnsupported("Ô thiếu tọa độ")
+        if not cells:
+            return
+        if row_num > self.max_row:
+            self.max_row = row_num
+        last_col = self._column(cells[-1][1])
+        if last_col > self.max_column:
+            self.max_column = last_col
+
+        loaded_cols = self.loaded_cols
+        for _, letters, cell_attrs, cell_content in cells:
+            col = self.letters.get(letters) or self._column(letters)
+            if col not in loaded_cols:
+                continue
+            style = _STYLE_RE.search(cell_attrs)
+            style = int(style.group(1)) if style else 0
+            if col in self.style_cols and style in self.wrap_xfs:
+                self.style_rows.add(row_num)
+                self.wrap_styles_used.add(style)
+            if not cell_content:
+                continue
+            if _FORMULA_RE.search(cell_content):
+                raise PatchUnsupported("Có công thức ở cột rule đọc")
+            data_type = _TYPE_RE.search(cell_attrs)
+            data_type = data_type.group(1).decode('ascii') if data_type else 'n'
+            if data_type == 'inlineStr':
+                text = b''.join(_TEXT_RE.findall(_PHONETIC_RE.sub(b'', cell_content)))
+                self.raw_values[col][row_num] = (data_type, text, style)
+                continue
+            value = _VALUE_RE.search(cell_content)
+            if value is None or not value.group(1):
+                continue
+            if data_type == 's':
+                self.string_indices.add(int(value.group(1)))
+            self.raw_values[col][row_num] = (data_type, value.group(1), style)
+
+
+def _si_text(element):
+    """
+    Nội dung một phần tử <si> của sharedStrings.xml (nối các đoạn rich text, bỏ phần phiên âm)
+    """
+    snippets = []
+    for child in element:
+        tag = _local(child.tag)
+        if tag == 't':
+            snippets.append(child.text or '')
+        elif tag == 'r':
+            snippets.extend(t.text or '' for t in child if _local(t.tag) == 't')
+    return ''.join(snippets).replace('x005F_', '')
+
+
+def _read_shared_strings(zin, path, indices):
+    """
+    Chỉ giải mã các shared string có trong indices (các ô thuộc cột rule đọc), indices = None: tất cả
+    """
+    strings = {}
+    if path is None or (indices is not None and not indices):
+        return strings
+    last = max(indices) if indices is not None else None
+    idx = 0
+    with zin.open(path) as source:
+        for _, element in ET.iterparse(source):
+            if _local(element.tag) != 'si':
+                continue
+            if indices is None or idx in indices:
+                strings[idx] = _si_text(element)
+            element.clear()
+            idx += 1
+            if last is not None and idx > last:
+                break
+    return strings
+
+
+def _typed_value(data_type, raw, style, strings, styles, epoch):
+    """
+    Giá trị ô giống openpyxl khi load_workbook (số, chuỗi, bool, ngày tháng theo định dạng ô)
+    """
+    if data_type == 'n':
+        value = _cast_number(raw.decode('ascii'))
+        if style in styles.date_xfs:
+            try:
+                return from_excel(value, epoch, timedelta=style in styles.timedelta_xfs)
+            except (OverflowError, ValueError):
+                return "#VALUE!"
+        return value
+    if data_type == 's':
+        return strings[int(raw)]
+    if data_type == 'b':
+        return bool(int(raw))
+    if data_type == 'd':
+        return from_ISO8601(raw.decode('ascii'))
+    return _unescape(raw)
+
+
+def _cell_value(cell_attrs, cell_content, strings, styles, epoch):
+    """
+    Giá trị một ô theo thuộc tính và nội dung thẻ <c> (None nếu ô không có giá trị)
+    """
+    if not cell_content:
+        return None
+    data_type = _TYPE_RE.search(cell_attrs)
+    data_type = data_type.group(1).decode('ascii') if data_type else 'n'
+    if data_type == 'inlineStr':
+        raw = b''.join(_TEXT_RE.findall(_PHONETIC_RE.sub(b'', cell_content)))
+    else:
+        raw = _VALUE_RE.search(cell_content)
+        if raw is None or not raw.group(1):
+            return None
+        raw = raw.group(1)
+    style = _STYLE_RE.search(cell_attrs)
+    style = int(style.group(1)) if style else 0
+    return _typed_value(data_type, raw, style, strings, styles, epoch)
+
+
+def _row_values(content, col_count, letters, strings, styles, epoch):
+    """
+    Giá trị tất cả các ô của một dòng (cho sink: excel_sidecar, excel_cache): list theo cột,
+    ô có công thức lấy giá trị đã tính lưu trong file
+    """
+    values = [None] * col_count
+    if not content:
+        return values
+    cells = _PLAIN_CELL_RE.findall(content)
+    if not cells or len(cells) != content.count(b'<c'):
+        # Thẻ có tiền tố / thuộc tính khác thứ tự thường gặp: đọc từng ô theo cách tổng quát
+        for _, cell_letters, cell_attrs, cell_content in _CELL_RE.findall(content):
+            col = letters.get(cell_letters)
+            if col is None:
+                col = letters[cell_letters] = column_index_from_string(cell_letters.decode('ascii'))
+            if col <= col_count:
+                values[col - 1] = _cell_value(cell_attrs, cell_content, strings, styles, epoch)
+        return values
+    for cell_letters, style, data_type, raw, text, other in cells:
+        col = letters.get(cell_letters)
+        if col is None:
+            col = letters[cell_letters] = column_index_from_string(cell_letters.decode('ascii'))
+        if col > col_count:
+            continue
+        raw = raw or text
+        if raw:
+            values[col - 1] = _typed_value(data_type.decode('ascii') if data_type else 'n', raw,
+                                           int(style) if style else 0, strings, styles, epoch)
+        elif other:
+            # Công thức, rich text, <v>/<t> rỗng...
+            attrs = (b' s="' + style + b'"' if style else b'') + (b' t="' + data_type + b'"' if data_type else b'')
+            values[col - 1] = _cell_value(attrs, other, strings, styles, epoch)
+    return values
+
+
+class _ByteStream:
+    """
+    Đọc tuần tự sheet XML ở lượt ghi: chép nguyên byte tới vị trí cần sửa, lấy ra phần tử cần sửa
+    """
+    def __init__(self, source, write):
+        self.source = source
+        self.write = write
+        self.buffer = b''
+        self.pos = 0     # Vị trí đang đọc trong buffer
+        self.offset = 0  # Vị trí byte của buffer[0]
+
+    def _fill(self):
+        chunk = self.source.read(CHUNK_SIZE)
+        if not chunk:
+            raise PatchUnsupported("Sheet XML thay đổi giữa hai lượt đọc")
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def copy_to(self, position):
+        while self.offset + len(self.buffer) < position:
+            self.write(self.buffer[self.pos:])
+            self.pos = len(self.buffer)
+            self._fill()
+        cut = position - self.offset
+        self.write(self.buffer[self.pos:cut])
+        self.pos = cut
+
+    def skip(self, length):
+        while len(self.buffer) - self.pos < length:
+            self._fill()
+        self.pos += length
+
+    def take_row(self):
+        while True:
+            match = _ROW_RE.match(self.buffer, self.pos)
+            if match:
+                self.pos = match.end()
+                return match
+            self._fill()
+
+    def copy_rest(self):
+        self.write(self.buffer[self.pos:])
+        while True:
+            chunk = self.source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.write(chunk)
+
+
+def _set_attr(attrs, name, value):
+    """
+    Đặt/ghi đè thuộc tính trong chuỗi thuộc tính của thẻ XML (giữ nguyên các thuộc tính khác)
+    """
+    pattern = re.compile(rb'\s' + name + rb'=["\'][^"\']*["\']')
+    new = b' ' + name + b'="' + value + b'"'
+    if pattern.search(attrs):
+        return pattern.sub(lambda _: new, attrs, count=1)
+    return attrs.rstrip() + new
+
+
+def _remove_attrs(attrs, names):
+    for name in names:
+        attrs = re.sub(rb'\s' + name + rb'=["\'][^"\']*["\']', b'', attrs)
+    return attrs
+
+
+def _patch_row(row_match, hide, clear, style_map, style_cols, letters):
+    """
+    Viết lại một phần tử <row>: thêm hidden="1", xóa giá trị ô trong khoảng clear, đổi style bỏ wrapText
+    """
+    qname, attrs, content = row_match.group(1), row_match.group(2), row_match.group(3)
+    if hide:
+        attrs = _set_attr(attrs, b'hidden', b'1')
+    if content is None:
+        return b'<' + qname + attrs + b'/>'
+
+    if clear or style_map:
+        def patch_cell(match):
+            cell_qname, cell_letters, cell_attrs, cell_content = match.groups()
+            col = letters.get(cell_letters) or column_index_from_string(cell_letters.decode('ascii'))
+            changed = False
+            if style_map and col in style_cols:
+                style = _STYLE_RE.search(cell_attrs)
+                style = int(style.group(1)) if style else 0
+                if style in style_map:
+                    cell_attrs = _set_attr(cell_attrs, b's', str(style_map[style]).encode('ascii'))
+                    changed = True
+            if clear and clear[0] <= col <= clear[1] and cell_content:
+                # Ô bị xóa giữ lại style, bỏ kiểu dữ liệu/giá trị/công thức
+                return b'<' + cell_qname + _remove_attrs(cell_attrs, (b't', b'cm', b'vm')) + b'/>'
+            if not changed:
+                return match.group(0)
+            if cell_content is None:
+                return b'<' + cell_qname + cell_attrs + b'/>'
+            return b'<' + cell_qname + cell_attrs + b'>' + cell_content + b'</' + cell_qname + b'>'
+
+        content = _CELL_RE.sub(patch_cell, content)
+    return b'<' + qname + attrs + b'>' + content + b'</' + qname + b'>'
+
+
+def _pane_xml(prefix, top_left_cell, old_selection_attrs):
+    """
+    <pane> + <selection> giống ws.freeze_panes = top_left_cell của openpyxl
+    """
+    row, column = coordinate_to_tuple(top_left_cell)
+    pane = {'topLeftCell': top_left_cell, 'activePane': 'topRight', 'state': 'frozen'}
+    selection_pane = 'topRight'
+    if column > 1:
+        pane['xSplit'] = str(column - 1)
+    if row > 1:
+        pane['ySplit'] = str(row - 1)
+        pane['activePane'] = selection_pane = 'bottomLeft'
+        if column > 1:
+            pane['activePane'] = selection_pane = 'bottomRight'
+    order = ('xSplit', 'ySplit', 'topLeftCell', 'activePane', 'state')
+    pane_attrs = ''.join(f' {key}="{pane[key]}"' for key in order if key in pane)
+
+    selection_attrs = [(key, value) for key, value in old_selection_attrs if key != 'pane']
+    if not old_selection_attrs:
+        selection_attrs = [('activeCell', '"A1"'), ('sqref', '"A1"')]
+    selections = ''
+    if row > 1 and column > 1:
+        selections += f'<{prefix}selection pane="topRight"/><{prefix}selection pane="bottomLeft"/>'
+    selections += f'<{prefix}selection pane="{selection_pane}"' + ''.join(
+        f' {key}={value}' for key, value in selection_attrs) + '/>'
+    return f'<{prefix}pane{pane_attrs}/>' + selections
+
+
+def _patch_sheet_views(header, prefix, freeze_panes):
+    """
+    Đặt vùng cố định tiêu đề trong sheetView đầu tiên (thêm sheetViews nếu chưa có)
+    """
+    match = re.search(r'<((?:[\w.-]+:)?sheetView)\b([^>]*?)(?:/>|>(.*?)</\1\s*>)', header, re.S)
+    if match is None:
+        pane = _pane_xml(prefix, freeze_panes, [])
+        views = f'<{prefix}sheetViews><{prefix}sheetView workbookViewId="0">{pane}</{prefix}sheetView></{prefix}sheetViews>'
+        anchor = re.search(r'<(?:[\w.-]+:)?(?:sheetFormatPr|cols)\b', header)
+        position = anchor.start() if anchor else len(header)
+        return header[:position] + views + header[position:]
+
+    qname, attrs, inner = match.group(1), match.group(2), match.group(3) or ''
+    selection = re.search(r'<(?:[\w.-]+:)?selection\b([^>]*?)/?>', inner)
+    old_selection_attrs = _ATTR_RE.findall(selection.group(1)) if selection else []
+    rest = re.sub(r'<((?:[\w.-]+:)?(?:pane|selection))\b[^>]*?(?:/>|>.*?</\1\s*>)', '', inner, flags=re.S)
+    new_view = f'<{qname}{attrs}>{_pane_xml(prefix, freeze_panes, old_selection_attrs)}{rest}</{qname}>'
+    return header[:match.start()] + new_view + header[match.end():]
+
+
+def _patch_cols(header, prefix, max_column, hidden_cols, widths):
+    """
+    Viết lại <cols>: ẩn các cột hidden_cols, đặt độ rộng autofit, giữ thuộc tính cột có sẵn
+    """
+    match = re.search(r'<((?:[\w.-]+:)?cols)\b[^>]*?(?:/>|>(.*?)</\1\s*>)', header, re.S)
+    segments = []  # [min, max, {thuộc tính}]
+    if match and match.group(2):
+        for col_attrs in re.findall(r'<(?:[\w.-]+:)?col\b([^>]*?)/?>', match.group(2)):
+            attrs = {key: value[1:-1] for key, value in _ATTR_RE.findall(col_attrs)}
+            segments.append([int(attrs.pop('min')), int(attrs.pop('max')), attrs])
+
+    limit = max(max_column, max(widths, default=0), max(hidden_cols, default=0))
+    per_column = {}
+    tail = []
+    for start, end, attrs in segments:
+        for col in range(start, min(end, limit) + 1):
+            per_column[col] = dict(attrs)
+        if end > limit:
+            tail.append([max(start, limit + 1), end, attrs])
+    for col in hidden_cols:
+        per_column.setdefault(col, {})['hidden'] = '1'
+    for col, width in widths.items():
+        attrs = per_column.setdefault(col, {})
+        attrs['width'] = f'{float(width):g}'
+        attrs['customWidth'] = '1'
+
+    ranges = []
+    for col in sorted(per_column):
+        if ranges and ranges[-1][1] == col - 1 and ranges[-1][2] == per_column[col]:
+            ranges[-1][1] = col
+        else:
+            ranges.append([col, col, per_column[col]])
+    ranges.extend(tail)
+    cols = ''.join(
+        f'<{prefix}col min="{start}" max="{end}"' + ''.join(
+            f' {key}="{html.escape(value, quote=True)}"' for key, value in attrs.items()) + '/>'
+        for start, end, attrs in ranges
+    )
+    block = f'<{prefix}cols>{cols}</{prefix}cols>' if cols else ''
+    if match:
+        return header[:match.start()] + block + header[match.end():]
+    return header + block
+
+
+class ZipStreamWriter:
+    """
+    Ghi file zip mới: file sửa được nén lại, các file còn lại chép nguyên byte đã nén từ file gốc
+    """
+    def __init__(self, out):
+        self.out = out
+        self.entries = []
+
+    @staticmethod
+    def _dos_time(date_time):
+        year, month, day, hour, minute, second = date_time
+        return ((year - 1980) << 9 | month << 5 | day), (hour << 11 | minute << 5 | second // 2)
+
+    def _local_header(self, info, flags, crc, compress_size, file_size, name):
+        dos_date, dos_time = self._dos_time(info.date_time)
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, flags, info.compress_type, dos_time, dos_date,
+                           crc, compress_size, file_size, len(name), 0) + name
+
+    @staticmethod
+    def _name(filename):
+        try:
+            return filename.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return filename.encode('utf-8'), 0x800
+
+    def copy_raw(self, source, info, filename=None):
+        """
+        Chép nguyên byte đã nén của một file trong zip nguồn (filename: tên mới trong zip đích)
+        """
+        if info.flag_bits & 0x1:
+            raise PatchUnsupported("File zip được mã hóa")
+        source.seek(info.header_offset)
+        header = source.read(30)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        source.seek(info.header_offset + 30 + name_length + extra_length)
+        remaining = info.compress_size
+        name, name_flag = self._name(filename or info.filename)
+        flags = (info.flag_bits & ~0x08 & ~0x800) | name_flag
+        offset = self.out.tell()
+        self.out.write(self._local_header(info, flags, info.CRC, info.compress_size, info.file_size, name))
+        while remaining:
+            data = source.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise PatchUnsupported("File zip bị cắt ngang")
+            self.out.write(data)
+            remaining -= len(data)
+        self.entries.append((info, name, flags, info.compress_type, info.CRC, info.compress_size, info.file_size, offset))
+
+    def write_stream(self, info, produce, level=6):
+        """
+        produce(write): ghi nội dung mới (chưa nén) qua hàm write
+        """
+        name, name_flag = self._name(info.filename)
+        flags = 0x08 | name_flag  # Kích thước/CRC ghi sau dữ liệu (data descriptor)
+        offset = self.out.tell()
+        compress_info = zipfile.ZipInfo(info.filename, info.date_time)
+        compress_info.compress_type = zipfile.ZIP_DEFLATED
+        self.out.write(self._local_header(compress_info, flags, 0, 0, 0, name))
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        state = {'crc': 0, 'size': 0, 'compressed': 0}
+
+        def write(data):
+            if not data:
+                return
+            state['crc'] = zlib.crc32(data, state['crc'])
+            state['size'] += len(data)
+            compressed = compressor.compress(data)
+            state['compressed'] += len(compressed)
+            self.out.write(compressed)
+
+        produce(write)
+        compressed = compressor.flush()
+        state['compressed'] += len(compressed)
+        self.out.write(compressed)
+        if state['size'] > 0xFFFFFFFF or state['compressed'] > 0xFFFFFFFF:
+            raise PatchUnsupported("Sheet quá lớn cho zip thường")
+        self.out.write(struct.pack('<IIII', 0x08074b50, state['crc'], state['compressed'], state['size']))
+        self.entries.append((info, name, flags, zipfile.ZIP_DEFLATED, state['crc'],
+                             state['compressed'], state['size'], offset))
+
+    def close(self):
+        start = self.out.tell()
+        for info, name, flags, method, crc, compress_size, file_size, offset in self.entries:
+            dos_date, dos_time = self._dos_time(info.date_time)
+            self.out.write(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (info.create_system << 8) | 20, 20, flags, method,
+                dos_time, dos_date, crc, compress_size, file_size, len(name), 0, 0, 0,
+                info.internal_attr, info.external_attr, offset) + name)
+        size = self.out.tell() - start
+        if len(self.entries) > 0xFFFF or start > 0xFFFFFFFF:
+            raise PatchUnsupported("File zip quá lớn")
+        self.out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self.entries), len(self.entries),
+                                   size, start, 0))
+
+
+def patch_excel_file(excel_file, rule_set, sinks=()):
+    """
+    Áp dụng bộ rule lên file bằng cách vá XML (cùng kết quả với engine openpyxl của process_single_excel).
+    sinks (excel_sidecar.SidecarWriter, excel_cache.ReportCacheWriter): nhận giá trị các dòng đã xử lý
+    ngay trong lượt ghi - begin(số cột), wants(dòng, ẩn), add_row(dòng, giá trị, ẩn, khoảng cột bị xóa).
+    Trả về (thống kê rule như RuleSet.run, {bước: giây}); raise PatchUnsupported nếu cần dùng openpyxl.
+    """
+    excel_file = Path(excel_file)
+    timings = {}
+    started = time.perf_counter()
+
+    with zipfile.ZipFile(excel_file) as zin:
+        package = XlsxPackage(zin)
+        styles = _Styles(zin.read(package.styles_path) if package.styles_path else None)
+        style_cols = set(rule_set.autofit_columns)
+        rule_cols = set().union(*(rule.columns for rule in rule_set.rules))
+        loaded_cols = rule_cols | style_cols
+
+        with zin.open(package.sheet_path) as source:
+            scan = _SheetScan(source, loaded_cols, style_cols, styles.wrap_xfs)
+        strings = _read_shared_strings(zin, package.strings_path, scan.string_indices)
+
+        # Giá trị các cột đã đọc; ô không phải ô đầu của vùng merge luôn rỗng (như MergedCell)
+        columns = {col: [None] * (scan.max_row + 1) for col in loaded_cols}
+        for col, raw_values in scan.raw_values.items():
+            values = columns[col]
+            for row_num, (data_type, raw, style) in raw_values.items():
+                values[row_num] = _typed_value(data_type, raw, style, strings, styles, package.epoch)
+        scan.raw_values = None
+        for ref in scan.merged:
+            min_col, min_row, max_col, max_row = range_boundaries(ref)
+            for col in loaded_cols:
+                if min_col <= col <= max_col:
+                    values = columns[col]
+                    for row_num in range(min_row, max_row + 1):
+                        if (row_num, col) != (min_row, min_col):
+                            values[row_num] = None
+        timings['read'] = time.perf_counter() - started
+
+        # B1 -> B7
+        started = time.perf_counter()
+        sheet = PatchSheet(columns, scan.hidden_rows, scan.max_row, scan.max_column)
+        rule_stats = rule_set.run(sheet, scan.max_row, scan.max_column)
+        timings['rules'] = time.perf_counter() - started
+
+        # B8 -> B10
+        started = time.perf_counter()
+        max_column = scan.max_column
+        hidden_cols = [col for col in range(1, max_column + 1) if rule_set.column_is_hidden(col, max_column)]
+        widths = {col: autofit_width(columns[col]) for col in rule_set.autofit_columns}
+        new_styles, style_map = None, {}
+        if scan.wrap_styles_used:
+            new_styles, style_map = styles.without_wrap(scan.wrap_styles_used)
+
+        prefix = scan.prefix
+        header = scan.header.decode('utf-8')
+        if rule_set.freeze_panes and rule_set.freeze_panes != 'A1':
+            header = _patch_sheet_views(header, prefix, rule_set.freeze_panes)
+        header = _patch_cols(header, prefix, max_column, hidden_cols, widths).encode('utf-8')
+
+        all_hidden = sheet.hidden_rows()
+        hidden_rows = all_hidden - scan.hidden_rows
+        existing_rows = [row_num for row_num, _ in scan.row_offsets]
+        edit_rows = hidden_rows | set(sheet.cleared) | (scan.style_rows if style_map else set())
+        taken_rows = edit_rows
+        if sinks:
+            # Dòng đưa vào sink cũng được tách ra ở lượt ghi để đọc giá trị (cần tất cả shared string)
+            for sink in sinks:
+                sink.begin(max_column)
+            all_strings = _read_shared_strings(zin, package.strings_path, None)
+            taken_rows = edit_rows | {row_num for row_num in existing_rows
+                                      if any(sink.wants(row_num, row_num in all_hidden) for sink in sinks)}
+        edits = [(offset, 1, row_num) for row_num, offset in scan.row_offsets if row_num in taken_rows]
+        # Dòng cần ẩn nhưng chưa có trong XML (dòng trống): chèn thẻ <row> trước dòng kế tiếp
+        existing = set(existing_rows)
+        sorted_rows = sorted(existing_rows)
+        offsets = dict(scan.row_offsets)
+        for row_num in sorted(hidden_rows - existing):
+            position = bisect_right(sorted_rows, row_num)
+            offset = offsets[sorted_rows[position]] if position < len(sorted_rows) else scan.sheet_data_end
+            edits.append((offset, 0, row_num))
+        edits.sort()
+
+        tmp_file = excel_file.with_name(excel_file.name + ".tmp")
+        try:
+            with open(excel_file, 'rb') as raw_source, open(tmp_file, 'wb') as out:
+                writer = ZipStreamWriter(out)
+                for info in zin.infolist():
+                    if info.filename == package.sheet_path:
+                        def produce(write):
+                            with zin.open(info) as source:
+                                stream = _ByteStream(source, write)
+                                stream.skip(len(scan.header))
+                                write(header)
+                                for offset, kind, row_num in edits:
+                                    stream.copy_to(offset)
+                                    if kind == 0:
+                                        write(f'<{prefix}row r="{row_num}" hidden="1"/>'.encode('utf-8'))
+                                        for sink in sinks:
+                                            if sink.wants(row_num, True):
+                                                sink.add_row(row_num, [], True)
+                                    else:
+                                        row_match = stream.take_row()
+                                        row_xml = row_match.group(0)
+                                        cleared = sheet.cleared.get(row_num)
+                                        if row_num in edit_rows:
+                                            row_xml = _patch_row(row_match, row_num in hidden_rows, cleared,
+                                                                 style_map, style_cols, scan.letters)
+                                        write(row_xml)
+                                        hidden = row_num in all_hidden
+                                        wanted = [sink for sink in sinks if sink.wants(row_num, hidden)]
+                                        if wanted:
+                                            if row_num in edit_rows:
+                                                row_match = _ROW_RE.match(row_xml)
+                                            values = _row_values(row_match.group(3), max_column, scan.letters,
+                                                                 all_strings, styles, package.epoch)
+                                            for sink in wanted:
+                                                sink.add_row(row_num, values, hidden, cleared)
+                                stream.copy_rest()
+                        writer.write_stream(info, produce)
+                    elif new_styles is not None and info.filename == package.styles_path:
+                        writer.write_stream(info, lambda write: write(new_styles))
+                    else:
+                        writer.copy_raw(raw_source, info)
+                writer.close()
+        except BaseException:
+            if tmp_file.exists():
+                tmp_file.unlink()
+            raise
+    os.replace(tmp_file, excel_file)
+    timings['write'] = time.perf_counter() - started
+    return rule_stats, timings
@@ -0,0 +1,491 @@
+"""
+Engine "stream" cho file rất lớn: như engine vá XML (xlsx_patch) nhưng bộ nhớ không tăng theo số dòng.
+- Không giữ giá trị các cột trong bộ nhớ: đọc sheet XML theo chunk, áp dụng bộ rule từng dòng một
+  (excel_rules.RowEvaluator) ngay khi đọc tới dòng đó
+- Shared string ghi ra file tạm và tra theo chỉ số (mmap), không nạp cả bảng chuỗi
+- Ba lượt đọc tuần tự sheet XML:
+  1. kích thước sheet (dòng/cột cuối có dữ liệu) và vùng merge
+  2. áp dụng rule để tính độ rộng cột autofit và style cần bỏ wrapText (phải ghi trong <cols> trước dữ liệu)
+  3. áp dụng lại rule (cùng kết quả) và ghi sheet mới: ẩn dòng, xóa ô, cột, cố định tiêu đề
+Phần đầu sheet (dòng tiêu đề, style, dòng đang ẩn, merge...) và các file khác trong zip giữ nguyên như engine vá XML.
+Bộ nhớ tối đa cỡ vài lần CHUNK_SIZE cộng với một dòng dữ liệu, không phụ thuộc số dòng của file.
+"""
+
+import os
+import re
+import mmap
+import time
+import struct
+import zipfile
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.cell import range_boundaries
+
+from excel_rules import RowEvaluator, AutofitMeter
+from xlsx_patch import (
+    PatchUnsupported, XlsxPackage, ZipStreamWriter, CHUNK_SIZE, _Styles,
+    _SHEET_DATA_START_RE, _SHEET_DATA_END_RE, _ROW_RE, _CELL_RE, _ANY_CELL_RE, _ROW_NUM_RE, _HIDDEN_RE,
+    _TYPE_RE, _STYLE_RE, _VALUE_RE, _FORMULA_RE, _TEXT_RE, _PHONETIC_RE, _MERGE_RE, _ENCODING_RE,
+    _local, _si_text, _typed_value, _row_values, _patch_row, _patch_sheet_views, _patch_cols,
+)
+
+_CELL_REF_RE = re.compile(rb'<(?:[\w.-]+:)?c\b[^>]*?\br=["\']([A-Z]+)(\d+)["\']')
+_OFFSET = struct.Struct('<Q')
+
+
+def use_streaming(excel_file, rule_set):
+    """
+    Có dùng engine stream cho file này không: writer = "stream", hoặc writer = "auto"
+    và sheet XML (chưa nén) từ stream_min_mb trở lên
+    """
+    if rule_set.writer == 'stream':
+        return True
+    if rule_set.writer != 'auto':
+        return False
+    try:
+        with zipfile.ZipFile(excel_file) as zin:
+            sheet_size = zin.getinfo(XlsxPackage(zin).sheet_path).file_size
+    except (PatchUnsupported, zipfile.BadZipFile, KeyError, ET.ParseError):
+        return False
+    return sheet_size >= rule_set.stream_min_mb * (1 << 20)
+
+
+class _StringStore:
+    """
+    Shared string lưu trong file tạm: nội dung UTF-8 nối tiếp + bảng vị trí 8 byte mỗi chuỗi.
+    Tra theo chỉ số qua mmap nên RAM không tăng theo số chuỗi; chỉ đọc sharedStrings.xml khi cần lần đầu
+    """
+    def __init__(self, zin, path):
+        self.zin = zin
+        self.path = path
+        self.files = None
+        self.data = None
+        self.offsets = None
+
+    def _load(self):
+        data_file = tempfile.TemporaryFile()
+        offsets_file = tempfile.TemporaryFile()
+        self.files = (data_file, offsets_file)
+        position = 0
+        offsets_file.write(_OFFSET.pack(0))
+        with self.zin.open(self.path) as source:
+            root = None
+            for event, element in ET.iterparse(source, events=('start', 'end')):
+                if root is None:
+                    root = element
+                if event != 'end' or _local(element.tag) != 'si':
+                    continue
+                text = _si_text(element).encode('utf-8')
+                data_file.write(text)
+                position += len(text)
+                offsets_file.write(_OFFSET.pack(position))
+                # Bỏ phần tử đã đọc khỏi cây (iterparse vẫn giữ các phần tử con của gốc)
+                root.clear()
+        data_file.flush()
+        offsets_file.flush()
+        self.offsets = mmap.mmap(offsets_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) if position else b''
+
+    def __getitem__(self, idx):
+        if self.offsets is None:
+            if self.path is None:
+                raise PatchUnsupported("Thiếu sharedStrings.xml")
+            self._load()
+        if idx < 0 or (idx + 2) * _OFFSET.size > len(self.offsets):
+            raise PatchUnsupported("Chỉ số shared string không hợp lệ")
+        start, = _OFFSET.unpack_from(self.offsets, idx * _OFFSET.size)
+        end, = _OFFSET.unpack_from(self.offsets, (idx + 1) * _OFFSET.size)
+        return self.data[start:end].decode('utf-8')
+
+    def close(self):
+        for mapped in (self.data, self.offsets):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        for f in self.files or ():
+            f.close()
+
+
+def _read_sheet_header(source):
+    """
+    Đọc sheet XML tới hết thẻ <sheetData> -> (phần đầu sheet, prefix namespace, thẻ sheetData, phần đã đọc sau thẻ)
+    """
+    buffer = b''
+    while True:
+        match = _SHEET_DATA_START_RE.search(buffer)
+        if match:
+            break
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            raise PatchUnsupported("Không tìm thấy sheetData")
+        buffer += chunk
+    encoding = _ENCODING_RE.match(buffer)
+    if encoding and encoding.group(1).lower() not in (b'utf-8', b'utf8'):
+        raise PatchUnsupported("Sheet XML không phải UTF-8")
+    if match.group(2):
+        raise PatchUnsupported("Sheet không có dữ liệu")
+    return buffer[:match.start()], match.group(1).decode('ascii'), match.group(0), buffer[match.end():]
+
+
+class _SheetOutline:
+    """
+    Lượt đọc thứ nhất: dòng/cột cuối có dữ liệu hoặc thuộc vùng merge (như ws.max_row/max_column) và các vùng merge,
+    chỉ dùng regex trên từng chunk (không tách từng dòng)
+    """
+    def __init__(self, source):
+        self.max_row = 0
+        self.max_column = 0
+        self.merged = []
+        max_letters = b''
+
+        _, self.prefix, _, buffer = _read_sheet_header(source)
+        in_data = True
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            buffer += chunk
+            # Chỉ xét tới trước thẻ đóng cuối cùng: các thẻ mở phía trước đã đọc đủ
+            cut = buffer.rfind(b'</') if chunk else len(buffer)
+            if cut <= 0 and chunk:
+                continue
+            region, buffer = buffer[:cut], buffer[cut:]
+            if in_data:
+                end_match = _SHEET_DATA_END_RE.search(region)
+                data = region[:end_match.start()] if end_match else region
+                refs = _CELL_REF_RE.findall(data)
+                if len(refs) != len(_ANY_CELL_RE.findall(data)):
+                    raise PatchUnsupported("Ô thiếu tọa độ")
+                if refs:
+                    self.max_row = max(self.max_row, max(int(row) for _, row in refs))
+                    letters = max((letters for letters, _ in refs), key=lambda text: (len(text), text))
+                    if (len(letters), letters) > (len(max_letters), max_letters):
+                        max_letters = letters
+                if end_match:
+                    in_data = False
+                    region = region[end_match.end():]
+            if not in_data:
+                self.merged.extend(ref.decode('ascii') for ref in _MERGE_RE.findall(region))
+            if not chunk:
+                break
+        if in_data:
+            raise PatchUnsupported("Sheet XML bị cắt ngang")
+        if max_letters:
+            self.max_column = column_index_from_string(max_letters.decode('ascii'))
+        # Dòng/cột chỉ có trong vùng merge vẫn tính (như MergedCell của openpyxl), rule áp dụng cả cho các dòng này
+        for ref in self.merged:
+            _, _, max_col, max_row = range_boundaries(ref)
+            self.max_row = max(self.max_row, max_row)
+            self.max_column = max(self.max_column, max_col)
+
+
+class _RowStream:
+    """
+    Đọc sheet XML theo chunk, lần lượt trả về ('raw', bytes) cho phần nằm giữa các dòng,
+    ('row', match) cho từng phần tử <row>, ('end', bytes) cho phần từ </sheetData> tới hết file.
+    Phần đầu sheet (trước <sheetData>) ở self.header
+    """
+    def __init__(self, source):
+        self.source = source
+        self.header, self.prefix, self.sheet_data_tag, self.buffer = _read_sheet_header(source)
+
+    def __iter__(self):
+        yield 'raw', self.sheet_data_tag
+        buffer = self.buffer
+        self.buffer = None
+        while True:
+            end_match = _SHEET_DATA_END_RE.search(buffer)
+            limit = end_match.start() if end_match else len(buffer)
+            consumed = 0
+            for row_match in _ROW_RE.finditer(buffer, 0, limit):
+                if row_match.start() > consumed:
+                    yield 'raw', buffer[consumed:row_match.start()]
+                yield 'row', row_match
+                consumed = row_match.end()
+            if end_match:
+                if buffer[consumed:limit].strip():
+                    raise PatchUnsupported("Không đọc được dòng trong sheetData")
+                yield 'end', buffer[consumed:]
+                break
+            buffer = buffer[consumed:]
+            chunk = self.source.read(CHUNK_SIZE)
+            if not chunk:
+                raise PatchUnsupported("Sheet XML bị cắt ngang")
+            buffer += chunk
+        while True:
+            chunk = self.source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield 'end', chunk
+
+
+class _StreamRow:
+    """
+    Dòng đang xét cho RowEvaluator: giá trị các cột đã đọc, khoảng cột bị xóa, style wrapText ở cột autofit
+    """
+    __slots__ = ('values', 'cleared', 'wrap_styles')
+
+    def __init__(self, values, wrap_styles=()):
+        self.values = values
+        self.cleared = None
+        self.wrap_styles = wrap_styles
+
+    def value(self, col):
+        return self.values.get(col)
+
+    def clear(self, from_col, to_col):
+        if self.cleared:
+            from_col, to_col = min(from_col, self.cleared[0]), max(to_col, self.cleared[1])
+        self.cleared = (from_col, to_col)
+        for col in self.values:
+            if from_col <= col <= to_col:
+                self.values[col] = None
+
+
+class _SheetReader:
+    """
+    Đọc và áp dụng bộ rule cho từng dòng của sheet (dùng cho lượt 2 và 3), chỉ giữ dòng đang xét
+    """
+    def __init__(self, rule_set, outline, styles, strings, epoch):
+        self.rule_set = rule_set
+        self.outline = outline
+        self.styles = styles
+        self.strings = strings
+        self.epoch = epoch
+        self.style_cols = set(rule_set.autofit_columns)
+        self.loaded_cols = set().union(*(rule.columns for rule in rule_set.rules)) | self.style_cols
+        self.hide_rows = set(rule_set.hide_rows)
+        self.letters = {}
+        # Vùng merge chứa cột cần đọc: ô không phải ô đầu vùng luôn rỗng (như MergedCell)
+        merges = []
+        for ref in outline.merged:
+            min_col, min_row, max_col, max_row = range_boundaries(ref)
+            cols = [col for col in self.loaded_cols if min_col <= col <= max_col]
+            if cols:
+                merges.append((min_row, max_row, min_col, cols))
+        self.merges = sorted(merges, key=lambda merge: merge[0])
+
+    def _column(self, letters):
+        col = self.letters.get(letters)
+        if col is None:
+            col = self.letters[letters] = column_index_from_string(letters.decode('ascii'))
+        return col
+
+    def _read_row(self, row_num, content, merges):
+        values = {}
+        wrap_styles = set()
+        if content:
+            loaded_cols = self.loaded_cols
+            for _, letters, cell_attrs, cell_content in _CELL_RE.findall(content):
+                col = self.letters.get(letters) or self._column(letters)
+                if col not in loaded_cols:
+                    continue
+                style = _STYLE_RE.search(cell_attrs)
+                style = int(style.group(1)) if style else 0
+                if col in self.style_cols and style in self.styles.wrap_xfs:
+                    wrap_styles.add(style)
+                if not cell_content:
+                    continue
+                if _FORMULA_RE.search(cell_content):
+                    raise PatchUnsupported("Có công thức ở cột rule đọc")
+                data_type = _TYPE_RE.search(cell_attrs)
+                data_type = data_type.group(1).decode('ascii') if data_type else 'n'
+                if data_type == 'inlineStr':
+                    raw = b''.join(_TEXT_RE.findall(_PHONETIC_RE.sub(b'', cell_content)))
+                else:
+                    raw = _VALUE_RE.search(cell_content)
+                    if raw is None or not raw.group(1):
+                        continue
+                    raw = raw.group(1)
+                values[col] = _typed_value(data_type, raw, style, self.strings, self.styles, self.epoch)
+        for min_row, _, min_col, cols in merges:
+            for col in cols:
+                if col in values and (row_num, col) != (min_row, min_col):
+                    values[col] = None
+        return _StreamRow(values, wrap_styles)
+
+    def rows(self, source, evaluator):
+        """
+        Yield (loại, dữ liệu, số dòng, dòng có ẩn sau khi áp dụng rule, _StreamRow) theo thứ tự trong file:
+        loại 'row' là dòng có trong XML, 'empty' là dòng không có trong XML nhưng cần ẩn,
+        'raw'/'end' là phần không phải dòng (chép nguyên)
+        """
+        stream = _RowStream(source)
+        yield 'header', stream.header, 0, False, None
+        rule_set = self.rule_set
+        max_row = self.outline.max_row
+        merges = self.merges
+        next_merge = 0
+        active = []
+        last_row = 0
+
+        def empty_rows(until):
+            # Dòng không có trong XML: giá trị rỗng, vẫn áp dụng rule như engine openpyxl
+            for gap_row in range(last_row + 1, until):
+                hidden = gap_row in self.hide_rows
+                if rule_set.data_start_row <= gap_row <= max_row:
+                    hidden = evaluator.evaluate(_StreamRow({}), hidden)
+                if hidden:
+                    yield 'empty', None, gap_row, True, None
+
+        for kind, data in stream:
+            if kind == 'raw':
+                yield kind, data, 0, False, None
+                continue
+            if kind == 'end':
+                if last_row is not None:
+                    yield from empty_rows(max(self.hide_rows | {max_row}) + 1)
+                    last_row = None
+                yield kind, data, 0, False, None
+                continue
+
+            attrs = data.group(2)
+            row_num = _ROW_NUM_RE.search(attrs)
+            if row_num is None:
+                raise PatchUnsupported("Dòng thiếu thuộc tính r")
+            row_num = int(row_num.group(1))
+            if row_num <= last_row:
+                raise PatchUnsupported("Dòng không theo thứ tự tăng dần")
+            yield from empty_rows(row_num)
+            last_row = row_num
+
+            while next_merge < len(merges) and merges[next_merge][0] <= row_num:
+                active.append(merges[next_merge])
+                next_merge += 1
+            if active:
+                active = [merge for merge in active if merge[1] >= row_num]
+            row = self._read_row(row_num, data.group(3), active)
+            hidden = bool(_HIDDEN_RE.search(attrs)) or row_num in self.hide_rows
+            if rule_set.data_start_row <= row_num <= max_row:
+                hidden = evaluator.evaluate(row, hidden)
+            yield kind, data, row_num, hidden, row
+
+
+def stream_excel_file(excel_file, rule_set, sinks=()):
+    """
+    Áp dụng bộ rule lên file với bộ nhớ cố định (cùng kết quả với engine vá XML / openpyxl).
+    sinks: nhận giá trị các dòng đã xử lý ở lượt ghi (như xlsx_patch.patch_excel_file).
+    Trả về (thống kê rule như RuleSet.run, {bước: giây}); raise PatchUnsupported nếu cần dùng openpyxl.
+    """
+    excel_file = Path(excel_file)
+    timings = {}
+    started = time.perf_counter()
+
+    with zipfile.ZipFile(excel_file) as zin:
+        package = XlsxPackage(zin)
+        styles = _Styles(zin.read(package.styles_path) if package.styles_path else None)
+        strings = _StringStore(zin, package.strings_path)
+        try:
+            with zin.open(package.sheet_path) as source:
+                outline = _SheetOutline(source)
+            max_column = outline.max_column
+            reader = _SheetReader(rule_set, outline, styles, strings, package.epoch)
+            timings['read'] = time.perf_counter() - started
+
+            # B1 -> B7 và số liệu cho B10 (độ rộng cột, style bỏ wrapText)
+            started = time.perf_counter()
+            evaluator = RowEvaluator(rule_set, max_column)
+            meters = {col: AutofitMeter() for col in rule_set.autofit_columns}
+            wrap_styles_used = set()
+            with zin.open(package.sheet_path) as source:
+                for kind, _, _, _, row in reader.rows(source, evaluator):
+                    if kind != 'row':
+                        continue
+                    for col, meter in meters.items():
+                        meter.add(row.values.get(col))
+                    wrap_styles_used |= row.wrap_styles
+            rule_stats = evaluator.stats()
+            timings['rules'] = time.perf_counter() - started
+
+            # B8 -> B10: ghi sheet mới, áp dụng lại bộ rule từng dòng
+            started = time.perf_counter()
+            hidden_cols = [col for col in range(1, max_column + 1) if rule_set.column_is_hidden(col, max_column)]
+            widths = {col: meter.width for col, meter in meters.items()}
+            new_styles, style_map = None, {}
+            if wrap_styles_used:
+                new_styles, style_map = styles.without_wrap(wrap_styles_used)
+            style_cols = reader.style_cols
+
+            for sink in sinks:
+                sink.begin(max_column)
+
+            def produce(write):
+                with zin.open(package.sheet_path) as source:
+                    rows = reader.rows(source, RowEvaluator(rule_set, max_column))
+                    for kind, data, row_num, hidden, row in rows:
+                        if kind == 'header':
+                            header = data.decode('utf-8')
+                            if rule_set.freeze_panes and rule_set.freeze_panes != 'A1':
+                                header = _patch_sheet_views(header, outline.prefix, rule_set.freeze_panes)
+                            write(_patch_cols(header, outline.prefix, max_column, hidden_cols, widths).encode('utf-8'))
+                        elif kind == 'empty':
+                            write(f'<{outline.prefix}row r="{row_num}" hidden="1"/>'.encode('utf-8'))
+                            for sink in sinks:
+                                if sink.wants(row_num, True):
+                                    sink.add_row(row_num, [], True)
+                        elif kind != 'row':
+                            write(data)
+                        else:
+                            row_xml = data.group(0)
+                            patched = ((hidden and not _HIDDEN_RE.search(data.group(2))) or row.cleared
+                                       or (style_map and row.wrap_styles))
+                            if patched:
+                                row_xml = _patch_row(data, hidden, row.cleared, style_map, style_cols, reader.letters)
+                            write(row_xml)
+                            wanted = [sink for sink in sinks if sink.wants(row_num, hidden)]
+                            if wanted:
+                                if patched:
+                                    data = _ROW_RE.match(row_xml)
+                                values = _row_values(data.group(3), max_column, reader.letters,
+                                                     strings, styles, package.epoch)
+                                for sink in wanted:
+                                    sink.add_row(row_num, values, hidden, row.cleared)
+
+            tmp_file = excel_file.with_name(excel_file.name + ".tmp")
+            try:
+                with open(excel_file, 'rb') as raw_source, open(tmp_file, 'wb') as out:
+                    writer = ZipStreamWriter(out)
+                    for info in zin.infolist():
+                        if info.filename == package.sheet_path:
+                            writer.write_stream(info, produce)
+                        elif new_styles is not None and info.filename == package.styles_path:
+                            writer.write_stream(info, lambda write: write(new_styles))
+                        else:
+                            writer.copy_raw(raw_source, info)
+                    writer.close()
+            except BaseException:
+                if tmp_file.exists():
+                    tmp_file.unlink()
+                raise
+        finally:
+            strings.close()
+    os.replace(tmp_file, excel_file)
+    timings['write'] = time.perf_counter() - started
+    return rule_stats, timings
+
+
+def read_sheet_rows(excel_file):
+    """
+    Đọc giá trị các dòng của sheet đang active với bộ nhớ cố định (không áp dụng rule):
+    yield (số dòng, list giá trị theo cột, dòng có ẩn) cho các dòng có trong XML.
+    Raise PatchUnsupported nếu file không đọc được theo cách này
+    """
+    with zipfile.ZipFile(excel_file) as zin:
+        package = XlsxPackage(zin)
+        styles = _Styles(zin.read(package.styles_path) if package.styles_path else None)
+        strings = _StringStore(zin, package.strings_path)
+        try:
+            with zin.open(package.sheet_path) as source:
+                max_column = _SheetOutline(source).max_column
+            letters = {}
+            with zin.open(package.sheet_path) as source:
+                for kind, data in _RowStream(source):
+                    if kind != 'row':
+                        continue
+                    attrs = data.group(2)
+                    row_num = _ROW_NUM_RE.search(attrs)
+                    if row_num is None:
+                        raise PatchUnsupported("Dòng thiếu thuộc tính r")
+                    values = _row_values(data.group(3), max_column, letters, strings, styles, package.epoch)
+                    yield int(row_num.group(1)), values, bool(_HIDDEN_RE.search(attrs))
+        finally:
+            strings.close()